@@ -1,25 +1,16 @@
 from fastapi import APIRouter, Request, Header, Form, Depends
 from fastapi.responses import HTMLResponse, RedirectResponse
-from fastapi.templating import Jinja2Templates
 from sqlalchemy import select
 from sqlalchemy.orm import Session
 from typing import Annotated, Union
 from datetime import datetime, timedelta, timezone
 from typing import Optional
-from db import Token, ClubSwimmer, get_db
-from dotenv import load_dotenv
+from db import DEFAULT_CLUB_ID, Token, ClubSwimmer, as_utc, get_db
+from templating import templates
 import bcrypt
 import secrets
-import os
 
 router = APIRouter()
-templates = Jinja2Templates(directory="templates")
-
-load_dotenv()
-pw_hash = os.getenv("PASSWORD")
-if not pw_hash:
-    raise RuntimeError("PASSWORD (bcrypt hash) is not set in .env!!!\n")
-pw = pw_hash.encode()
 
 TOKEN_LIFETIME = timedelta(hours=1)
 COOKIE_MAX_AGE = int(TOKEN_LIFETIME.total_seconds())
@@ -48,7 +39,7 @@ def verify_token(token_str: Optional[str], db: Session) -> bool:
     if not token:
         return False
 
-    expiry = token.expiry.replace(tzinfo=timezone.utc) # Just ensure UTC no matter what
+    expiry = as_utc(token.expiry) # Just ensure UTC no matter what
 
     if datetime.now(timezone.utc) > expiry:
         db.delete(token)
@@ -68,6 +59,8 @@ async def admin_login_post(
     db: Session = Depends(get_db),
     password: str = Form(...)
 ):
+    pw = request.app.state.settings.password_hash.encode()
+
     if bcrypt.checkpw(password.encode('utf-8'), pw):
         token_str = secrets.token_urlsafe(32)
         expiry = datetime.now(timezone.utc) + TOKEN_LIFETIME
@@ -208,3 +201,31 @@ async def admin_frag_view_pb_form(
     else:
         return RedirectResponse(url="/admin", status_code=302)
 
+
+@router.get(
+    "/admin/frag/live-meet-form",
+    response_class=HTMLResponse,
+    summary="Returns an html fragment for following a meet's results live",
+    description="Shows the meet followed live, if any, with a button to stop it, and a form to follow another one (posted to `/v1/live-meet`)."
+)
+async def admin_frag_live_meet_form(
+    request: Request,
+    db: Session = Depends(get_db),
+    hx_request: Annotated[Union[str, None], Header()] = None
+):
+    token = request.cookies.get("access_token")
+
+    if hx_request:
+        if verify_token(token, db):
+            return templates.TemplateResponse(
+                request=request, name="htmx/admin_live_meet_form.html",
+                context={"live": request.app.state.live_meet, "default_club_id": DEFAULT_CLUB_ID}
+            )
+        else:
+            response = templates.TemplateResponse(
+                request=request, name="htmx/admin_login.html"
+            )
+            response.headers["HX-Push-Url"] = "/admin"
+            return response
+    else:
+        return RedirectResponse(url="/admin", status_code=302)
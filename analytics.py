@@ -0,0 +1,275 @@
+from dataclasses import dataclass
+from typing import Optional
+from sqlalchemy.orm import Session
+from sqlalchemy import select, func
+from db import ClubSwimmer, ClubSwimmerPb
+import numpy as np
+import weakref
+
+@dataclass
+class RankedPb:
+    """
+    A single swimmer's standing within one club/event/course/gender group.
+
+    Attributes:
+        athlete_id (int): Primary key of the swimmer in `scwr_swimmers`.
+        sw_club_id (int): swimrankings.net id of the club the swimmer is ranked in.
+        sw_style_id (int): Style ID from swimrankings.net.
+        event (str): Event name (distance(m) stroke).
+        course (int): Course length in meters.
+        gender (int): Gender of the group (0: man, 1: woman).
+        seconds (float): The PB time in seconds.
+        rank (int): 1-based club rank, tied times share the best rank.
+        group_size (int): Number of swimmers ranked in the group.
+        percentile (float): Percentage of the group this swimmer is at least as fast as.
+        gap (float): Seconds behind the next faster swimmer (0 for the leader).
+    """
+    athlete_id: int
+    sw_club_id: int
+    sw_style_id: int
+    event: str
+    course: int
+    gender: int
+    seconds: float
+    rank: int
+    group_size: int
+    percentile: float
+    gap: float
+
+class ClubRankings:
+    """
+    Columnar club rankings over every PB in `athlete_pbs`.
+
+    Every club is ranked on its own. Rows are sorted by group and then by
+    time, so each club/event/course/gender group is a contiguous slice
+    described by `group_starts`/`group_sizes`.
+    """
+    def __init__(
+        self,
+        athlete_ids: np.ndarray,
+        club_ids: np.ndarray,
+        style_ids: np.ndarray,
+        courses: np.ndarray,
+        genders: np.ndarray,
+        seconds: np.ndarray,
+        events: np.ndarray,
+        first_names: np.ndarray,
+        last_names: np.ndarray,
+        sw_ids: np.ndarray
+    ):
+        self.athlete_ids = athlete_ids
+        self.club_ids = club_ids
+        self.style_ids = style_ids
+        self.courses = courses
+        self.genders = genders
+        self.seconds = seconds
+        self.events = events
+        self.first_names = first_names
+        self.last_names = last_names
+        self.sw_ids = sw_ids
+
+        n = len(seconds)
+        idx = np.arange(n)
+
+        group_change = np.ones(n, dtype=bool)
+        if n:
+            group_change[1:] = (
+                (club_ids[1:] != club_ids[:-1])
+                | (style_ids[1:] != style_ids[:-1])
+                | (courses[1:] != courses[:-1])
+                | (genders[1:] != genders[:-1])
+            )
+
+        self.group_starts = idx[group_change]
+        self.group_sizes = np.diff(np.append(self.group_starts, n))
+        self.group_of_row = np.cumsum(group_change) - 1
+
+        row_group_start = self.group_starts[self.group_of_row] if n else idx
+        row_group_size = self.group_sizes[self.group_of_row] if n else idx
+
+        # A new rank starts at every group boundary and every strictly slower time
+        new_rank = group_change.copy()
+        if n:
+            new_rank[1:] |= seconds[1:] != seconds[:-1]
+        rank_start = np.maximum.accumulate(np.where(new_rank, idx, 0))
+
+        self.ranks = rank_start - row_group_start + 1
+        self.group_size_of_row = row_group_size
+        self.percentiles = 100.0 * (row_group_size - self.ranks + 1) / np.maximum(row_group_size, 1)
+
+        self.gaps = np.zeros(n)
+        if n:
+            self.gaps[1:] = seconds[1:] - seconds[:-1]
+            self.gaps[group_change] = 0.0
+
+    def __len__(self) -> int:
+        return len(self.seconds)
+
+    def _row(self, i: int) -> RankedPb:
+        return RankedPb(
+            athlete_id=int(self.athlete_ids[i]),
+            sw_club_id=int(self.club_ids[i]),
+            sw_style_id=int(self.style_ids[i]),
+            event=str(self.events[i]),
+            course=int(self.courses[i]),
+            gender=int(self.genders[i]),
+            seconds=float(self.seconds[i]),
+            rank=int(self.ranks[i]),
+            group_size=int(self.group_size_of_row[i]),
+            percentile=float(self.percentiles[i]),
+            gap=float(self.gaps[i])
+        )
+
+    def for_athlete(self, athlete_id: int) -> list[RankedPb]:
+        """
+        Returns the athlete's standing in every group they have a PB in.
+        """
+        rows = np.flatnonzero(self.athlete_ids == athlete_id)
+        return [self._row(i) for i in rows]
+
+    def clubs(self) -> list[int]:
+        """
+        Returns the ids of the clubs that have ranked PBs.
+        """
+        return [int(club) for club in np.unique(self.club_ids)]
+
+    def groups(self, club: Optional[int] = None) -> list[tuple[RankedPb, list[dict]]]:
+        """
+        Returns every group (of `club` only, if given) as `(leader, table)`
+        where `table` is the ordered list of swimmers in that group, ready
+        to be rendered.
+        """
+        result = []
+        for start, size in zip(self.group_starts, self.group_sizes):
+            if club is not None and self.club_ids[start] != club:
+                continue
+            table = []
+            for i in range(start, start + size):
+                table.append({
+                    "ranked": self._row(i),
+                    "sw_id": int(self.sw_ids[i]),
+                    "first_name": str(self.first_names[i]),
+                    "last_name": str(self.last_names[i]),
+                })
+            result.append((self._row(start), table))
+        return result
+
+
+def _time_to_seconds(t) -> float:
+    return t.hour * 3600 + t.minute * 60 + t.second + t.microsecond / 1_000_000
+
+def data_version(db: Session) -> tuple:
+    """
+    Returns a cheap fingerprint of what the rankings are built from: the
+    rosters, the swimmers' details and their pbs.
+
+    Inserts and deletes change the counts and max ids. A sync that changed
+    a swimmer's pbs stamps their `pbs_changed_at` and a new name or gender
+    their `updated_at`. Bookkeeping a sync writes for every swimmer
+    (`pbs_checked_at`) touches neither, so syncs that find nothing new
+    keep the cached rankings.
+    """
+    pb_stmt = select(func.count(ClubSwimmerPb.id), func.max(ClubSwimmerPb.id))
+    swimmer_stmt = select(
+        func.count(ClubSwimmer.id),
+        func.max(ClubSwimmer.id),
+        func.max(ClubSwimmer.pbs_changed_at),
+        func.max(ClubSwimmer.updated_at)
+    )
+    return tuple(db.execute(pb_stmt).one()) + tuple(db.execute(swimmer_stmt).one())
+
+def load_rankings(db: Session) -> ClubRankings:
+    """
+    Loads every PB into columnar arrays and ranks them per
+    club/event/course/gender, so a swimmer is only compared with their own
+    club and an athlete on several rosters is ranked once in each.
+
+    If a swimmer (`sw_id`) has more than one row for the same group only
+    their fastest time is ranked.
+    """
+    stmt = (
+        select(
+            ClubSwimmerPb.athlete_id,
+            ClubSwimmer.sw_club_id,
+            ClubSwimmerPb.sw_style_id,
+            ClubSwimmerPb.course,
+            ClubSwimmer.gender,
+            ClubSwimmerPb.time,
+            ClubSwimmerPb.event,
+            ClubSwimmer.first_name,
+            ClubSwimmer.last_name,
+            ClubSwimmer.sw_id
+        )
+        .join(ClubSwimmer, ClubSwimmer.id == ClubSwimmerPb.athlete_id)
+    )
+    rows = db.execute(stmt).all()
+
+    if rows:
+        cols = list(zip(*rows))
+    else:
+        cols = [()] * 10
+
+    athlete_ids = np.array(cols[0], dtype=np.int64)
+    club_ids = np.array(cols[1], dtype=np.int64)
+    style_ids = np.array(cols[2], dtype=np.int64)
+    courses = np.array(cols[3], dtype=np.int64)
+    genders = np.array(cols[4], dtype=np.int64)
+    seconds = np.array([_time_to_seconds(t) for t in cols[5]], dtype=np.float64)
+    events = np.array(cols[6], dtype=object)
+    first_names = np.array(cols[7], dtype=object)
+    last_names = np.array(cols[8], dtype=object)
+    sw_ids = np.array(cols[9], dtype=np.int64)
+
+    # Keep each athlete's fastest row per group
+    order = np.lexsort((seconds, sw_ids, genders, courses, style_ids, club_ids))
+    keep = np.ones(len(order), dtype=bool)
+    if len(order):
+        o = order
+        keep[1:] = (
+            (club_ids[o[1:]] != club_ids[o[:-1]])
+            | (style_ids[o[1:]] != style_ids[o[:-1]])
+            | (courses[o[1:]] != courses[o[:-1]])
+            | (genders[o[1:]] != genders[o[:-1]])
+            | (sw_ids[o[1:]] != sw_ids[o[:-1]])
+        )
+    order = order[keep]
+
+    # Then sort by group and time
+    order = order[np.lexsort((seconds[order], genders[order], courses[order], style_ids[order], club_ids[order]))]
+
+    return ClubRankings(
+        athlete_ids[order],
+        club_ids[order],
+        style_ids[order],
+        courses[order],
+        genders[order],
+        seconds[order],
+        events[order],
+        first_names[order],
+        last_names[order],
+        sw_ids[order]
+    )
+
+# Keyed by engine so separate apps (e.g. tests) never share rankings
+_cache: "weakref.WeakKeyDictionary[object, tuple[tuple, ClubRankings]]" = weakref.WeakKeyDictionary()
+
+def get_rankings(db: Session) -> ClubRankings:
+    """
+    Returns the club rankings, rebuilding them only when the data version changed.
+    """
+    version = data_version(db)
+    engine = db.get_bind()
+    cached: Optional[tuple[tuple, ClubRankings]] = _cache.get(engine)
+
+    if cached is not None and cached[0] == version:
+        return cached[1]
+
+    rankings = load_rankings(db)
+    _cache[engine] = (version, rankings)
+    return rankings
+
+def fmt_seconds(seconds: float) -> str:
+    minutes, secs = divmod(seconds, 60)
+    if minutes:
+        return f"{int(minutes)}:{secs:05.2f}"
+    return f"{secs:.2f}"
@@ -1,16 +1,22 @@
 from fastapi import APIRouter, Request, Header, Security, HTTPException, status, Depends, Form
-from fastapi.responses import HTMLResponse, RedirectResponse
-from fastapi.templating import Jinja2Templates
+from fastapi.responses import HTMLResponse, RedirectResponse, Response, StreamingResponse
 from fastapi.security.api_key import APIKeyCookie
 from sqlalchemy.orm import Session
-from sqlalchemy import select, delete
-from typing import Union, Annotated
+from sqlalchemy import select
+from typing import Callable, Optional, Union, Annotated
+import asyncio
 from starlette.status import HTTP_500_INTERNAL_SERVER_ERROR
-from db import ClubSwimmer, ClubSwimmerPb, get_db
+from db import ClubSwimmer, ClubSwimmerPb, DEFAULT_CLUB_ID, get_db, retire_athletes
 from admin import verify_token
+from metrics import NAME_INDEX_LOOKUPS
+from name_index import get_name_index, remember_athletes
 from scraper import swimrankings
-from scraper.swimrankings import SwimrankingsScraper
-from datetime import time, date, datetime
+from scraper.swimrankings import PbBatch, SwimrankingsScraper
+from scraper.base_scraper import InvalidNameError, ScraperError
+from templating import templates
+from sync import SyncResult, add_club_swimmer, upsert_pbs
+from sync_events import start_sync_job
+from live import start_live_meet
 
 api_key_cookie = APIKeyCookie(name="access_token")
 
@@ -39,99 +45,88 @@ def get_api_key(db: Session = Depends(get_db), api_key: str = Security(api_key_c
     return api_key
 
 router = APIRouter(prefix="/v1", dependencies=[Depends(get_api_key)])
-templates = Jinja2Templates(directory="templates")
-
-def fmt_time(tim_e: time) -> str:
-    if tim_e.hour:
-        return tim_e.strftime("%H:%M:%S.%f")[:-3]
-    elif tim_e.minute:
-        return tim_e.strftime("%M:%S.%f")[:-3]
-    else:
-        return tim_e.strftime("%S.%f")[:-3]
-
-def fmt_date(dat_e: date) -> str:
-    return dat_e.strftime("%d-%m-%Y")
-
-templates.env.filters["fmt_time"] = fmt_time
-templates.env.filters["fmt_date"] = fmt_date
 
 @router.post(
     "/add-swimmer",
     response_class=HTMLResponse,
     summary='API endpoint to add a swimmer to db',
-    description='Fetches swimmer\'s data from swimranings.net and adds that data to the database.'
+    description='Resolves the prompted name against the local index of every athlete seen so far (accent, case and word order insensitive) and only searches swimrankings.net when it isn\'t known, then adds the swimmer and their pbs to the database. A swimmer already on the roster is left as is (no duplicate). If the name is ambiguous or the search fails, similar known names are offered instead; picking one posts its `sw_id`.'
 )
 async def api_add_swimmer(
     request: Request,
     db: Session = Depends(get_db),
     scraper: SwimrankingsScraper = Depends(swimrankings.get_scraper),
     full_name: Annotated[Union[str, None], Header(alias="HX-Prompt")] = None,
-    hx_request: Annotated[Union[str, None], Header(alias="HX-Request")] = None
+    hx_request: Annotated[Union[str, None], Header(alias="HX-Request")] = None,
+    sw_id: Annotated[Optional[int], Form()] = None
 ):
     if hx_request:
-        swimmer = None
-        try:
+        index = get_name_index(db)
+        suggestions = []
+
+        if sw_id is not None:
+            # A picked suggestion
+            swimmer = index.get(sw_id)
+            if swimmer is None:
+                raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Athlete not found")
+        else:
             if not full_name:
                 raise HTTPException(
                     status_code=status.HTTP_400_BAD_REQUEST,
                     detail="No name provided"
                 )
-            swimmer = await scraper.fetch_athlete(str(full_name))
-        except RuntimeError as e:
-            print(e)
-            raise HTTPException(
-                status_code=HTTP_500_INTERNAL_SERVER_ERROR,
-                detail="Failed to scrape swimrankings.net"
-            )
+
+            swimmer = index.resolve(full_name)
+            if swimmer is not None:
+                NAME_INDEX_LOOKUPS.inc(result="hit")
+            else:
+                suggestions = index.suggest(full_name)
+                if len(index.matches(full_name)) > 1:
+                    # Several athletes share the name, let the admin pick
+                    NAME_INDEX_LOOKUPS.inc(result="ambiguous")
+                    swimmers = db.execute(select(ClubSwimmer)).scalars().all()
+                    return templates.TemplateResponse(
+                        request=request, name="htmx/admin_view_db.html", context = {"swimmers": swimmers, "suggestions": suggestions}
+                    )
+
+                NAME_INDEX_LOOKUPS.inc(result="miss")
+                try:
+                    swimmer = await scraper.fetch_athlete(str(full_name))
+                except ScraperError as e:
+                    print(e)
+                    if not suggestions and isinstance(e, InvalidNameError):
+                        raise HTTPException(
+                            status_code=status.HTTP_400_BAD_REQUEST,
+                            detail="Name must be given as 'First, Last'"
+                        )
+                    if not suggestions:
+                        raise HTTPException(
+                            status_code=HTTP_500_INTERNAL_SERVER_ERROR,
+                            detail="Failed to scrape swimrankings.net"
+                        )
+                    swimmers = db.execute(select(ClubSwimmer)).scalars().all()
+                    return templates.TemplateResponse(
+                        request=request, name="htmx/admin_view_db.html", context = {"swimmers": swimmers, "suggestions": suggestions}
+                    )
+                remember_athletes(db, [swimmer])
 
         if swimmer:
-            swimmer = ClubSwimmer(
-                sw_id = swimmer.sw_id,
-                birth_year = swimmer.birth_year,
-                first_name = swimmer.first_name,
-                last_name = swimmer.last_name,
-                gender = swimmer.gender.value
-            )
-            db.add(swimmer)
-            db.commit()
+            swimmer, added = add_club_swimmer(db, swimmer, DEFAULT_CLUB_ID)
 
             stmt = select(ClubSwimmer)
             swimmers = db.execute(stmt).scalars().all()
 
-            pbs = await scraper.fetch_athlete_personal_bests(swimmer.sw_id)
-
-            for pb in pbs:
-                scraped_pb = ClubSwimmerPb(
-                    athlete_id = swimmer.id,
-                    sw_style_id = pb.sw_style_id,
-                    sw_result_id = pb.sw_result_id,
-                    sw_meet_id = pb.sw_meet_id,
-                    sw_default_fina = pb.sw_default_fina,
-                    event = pb.event,
-                    course = pb.course,
-                    time = pb.time,
-                    pts = pb.pts,
-                    date = pb.date,
-                    city = pb.city,
-                    meet_name = pb.meet_name,
-                    last_scraped = pb.last_scraped
-                )
-
-                stmt = select(ClubSwimmerPb).filter_by(sw_result_id=scraped_pb.sw_result_id)
-                existing = db.execute(stmt).scalar_one_or_none()
-
-                if existing is None:
-                    db.add(scraped_pb)
-                else:
-                    fields = ("athlete_id","sw_style_id","sw_meet_id","sw_default_fina","event",
-                              "course","time","pts","date","city","meet_name","last_scraped")
-
-                    for f in fields:
-                        if getattr(existing, f) != getattr(scraped_pb, f):
-                            setattr(existing, f, getattr(scraped_pb, f))
-
-            db.commit()
+            if added:
+                try:
+                    pbs = await scraper.fetch_athlete_personal_bests(swimmer.sw_id)
+                except (ScraperError, ValueError) as e:
+                    # Keep the swimmer, the next sync will pick up their pbs
+                    print(e)
+                    pbs = PbBatch()
 
+                upsert_pbs(db, swimmer, pbs, SyncResult())
+                db.commit()
+                await request.app.state.snapshots.publish_async()
 
             return templates.TemplateResponse(
                 request=request, name="htmx/admin_view_db.html", context = {"swimmers": swimmers}
@@ -152,15 +147,10 @@ async def api_remove_athlete(
     hx_request: Annotated[Union[str, None], Header(alias="HX-Request")] = None
 ):
     if hx_request:
-        stmt = select(ClubSwimmer).filter_by(id=swimmer_id)
-        swimmer = db.execute(stmt).scalar_one_or_none()
-
-        if swimmer is None:
+        if not retire_athletes(db, ClubSwimmer.id == swimmer_id):
             raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Athlete not found")
-
-        db.execute(delete(ClubSwimmerPb).filter_by(athlete_id=swimmer.id))
-        db.delete(swimmer)
         db.commit()
+        await request.app.state.snapshots.publish_async()
 
         swimmers = db.query(ClubSwimmer).all()
         return templates.TemplateResponse(
@@ -172,94 +162,121 @@ async def api_remove_athlete(
     "/sync-swimmers",
     response_class=HTMLResponse,
     summary='API endpoint to sync current swimmers in db with ones registered in swimrankings.net',
-    description='Updates the database entries of the swimmers based on what gets scraped from swimrankings.net. If a new swimmer appears, they get added to the db. If one disappears, they are removed from the db.'
+    description='Updates the database entries of the swimmers of every club in `sync_targets` based on what gets scraped from swimrankings.net and waits for it to finish. Clubs are synced concurrently under one shared rate limit. If a new swimmer appears, they get added to the db. If one disappears, they are removed from the db. Runs as the app\'s background sync job, so a sync that is already running is joined instead of starting a second one.'
 )
 async def api_sync_swimmers(
     request: Request,
     db: Session = Depends(get_db),
-    scraper: SwimrankingsScraper = Depends(swimrankings.get_scraper),
+    scraper_factory: Callable[[], SwimrankingsScraper] = Depends(swimrankings.get_scraper_factory),
     hx_request: Annotated[Union[str, None], Header()] = None
 ):
     if hx_request:
-        try:
-            swimmers = await scraper.fetch_club_athletes()
-        except RuntimeError as e:
-            print(e)
+        job = start_sync_job(request.app, scraper_factory)
+        # Shielded: a client giving up mustn't cancel a sync others may follow
+        await asyncio.shield(job.task)
+        result = job.result
+
+        if result is None or (result.failed_clubs and not result.swimmers):
             raise HTTPException(
                 status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
                 detail="Failed to scrape swimrankings"
             )
-        if swimmers:
-            for swimmer in swimmers:
-                stmt = select(ClubSwimmer).filter_by(sw_id=swimmer.sw_id)
-                db_swimmer = db.execute(stmt).scalar_one_or_none()
-                if not db_swimmer:
-                    swimmer = ClubSwimmer(
-                        sw_id = swimmer.sw_id,
-                        birth_year = swimmer.birth_year,
-                        first_name = swimmer.first_name,
-                        last_name = swimmer.last_name,
-                        gender = swimmer.gender.value
-                    )
-
-                    db.add(swimmer)
-                    db.commit()
-            
-            # wish there was a cleaner way of doing this
-            sw_ids = []
-            for swimmer in swimmers:
-                sw_ids.append(swimmer.sw_id)
 
-            stmt = delete(ClubSwimmer).where(ClubSwimmer.sw_id.notin_(sw_ids))
-            db.execute(stmt)
-            db.commit()
+        stmt = select(ClubSwimmer)
+        swimmers = db.execute(stmt).scalars().all()
 
-            stmt = select(ClubSwimmer)
-            swimmers = db.execute(stmt).scalars().all()
-
-            for swimmer in swimmers:
-                pbs = await scraper.fetch_athlete_personal_bests(swimmer.sw_id)
-
-                for pb in pbs:
-                    scraped_pb = ClubSwimmerPb(
-                        athlete_id = swimmer.id,
-                        sw_style_id = pb.sw_style_id,
-                        sw_result_id = pb.sw_result_id,
-                        sw_meet_id = pb.sw_meet_id,
-                        sw_default_fina = pb.sw_default_fina,
-                        event = pb.event,
-                        course = pb.course,
-                        time = pb.time,
-                        pts = pb.pts,
-                        date = pb.date,
-                        city = pb.city,
-                        meet_name = pb.meet_name,
-                        last_scraped = pb.last_scraped
-                    )
-
-                    stmt = select(ClubSwimmerPb).filter_by(sw_result_id=scraped_pb.sw_result_id)
-                    existing = db.execute(stmt).scalar_one_or_none()
+        return templates.TemplateResponse(
+            request=request, name="htmx/admin_view_db.html", context = {"swimmers": swimmers, "failed": result.failed}
+        )
+    else:
+        return RedirectResponse(
+            "/", status_code=status.HTTP_403_FORBIDDEN
+        )
 
-                    if existing is None:
-                        db.add(scraped_pb)
-                    else:
-                        fields = ("athlete_id","sw_style_id","sw_meet_id","sw_default_fina","event",
-                                  "course","time","pts","date","city","meet_name","last_scraped")
+@router.post(
+    "/sync-swimmers/job",
+    response_class=HTMLResponse,
+    summary='Starts a sync in the background',
+    description='Starts a sync of every club in `sync_targets` in the background, or joins the one already running, and returns an html fragment following its progress through `/v1/sync-swimmers/events`.'
+)
+async def api_sync_swimmers_job(
+    request: Request,
+    scraper_factory: Callable[[], SwimrankingsScraper] = Depends(swimrankings.get_scraper_factory),
+    hx_request: Annotated[Union[str, None], Header()] = None
+):
+    if hx_request:
+        start_sync_job(request.app, scraper_factory)
+        return templates.TemplateResponse(
+            request=request, name="htmx/admin_sync_progress.html"
+        )
+    else:
+        return RedirectResponse('/admin/view-db', status_code=302)
 
-                        for f in fields:
-                            if getattr(existing, f) != getattr(scraped_pb, f):
-                                setattr(existing, f, getattr(scraped_pb, f))
+@router.get(
+    "/sync-swimmers/events",
+    summary='Server-sent events with the progress of a background sync',
+    description='Streams a `progress` event per athlete of the background sync (started with `POST /v1/sync-swimmers/job`), carrying the progress line plus out-of-band swaps of only the rows that changed, and a final `done` event. Never starts a sync: without one it answers 204. Reconnecting with `Last-Event-ID` resumes the stream.'
+)
+async def api_sync_swimmer_events(
+    request: Request,
+    last_event_id: Annotated[Union[str, None], Header(alias="Last-Event-ID")] = None
+):
+    job = request.app.state.sync_job
+    start = None
+    if job is not None:
+        start = job.parse_event_id(last_event_id) if last_event_id else 0
 
-                db.commit()
+    if start is None:
+        # No sync (or a reconnect to one that's gone), 204 stops the browser retrying
+        return Response(status_code=status.HTTP_204_NO_CONTENT)
 
+    return StreamingResponse(
+        job.stream(start),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
 
-            return templates.TemplateResponse(
-                request=request, name="htmx/admin_view_db.html", context = {"swimmers": swimmers}
-            )
+@router.post(
+    "/live-meet",
+    response_class=HTMLResponse,
+    summary='Follows a meet\'s results live',
+    description='Starts polling the club results page of meet `sw_meet_id` in the background (stopping any other meet followed live) and pushes new results to the meets page as they appear. The poll interval backs off while nothing changes and drops back when new results come in.'
+)
+async def api_live_meet(
+    request: Request,
+    scraper_factory: Callable[[], SwimrankingsScraper] = Depends(swimrankings.get_scraper_factory),
+    sw_meet_id: int = Form(...),
+    sw_club_id: int = Form(DEFAULT_CLUB_ID),
+    hx_request: Annotated[Union[str, None], Header()] = None
+):
+    if hx_request:
+        live = start_live_meet(request.app, scraper_factory, sw_meet_id, sw_club_id)
+        return templates.TemplateResponse(
+            request=request, name="htmx/admin_live_meet_form.html", context={"live": live}
+        )
     else:
-        return RedirectResponse(
-            "/", status_code=status.HTTP_403_FORBIDDEN
+        return RedirectResponse('/admin/view-db', status_code=302)
+
+@router.post(
+    "/live-meet/stop",
+    response_class=HTMLResponse,
+    summary='Stops following a meet live',
+    description='Stops the live results polling; the results stored so far are kept.'
+)
+async def api_live_meet_stop(
+    request: Request,
+    hx_request: Annotated[Union[str, None], Header()] = None
+):
+    if hx_request:
+        live = request.app.state.live_meet
+        if live is not None:
+            live.stop()
+        return templates.TemplateResponse(
+            request=request, name="htmx/admin_live_meet_form.html",
+            context={"live": live, "default_club_id": DEFAULT_CLUB_ID}
         )
+    else:
+        return RedirectResponse('/admin/view-db', status_code=302)
 
 @router.post(
     "/get-swimmer-pbs",
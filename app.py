@@ -1,16 +1,123 @@
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import asynccontextmanager
+from typing import Optional
 from fastapi import FastAPI
-from fastapi.staticfiles import StaticFiles
 from pages import router as pages_router
 from api import router as api_router
 from admin import router as admin_router
 from htmx import router as htmx_router
+from settings import Settings
+from assets import AssetFiles, load_assets
+from db import make_engine, make_session_factory, init_db
+from snapshots import SnapshotStore
+from scraper.archive import PageArchive
+from templating import make_templates, precompile_templates
+from metrics import router as metrics_router, instrument_engine, metrics_middleware
+from tracing import make_tracer, tracing_middleware
+from profiling import QueryProfilerMiddleware
+from compression import CompressionMiddleware
+import multiprocessing
+import profiling
+import tracing
 
-app = FastAPI()
+def create_app(settings: Optional[Settings] = None) -> FastAPI:
+    """
+    Builds a new app instance with its own engine and session factory.
 
-app.mount("/static", StaticFiles(directory="static"), name="static")
+    Nothing touches the database until the lifespan starts, where the schema
+    is created. Passing `Settings(db_location="sqlite://", ...)` gives a fully
+    isolated in-memory app. Templates, static assets and the tracer belong to
+    the app too, so several apps can live in one process. Served with
+    `uvicorn --factory app:create_app`; nothing is built at import time.
 
-# Mount routers
-app.include_router(pages_router)
-app.include_router(api_router)
-app.include_router(admin_router)
-app.include_router(htmx_router)
+    Args:
+        settings (Optional[Settings]): App configuration, read from `.env` when omitted.
+
+    Returns:
+        FastAPI: The configured app
+    """
+    if settings is None:
+        settings = Settings.from_env()
+
+    engine = make_engine(settings.db_location, settings.db_pool_size, settings.db_max_overflow)
+    instrument_engine(engine)
+    tracer = make_tracer(settings)
+    if tracer.enabled:
+        tracing.instrument_engine(engine)
+    templates = make_templates(settings)
+    assets = load_assets(settings)
+    instruments = [instrument_engine]
+    if settings.sql_profiling:
+        instruments.append(profiling.instrument_engine)
+    if tracer.enabled:
+        instruments.append(tracing.instrument_engine)
+    snapshots = SnapshotStore(engine, settings.snapshot_dir, instruments=instruments)
+
+    @asynccontextmanager
+    async def lifespan(app: FastAPI):
+        init_db(engine)
+        # Whatever changed while the server was down (or before the first
+        # start) goes live before the first request
+        snapshots.publish()
+        if not settings.debug:
+            # Warm the template cache so the first page isn't paying for it
+            precompile_templates(templates.env)
+        if settings.parse_workers > 0:
+            # spawn, not fork: the workers only need the parser, not a copy
+            # of the server's threads, sockets and connection pool
+            app.state.parse_pool = ProcessPoolExecutor(
+                settings.parse_workers, mp_context=multiprocessing.get_context("spawn")
+            )
+        yield
+        if app.state.sync_job is not None and app.state.sync_job.task is not None:
+            app.state.sync_job.task.cancel()
+        if app.state.live_meet is not None and app.state.live_meet.task is not None:
+            app.state.live_meet.task.cancel()
+        if app.state.parse_pool is not None:
+            app.state.parse_pool.shutdown(cancel_futures=True)
+            app.state.parse_pool = None
+        snapshots.close()
+        engine.dispose()
+        tracer.shutdown()
+
+    app = FastAPI(lifespan=lifespan)
+    app.state.settings = settings
+    app.state.engine = engine
+    app.state.session_factory = make_session_factory(engine)
+    app.state.snapshots = snapshots
+    app.state.assets = assets
+    app.state.templates = templates
+    app.state.tracer = tracer
+    app.state.parse_pool = None
+    app.state.page_archive = PageArchive(settings.page_archive_dir) if settings.page_archive_dir else None
+    app.state.sync_job = None
+    app.state.live_meet = None
+
+    app.middleware("http")(metrics_middleware)
+    app.middleware("http")(tracing_middleware)
+    if settings.sql_profiling:
+        profiling.instrument_engine(engine)
+        app.add_middleware(
+            QueryProfilerMiddleware,
+            budget=settings.query_budget,
+            budgets=settings.query_budgets,
+            strict=settings.query_budget_strict
+        )
+    if settings.compress_min_size is not None:
+        # Added last so it wraps everything, including the profiler's headers
+        app.add_middleware(
+            CompressionMiddleware,
+            minimum_size=settings.compress_min_size,
+            gzip_level=settings.compress_gzip_level,
+            brotli_quality=settings.compress_brotli_quality
+        )
+    app.mount("/static", AssetFiles(directory="static", assets=assets), name="static")
+
+    # Mount routers
+    app.include_router(pages_router)
+    app.include_router(api_router)
+    app.include_router(admin_router)
+    app.include_router(htmx_router)
+    app.include_router(metrics_router)
+
+    return app
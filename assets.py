@@ -0,0 +1,231 @@
+from dataclasses import asdict, dataclass
+from typing import Callable, Optional
+from starlette.datastructures import Headers
+from starlette.exceptions import HTTPException
+from starlette.responses import FileResponse, Response
+from starlette.staticfiles import NotModifiedResponse, StaticFiles
+from jinja2 import pass_context
+from starlette.types import Scope
+from settings import Settings
+import anyio
+import gzip
+import hashlib
+import json
+import mimetypes
+import os
+
+try:
+    import brotli
+except ImportError: # optional, without it only gzip variants are built
+    brotli = None
+
+SOURCE_DIR = "static"
+MANIFEST = "manifest.json"
+# Fingerprinted URLs change whenever the content does, so they never need revalidating
+IMMUTABLE = "public, max-age=31536000, immutable"
+# Everything else may change under the same URL, browsers revalidate with the ETag
+REVALIDATE = "no-cache"
+# Worth compressing; images, audio and fonts already are
+COMPRESSIBLE = {".css", ".js", ".mjs", ".svg", ".json", ".txt", ".html", ".xml", ".map"}
+# Preferred first when the client accepts several
+SUFFIXES = {"br": ".br", "gzip": ".gz"}
+
+@dataclass
+class Asset:
+    """
+    One built static file.
+
+    Attributes:
+        path (str): Fingerprinted path relative to the build directory, e.g. `css/index.3f2a1b9c0d.css`.
+        encodings (list[str]): Pre-encoded variants next to it (`br`, `gzip`), best first.
+    """
+    path: str
+    encodings: list[str]
+
+class AssetManifest:
+    """
+    The built static files one app serves, as listed in the manifest
+    `build_assets` writes. Empty means plain, unhashed `/static/...` files.
+
+    Attributes:
+        build_dir (Optional[str]): Directory the built files are in.
+        assets (dict[str, Asset]): Built files, keyed by path relative to `static/`.
+        hashed (dict[str, Asset]): The same, keyed by fingerprinted path.
+    """
+    def __init__(self, build_dir: Optional[str] = None, assets: Optional[dict[str, Asset]] = None):
+        self.build_dir = build_dir
+        self.assets = assets or {}
+        self.hashed = {asset.path: asset for asset in self.assets.values()}
+
+    def url(self, path: str) -> str:
+        asset = self.assets.get(path)
+        return f"/static/{asset.path if asset is not None else path}"
+
+def _write(path: str, data: bytes) -> None:
+    if os.path.exists(path):
+        return # same name, same content
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+
+def _compressors() -> list[tuple[str, Callable[[bytes], bytes]]]:
+    compressors = []
+    if brotli is not None:
+        compressors.append(("br", lambda data: brotli.compress(data, quality=11)))
+    compressors.append(("gzip", lambda data: gzip.compress(data, compresslevel=9, mtime=0)))
+    return compressors
+
+def build_assets(source: str = SOURCE_DIR, output: str = ".cache/static") -> dict[str, Asset]:
+    """
+    Copies every file under `source` to `output` with a content hash in its
+    name, plus gzip (and, with the `brotli` package, brotli) variants of
+    text files where that makes them smaller, and writes the manifest
+    mapping original paths to built ones.
+
+    Files and variants already built are skipped, so rebuilding unchanged
+    assets is cheap, and older fingerprints stay around for pages still
+    referencing them.
+
+    Returns:
+        dict[str, Asset]: The manifest, keyed by path relative to `source` (with `/`).
+    """
+    manifest = {}
+    for root, _, files in os.walk(source):
+        for name in sorted(files):
+            full_path = os.path.join(root, name)
+            original = os.path.relpath(full_path, source).replace(os.sep, "/")
+            with open(full_path, "rb") as f:
+                data = f.read()
+
+            stem, ext = os.path.splitext(original)
+            hashed = f"{stem}.{hashlib.sha256(data).hexdigest()[:10]}{ext}"
+            target = os.path.join(output, hashed)
+            _write(target, data)
+
+            encodings = []
+            if ext.lower() in COMPRESSIBLE:
+                for encoding, compress in _compressors():
+                    variant = target + SUFFIXES[encoding]
+                    if os.path.exists(variant):
+                        encodings.append(encoding)
+                        continue
+                    compressed = compress(data)
+                    if len(compressed) < len(data):
+                        _write(variant, compressed)
+                        encodings.append(encoding)
+
+            manifest[original] = Asset(hashed, encodings)
+
+    os.makedirs(output, exist_ok=True)
+    manifest_path = os.path.join(output, MANIFEST)
+    tmp_path = f"{manifest_path}.{os.getpid()}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump({k: asdict(v) for k, v in manifest.items()}, f, indent=1, sort_keys=True)
+    os.replace(tmp_path, manifest_path)
+    return manifest
+
+def load_assets(settings: Settings) -> AssetManifest:
+    """
+    Loads the manifest `python -m assets` wrote into
+    `settings.static_build_dir`, without building anything: that's a
+    deploy step, not something every worker does on startup. In debug mode,
+    without a build directory or without a manifest, plain `/static/...`
+    URLs are used (and edited files show up on reload).
+
+    Returns:
+        AssetManifest: The assets to serve, empty for the plain files
+    """
+    if settings.debug or not settings.static_build_dir:
+        return AssetManifest()
+
+    try:
+        with open(os.path.join(settings.static_build_dir, MANIFEST)) as f:
+            manifest = json.load(f)
+    except FileNotFoundError:
+        print(f"No {MANIFEST} in {settings.static_build_dir}, serving unhashed static files (run `python -m assets`)")
+        return AssetManifest()
+    except (OSError, ValueError) as e:
+        print(e)
+        return AssetManifest()
+
+    return AssetManifest(settings.static_build_dir, {path: Asset(**asset) for path, asset in manifest.items()})
+
+@pass_context
+def static_url(context, path: str) -> str:
+    """
+    Template global: the URL of static file `path` (relative to `static/`),
+    fingerprinted when the rendering app has built assets.
+    """
+    request = context.get("request")
+    assets = getattr(request.app.state, "assets", None) if request is not None else None
+    return assets.url(path) if assets is not None else f"/static/{path}"
+
+def pick_encoding(accept_encoding: str, available: list[str]) -> Optional[str]:
+    """
+    Returns the first of `available` the `Accept-Encoding` header allows, or None.
+    """
+    accepted = set()
+    for part in accept_encoding.split(","):
+        coding, _, params = part.strip().partition(";")
+        if params.replace(" ", "") not in ("q=0", "q=0.0", "q=0.00", "q=0.000"):
+            accepted.add(coding.strip().lower())
+    for encoding in available:
+        if encoding in accepted:
+            return encoding
+    return None
+
+class AssetFiles(StaticFiles):
+    """
+    `StaticFiles` that serves fingerprinted files from the build directory
+    with a one year immutable cache lifetime, picking the pre-encoded
+    brotli or gzip variant the client accepts. Unfingerprinted paths fall
+    through to the plain source files, revalidated on every use.
+
+    Args:
+        assets (AssetManifest): The built files, see `load_assets`.
+    """
+    def __init__(self, *args, assets: AssetManifest, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.assets = assets
+
+    async def get_response(self, path: str, scope: Scope) -> Response:
+        asset = self.assets.hashed.get(path.replace(os.sep, "/"))
+        if asset is None:
+            response = await super().get_response(path, scope)
+            response.headers.setdefault("Cache-Control", REVALIDATE)
+            return response
+
+        if scope["method"] not in ("GET", "HEAD"):
+            raise HTTPException(status_code=405)
+
+        request_headers = Headers(scope=scope)
+        encoding = pick_encoding(request_headers.get("accept-encoding", ""), asset.encodings)
+        full_path = os.path.join(self.assets.build_dir, asset.path) + (SUFFIXES[encoding] if encoding else "")
+        try:
+            stat_result = await anyio.to_thread.run_sync(os.stat, full_path)
+        except FileNotFoundError:
+            raise HTTPException(status_code=404)
+
+        headers = {"Cache-Control": IMMUTABLE, "Vary": "Accept-Encoding"}
+        if encoding:
+            headers["Content-Encoding"] = encoding
+        response = FileResponse(
+            full_path,
+            stat_result=stat_result,
+            headers=headers,
+            media_type=mimetypes.guess_type(asset.path)[0] or "application/octet-stream"
+        )
+        if self.is_not_modified(response.headers, request_headers):
+            return NotModifiedResponse(response.headers)
+        return response
+
+if __name__ == "__main__":
+    # Build step: python -m assets
+    settings = Settings.from_env(require_password=False)
+    output = settings.static_build_dir or ".cache/static"
+    manifest = build_assets(SOURCE_DIR, output)
+    variants = sum(len(asset.encodings) for asset in manifest.values())
+    print(f"Built {len(manifest)} static files (+{variants} precompressed variants) into {output}"
+          + ("" if brotli is not None else " - install `brotli` for .br variants"))
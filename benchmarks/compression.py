@@ -0,0 +1,126 @@
+"""
+Bytes on the wire and compression CPU cost per route.
+
+Seeds an in-memory app with a club of fake athletes (pbs parsed from
+`benchmarks.fake_swimrankings` pages), renders every listed route once with
+the templates as written and once with `TEMPLATE_STRIP_WHITESPACE`, and
+compresses each body with the same code `CompressionMiddleware` runs, at
+several gzip levels and brotli qualities (brotli only with the `brotli`
+package installed).
+
+For every route, template mode and encoding it reports the body size,
+the size relative to the unstripped, uncompressed page and the median
+time one compression took.
+
+Usage:
+    python -m benchmarks.compression [--athletes 200] [--pbs 22] [--repeat 10]
+"""
+from datetime import datetime, timedelta, timezone
+from statistics import median
+import argparse
+import time
+
+from fastapi.testclient import TestClient
+from app import create_app
+from assets import brotli
+from compression import compress
+from db import DEFAULT_CLUB_ID, Token
+from settings import Settings
+from scraper.swimrankings import Gender, Swimmer, parse_athlete_pbs
+from sync import SyncResult, new_club_swimmer, write_pbs
+from benchmarks.fake_swimrankings import FakeConfig, FakeSwimrankings, FIRST_ATHLETE_ID
+
+HX = {"HX-Request": "true"}
+
+# (label, method, path, form data, headers)
+ROUTES = [
+    ("/", "GET", "/", None, {}),
+    ("/athletes", "GET", "/athletes", None, {}),
+    ("/athlete", "GET", f"/athlete?sw_id={FIRST_ATHLETE_ID}", None, {}),
+    ("/rankings", "GET", "/rankings", None, {}),
+    ("/htmx/page/athletes", "GET", "/htmx/page/athletes", None, HX),
+    ("/htmx/page/rankings", "GET", "/htmx/page/rankings", None, HX),
+    ("/admin/view-db", "GET", "/admin/view-db", None, HX),
+    ("/v1/get-swimmer-pbs", "POST", "/v1/get-swimmer-pbs", {"swimmer_id": 1}, HX),
+]
+
+def codecs() -> list[tuple[str, dict]]:
+    """
+    (encoding, `compress` keyword arguments) pairs to compare.
+    """
+    pairs = [("gzip", {"gzip_level": level}) for level in (1, 6, 9)]
+    if brotli is not None:
+        pairs += [("br", {"brotli_quality": quality}) for quality in (1, 4, 7)]
+    return pairs
+
+def seed(app, athletes: int, pbs: int) -> None:
+    fake = FakeSwimrankings(FakeConfig(athletes=athletes, pbs_per_athlete=pbs))
+    now = datetime.now(timezone.utc)
+    with app.state.session_factory() as db:
+        items = []
+        for i in range(athletes):
+            swimmer = new_club_swimmer(Swimmer(
+                FIRST_ATHLETE_ID + i, 2000 + i % 15, f"First{i}", f"LAST{i}", Gender(i % 2)
+            ), DEFAULT_CLUB_ID)
+            db.add(swimmer)
+            items.append((swimmer, parse_athlete_pbs(fake.athlete_page(FIRST_ATHLETE_ID + i))))
+        db.flush()
+        write_pbs(db, items, SyncResult(), now)
+        db.add(Token(token="benchmark", expiry=now + timedelta(hours=1)))
+        db.commit()
+
+def render(strip: bool, athletes: int, pbs: int) -> dict[str, bytes]:
+    """
+    Returns the uncompressed body of every route, rendered with or without whitespace stripping.
+    """
+    app = create_app(Settings(
+        db_location="sqlite://",
+        password_hash="unused",
+        template_cache_dir=None,
+        template_strip_whitespace=strip,
+        compress_min_size=None,
+        parse_workers=0
+    ))
+    bodies = {}
+    with TestClient(app) as client:
+        seed(app, athletes, pbs)
+        client.cookies.set("access_token", "benchmark")
+        for label, method, path, data, headers in ROUTES:
+            response = client.request(method, path, data=data, headers=headers)
+            response.raise_for_status()
+            bodies[label] = response.content
+    return bodies
+
+def timed(body: bytes, encoding: str, options: dict, repeat: int) -> tuple[int, float]:
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        size = len(compress(body, encoding, **options))
+        samples.append(time.perf_counter() - start)
+    return size, median(samples)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--athletes", type=int, default=200)
+    parser.add_argument("--pbs", type=int, default=22)
+    parser.add_argument("--repeat", type=int, default=10)
+    args = parser.parse_args()
+
+    rendered = {strip: render(strip, args.athletes, args.pbs) for strip in (False, True)}
+
+    print(f"{'route':<22} {'templates':<9} {'encoding':<10} {'bytes':>9} {'% raw':>7} {'cpu µs':>9}")
+    for label, *_ in ROUTES:
+        raw_size = len(rendered[False][label])
+        for strip in (False, True):
+            body = rendered[strip][label]
+            mode = "stripped" if strip else "as-is"
+            rows = [("identity", len(body), 0.0)]
+            for encoding, options in codecs():
+                size, seconds = timed(body, encoding, options, args.repeat)
+                level = next(iter(options.values()))
+                rows.append((f"{encoding}-{level}", size, seconds))
+            for name, size, seconds in rows:
+                print(f"{label:<22} {mode:<9} {name:<10} {size:>9} {size / raw_size * 100:>6.1f}% {seconds * 1e6:>9.1f}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,238 @@
+"""
+A local stand-in for swimrankings.net that serves fixture pages shaped like
+the real ones, so sync can be load tested without touching the real site.
+
+Usage:
+    python -m benchmarks.fake_swimrankings --athletes 100 --latency 0.05 --error-rate 0.01
+"""
+from dataclasses import dataclass
+from fastapi import FastAPI, Request
+from fastapi.responses import HTMLResponse
+from typing import Optional
+import argparse
+import asyncio
+import random
+import socket
+import threading
+import time
+import uvicorn
+
+FIRST_ATHLETE_ID = 4000000 # 7 digits, the scraper slices ids out of hrefs
+EVENTS = [
+    (1, "50m Freestyle"), (2, "100m Freestyle"), (3, "200m Freestyle"),
+    (5, "400m Freestyle"), (9, "50m Backstroke"), (10, "100m Backstroke"),
+    (13, "50m Breaststroke"), (14, "100m Breaststroke"), (16, "50m Butterfly"),
+    (17, "100m Butterfly"), (26, "200m Medley"),
+]
+
+@dataclass
+class FakeConfig:
+    """
+    Attributes:
+        athletes (int): Club roster size.
+        pbs_per_athlete (int): Rows in each athlete's PB table (max `len(EVENTS) * 2`).
+        latency (float): Seconds added to every response.
+        error_rate (float): Probability (0-1) that a request answers 500.
+        seed (int): Seed for the generated roster and results.
+        clubs (tuple[int, ...]): Club ids served, each with its own `athletes` roster.
+        meet_results_per_minute (float): How fast a meet's club results page fills up, counted from its first request.
+    """
+    athletes: int = 100
+    pbs_per_athlete: int = 12
+    latency: float = 0.0
+    error_rate: float = 0.0
+    seed: int = 0
+    clubs: tuple[int, ...] = (73626,)
+    meet_results_per_minute: float = 6.0
+
+class FakeSwimrankings:
+    def __init__(self, config: FakeConfig):
+        self.config = config
+        self.requests = 0
+        self.errors = 0
+        self._rng = random.Random(config.seed)
+        self._meets_started: dict[int, float] = {}
+
+    def athlete_id(self, i: int) -> int:
+        return FIRST_ATHLETE_ID + i
+
+    def _athlete_row(self, i: int, css: str) -> str:
+        gender = 1 if i % 2 == 0 else 2
+        return (
+            f'<tr class="{css}">'
+            f'<td class="name"><a href="?page=athleteDetail&athleteId={self.athlete_id(i)}">LAST{i}, First{i}</a></td>'
+            f'<td class="date">{2000 + i % 15}</td>'
+            f'<td class="nation">BEL</td>'
+            f'<td><img src="images/gender{gender}.png"></td>'
+            f'</tr>'
+        )
+
+    def slots(self, i: int) -> list[tuple[int, str, int]]:
+        """
+        The (style, event, course) results athlete `i` has, a seeded random
+        subset so each ranking view lists a different part of the roster.
+        """
+        every = [(style, event, course) for style, event in EVENTS for course in (25, 50)]
+        rng = random.Random(self.config.seed * 7_919 + i)
+        return sorted(rng.sample(every, min(self.config.pbs_per_athlete, len(every))))
+
+    def club_page(self, club_id: int, course: str, stroke: int) -> str:
+        clubs = self.config.clubs
+        first = clubs.index(club_id) * self.config.athletes if club_id in clubs else 0
+        last = first + self.config.athletes
+        meters = 50 if course == "LCM" else 25
+        listed = [i for i in range(first, last) if any(s == stroke and c == meters for s, _, c in self.slots(i))]
+        boys = "".join(self._athlete_row(i, f"athleteSearch{i % 2}") for i in listed if i % 2 == 0)
+        girls = "".join(self._athlete_row(i, f"athleteSearch{i % 2}") for i in listed if i % 2 == 1)
+        return (
+            '<html><body><table cellspacing="0" cellpadding="0" border="0"><tr>'
+            f'<td><table class="athleteList">{boys}</table></td>'
+            f'<td><table class="athleteList">{girls}</table></td>'
+            '</tr></table></body></html>'
+        )
+
+    def find_page(self, last_name: str) -> str:
+        digits = "".join(c for c in last_name if c.isdigit())
+        i = int(digits) if digits else 0
+        return (
+            '<html><body><table class="athleteSearch">'
+            f'{self._athlete_row(i, "athleteSearch0")}'
+            '</table></body></html>'
+        )
+
+    def athlete_page(self, athlete_id: int) -> str:
+        i = athlete_id - FIRST_ATHLETE_ID
+        rng = random.Random(self.config.seed * 1_000_003 + i)
+        rows = []
+        for n, (style, event, course) in enumerate(self.slots(i)):
+            distance = int(event.split("m")[0])
+            seconds = round(distance * rng.uniform(0.55, 0.8), 2)
+            minutes, secs = divmod(seconds, 60)
+            time_str = f"{int(minutes)}:{secs:05.2f}" if minutes else f"{secs:.2f}"
+            result_id = athlete_id * 100 + n
+            meet_id = 600000 + rng.randrange(200)
+            rows.append(
+                '<tr>'
+                f'<td class="event"><a href="?page=athleteDetail&athleteId={athlete_id}&styleId={style}">{event}</a></td>'
+                f'<td class="course">{course}m</td>'
+                f'<td class="time"><a href="?page=resultDetail&id={result_id}">{time_str}</a></td>'
+                f'<td class="code">{rng.randrange(300, 800)}</td>'
+                f'<td class="date">{rng.randrange(1, 28):02d} Mar 2025</td>'
+                f'<td class="city"><a href="?page=meetDetail&meetId={meet_id}" title="Meet {meet_id}">City{meet_id % 7}</a></td>'
+                '</tr>'
+            )
+        return (
+            '<html><body>'
+            '<select name="points"><option>FINA 2023</option><option selected>FINA 2024</option></select>'
+            '<table class="athleteBest"><tr><th>Event</th></tr>'
+            f'{"".join(rows)}'
+            '</table></body></html>'
+        )
+
+    def meet_page(self, meet_id: int, club_id: int) -> str:
+        """
+        A meet's results for one club, growing by `meet_results_per_minute`
+        from the first time the page is requested until every athlete swam
+        two events.
+        """
+        started = self._meets_started.setdefault(meet_id, time.monotonic())
+        clubs = self.config.clubs
+        first = clubs.index(club_id) * self.config.athletes if club_id in clubs else 0
+        total = self.config.athletes * 2
+        listed = min(total, int((time.monotonic() - started) / 60 * self.config.meet_results_per_minute))
+        rows = []
+        for k in range(listed):
+            i = first + k % self.config.athletes
+            style, event, course = self.slots(i)[k // self.config.athletes % len(self.slots(i))]
+            rng = random.Random(meet_id * 1_000_003 + k)
+            seconds = round(int(event.split("m")[0]) * rng.uniform(0.55, 0.8), 2)
+            minutes, secs = divmod(seconds, 60)
+            time_str = f"{int(minutes)}:{secs:05.2f}" if minutes else f"{secs:.2f}"
+            rows.append(
+                f'<tr class="meetResult{k % 2}">'
+                f'<td class="name"><a href="?page=athleteDetail&athleteId={self.athlete_id(i)}">LAST{i}, First{i}</a></td>'
+                f'<td class="event"><a href="?page=meetDetail&meetId={meet_id}&styleId={style}">{event}</a></td>'
+                f'<td class="course">{course}m</td>'
+                f'<td class="time"><a href="?page=resultDetail&id={meet_id * 10_000 + k}">{time_str}</a></td>'
+                f'<td class="code">{rng.randrange(300, 800)}</td>'
+                '</tr>'
+            )
+        return (
+            '<html><body><table class="meetResult"><tr><th>Athlete</th></tr>'
+            f'{"".join(rows)}'
+            '</table></body></html>'
+        )
+
+    def build_app(self) -> FastAPI:
+        app = FastAPI()
+
+        @app.get("/index.php", response_class=HTMLResponse)
+        async def index(request: Request):
+            self.requests += 1
+            if self.config.latency:
+                await asyncio.sleep(self.config.latency)
+            if self.config.error_rate and self._rng.random() < self.config.error_rate:
+                self.errors += 1
+                return HTMLResponse("Server Error", status_code=500)
+
+            params = request.query_params
+            if params.get("internalRequest") == "athleteFind":
+                return HTMLResponse(self.find_page(params.get("athlete_lastname", "")))
+            if params.get("page") == "rankingDetail":
+                return HTMLResponse(self.club_page(
+                    int(params.get("clubId", 0)), params.get("course", "LCM"), int(params.get("stroke", 0))
+                ))
+            if params.get("page") == "meetDetail":
+                return HTMLResponse(self.meet_page(int(params["meetId"]), int(params.get("clubId", 0))))
+            if params.get("page") == "athleteDetail":
+                return HTMLResponse(self.athlete_page(int(params["athleteId"])))
+            return HTMLResponse("Not Found", status_code=404)
+
+        return app
+
+class FakeServer:
+    """
+    Runs a `FakeSwimrankings` app with uvicorn on a background thread.
+
+    Usage:
+        with FakeServer(FakeConfig(athletes=100)) as server:
+            scraper.url_book.base = server.base
+    """
+    def __init__(self, config: FakeConfig, port: Optional[int] = None):
+        self.fake = FakeSwimrankings(config)
+        self.port = port or _free_port()
+        self.base = f"http://127.0.0.1:{self.port}/index.php?"
+        self._server = uvicorn.Server(uvicorn.Config(
+            self.fake.build_app(), host="127.0.0.1", port=self.port, log_level="warning"
+        ))
+        self._thread = threading.Thread(target=self._server.run, daemon=True)
+
+    def __enter__(self) -> "FakeServer":
+        self._thread.start()
+        while not self._server.started:
+            time.sleep(0.01)
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self._server.should_exit = True
+        self._thread.join()
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--athletes", type=int, default=100)
+    parser.add_argument("--pbs", type=int, default=12)
+    parser.add_argument("--latency", type=float, default=0.0)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--port", type=int, default=8765)
+    args = parser.parse_args()
+
+    config = FakeConfig(args.athletes, args.pbs, args.latency, args.error_rate)
+    uvicorn.run(FakeSwimrankings(config).build_app(), host="127.0.0.1", port=args.port)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,102 @@
+"""
+Memory per personal best for the scraper's pb representations.
+
+Builds N pbs three ways from the same parsed fake pages, each fed fresh
+strings like BeautifulSoup hands out:
+
+- `dataclass`: the old model, a plain dataclass per row with its own
+  `__dict__` and a timezone-aware `last_scraped` datetime
+- `slotted`: the frozen, slotted `SwimmerPb` row type
+- `PbBatch`: the column-oriented batch the parser now returns
+
+and reports the Python heap retained per pb (tracemalloc) and the pickled
+size per pb, which is what crosses the parse pool.
+
+Usage:
+    python -m benchmarks.pb_memory [--pbs 100000]
+"""
+from dataclasses import dataclass
+from datetime import date, datetime, time, timezone
+import argparse
+import pickle
+import tracemalloc
+
+from benchmarks.fake_swimrankings import FakeConfig, FakeSwimrankings, FIRST_ATHLETE_ID
+from scraper.swimrankings import PbBatch, SwimmerPb, parse_athlete_pbs
+
+@dataclass
+class DictPb:
+    """`SwimmerPb` as it was before: no slots, a datetime per row."""
+    sw_style_id: int
+    sw_result_id: int
+    sw_meet_id: int
+    sw_default_fina: str
+    event: str
+    course: int
+    time: time
+    pts: int
+    date: date
+    city: str
+    meet_name: str
+    last_scraped: datetime
+
+def _fresh(s: str) -> str:
+    # A new str object with the same value, like every parsed cell is
+    return s.encode().decode()
+
+def sample(n: int) -> list[tuple]:
+    """
+    Returns `n` pbs as raw tuples (times in microseconds, dates as ordinals),
+    cycling through the parsed pages of a fake club with new result ids.
+    """
+    fake = FakeSwimrankings(FakeConfig(athletes=200, pbs_per_athlete=22))
+    parsed = []
+    for i in range(200):
+        batch = parse_athlete_pbs(fake.athlete_page(FIRST_ATHLETE_ID + i))
+        for k in range(len(batch)):
+            parsed.append(tuple(getattr(batch, f)[k] for f in PbBatch.__slots__))
+    return [(row[0], i, *row[2:]) for i, row in ((i, parsed[i % len(parsed)]) for i in range(n))]
+
+def _values(row: tuple) -> tuple:
+    style, result, meet, fina, event, course, us, pts, ordinal, city, meet_name = row
+    seconds, microsecond = divmod(us, 1_000_000)
+    minutes, second = divmod(seconds, 60)
+    return (style, result, meet, _fresh(fina), _fresh(event), course,
+            time(minutes // 60, minutes % 60, second, microsecond), pts,
+            date.fromordinal(ordinal), _fresh(city), _fresh(meet_name))
+
+def build_dataclass(rows: list[tuple]) -> list[DictPb]:
+    return [DictPb(*_values(row), datetime.now(timezone.utc)) for row in rows]
+
+def build_slotted(rows: list[tuple]) -> list[SwimmerPb]:
+    return [SwimmerPb(*_values(row)) for row in rows]
+
+def build_batch(rows: list[tuple]) -> PbBatch:
+    batch = PbBatch()
+    for row in rows:
+        batch.append(*_values(row))
+    return batch
+
+def measure(build, rows: list[tuple]) -> dict:
+    tracemalloc.start()
+    result = build(rows)
+    retained, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    pickled = len(pickle.dumps(result))
+    n = len(rows)
+    return {"bytes_per_pb": retained / n, "peak_per_pb": peak / n, "pickled_per_pb": pickled / n}
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--pbs", type=int, default=100_000)
+    args = parser.parse_args()
+
+    rows = sample(args.pbs)
+    columns = ("model", "bytes_per_pb", "peak_per_pb", "pickled_per_pb")
+    print(" ".join(f"{c:>16}" for c in columns))
+    for name, build in (("dataclass", build_dataclass), ("slotted", build_slotted), ("PbBatch", build_batch)):
+        result = measure(build, rows)
+        print(f"{name:>16} " + " ".join(f"{result[c]:>16.1f}" for c in columns[1:]))
+
+if __name__ == "__main__":
+    main()
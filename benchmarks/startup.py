@@ -0,0 +1,54 @@
+"""
+Measures worker boot time: importing `app`, building an app with
+`create_app` and serving the first request.
+
+Usage:
+    python -m benchmarks.startup [--runs N]
+"""
+from statistics import median
+import argparse
+import os
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Runs in a fresh interpreter so import caches don't skew the numbers
+CHILD = """
+import time
+t0 = time.perf_counter()
+import bcrypt
+from settings import Settings
+from app import create_app
+t1 = time.perf_counter()
+app = create_app(Settings(db_location="sqlite://", password_hash=bcrypt.hashpw(b"x", bcrypt.gensalt(4)).decode()))
+t2 = time.perf_counter()
+from fastapi.testclient import TestClient
+with TestClient(app) as client:
+    t3 = time.perf_counter()
+    client.get("/athletes")
+    t4 = time.perf_counter()
+print(t1 - t0, t2 - t1, t3 - t2, t4 - t3)
+"""
+
+def run_once() -> list[float]:
+    out = subprocess.run(
+        [sys.executable, "-c", CHILD], cwd=ROOT,
+        capture_output=True, text=True, check=True
+    )
+    return [float(x) for x in out.stdout.split()]
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--runs", type=int, default=5)
+    args = parser.parse_args()
+
+    results = [run_once() for _ in range(args.runs)]
+    labels = ("import", "create_app", "lifespan", "first request")
+
+    for i, label in enumerate(labels):
+        samples = [r[i] * 1000 for r in results]
+        print(f"{label:>14}: median {median(samples):8.2f} ms  min {min(samples):8.2f} ms")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,143 @@
+"""
+End-to-end load test of `/v1/sync-swimmers` against the local swimrankings
+stand-in in `benchmarks.fake_swimrankings`.
+
+For every club size it builds a fresh app on a throwaway SQLite file (or the
+database given with `--db`, which is wiped first), points
+`UrlBook.base` at the fake server and reports wall time, upstream
+requests/second, DB writes and peak Python memory of one full sync, both
+of the sync itself (`sync_peak_mib`) and of the whole request including
+the rendered roster (`peak_mib`).
+
+Usage:
+    python -m benchmarks.sync_load [--sizes 10 100 1000] [--clubs 1] [--latency 0.02] [--error-rate 0] [--interval 0] [--parse-workers 2] [--resync] [--db URL]
+
+With `--clubs N` every size is per club and N clubs are synced concurrently.
+With `--resync` a second, no-op sync follows and its writes are reported too.
+With `--db postgresql+psycopg://...` (a throwaway database!) pbs are loaded
+with `COPY`; `db_writes` counts the merge statements, not the COPY itself.
+"""
+from datetime import datetime, timedelta, timezone
+from sqlalchemy import event
+import argparse
+import os
+import secrets
+import tempfile
+import time
+import tracemalloc
+
+from benchmarks.fake_swimrankings import FakeConfig, FakeServer
+
+class WriteCounter:
+    """
+    Counts INSERT/UPDATE/DELETE statements issued on an engine.
+    """
+    def __init__(self, engine):
+        self.statements = 0
+        event.listen(engine, "after_cursor_execute", self._after)
+
+    def _after(self, conn, cursor, statement, parameters, context, executemany):
+        word = statement.lstrip().split(None, 1)[0].upper()
+        if word in ("INSERT", "UPDATE", "DELETE"):
+            self.statements += 1
+
+def run(size: int, args) -> dict:
+    from fastapi.testclient import TestClient
+    from app import create_app
+    from settings import Settings
+    from db import Base, Token, SyncTarget, DEFAULT_CLUB_ID, make_engine
+    from scraper import swimrankings
+    from scraper.base_scraper import BaseScraper
+    from metrics import SYNC_LAST_PEAK_MEMORY
+
+    BaseScraper._request.min_interval = args.interval
+    clubs = tuple(DEFAULT_CLUB_ID + i for i in range(args.clubs))
+
+    with tempfile.TemporaryDirectory() as tmp, FakeServer(FakeConfig(
+        athletes=size, pbs_per_athlete=args.pbs, latency=args.latency, error_rate=args.error_rate, clubs=clubs
+    )) as server:
+        db_location = args.db or f"sqlite:///{os.path.join(tmp, 'load.db')}"
+        if args.db:
+            engine = make_engine(args.db)
+            Base.metadata.drop_all(engine)
+            engine.dispose()
+        app = create_app(Settings(
+            db_location=db_location,
+            password_hash="unused",
+            parse_workers=args.parse_workers,
+            sync_trace_memory=True
+        ))
+
+        def fake_scraper():
+            scraper = swimrankings.SwimrankingsScraper(parse_pool=app.state.parse_pool)
+            scraper.url_book.base = server.base
+            return scraper
+
+        app.dependency_overrides[swimrankings.get_scraper_factory] = lambda: fake_scraper
+        writes = WriteCounter(app.state.engine)
+
+        with TestClient(app, raise_server_exceptions=False) as client:
+            token = secrets.token_urlsafe(32)
+            with app.state.session_factory() as db:
+                db.add(Token(token=token, expiry=datetime.now(timezone.utc) + timedelta(hours=1)))
+                for club in clubs[1:]:
+                    db.add(SyncTarget(sw_club_id=club, season=2025))
+                db.commit()
+            client.cookies.set("access_token", token)
+
+            writes.statements = 0
+            server.fake.requests = 0
+
+            tracemalloc.start()
+            start = time.perf_counter()
+            response = client.post("/v1/sync-swimmers", headers={"HX-Request": "true"})
+            wall = time.perf_counter() - start
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            sync_peak = SYNC_LAST_PEAK_MEMORY.value()
+
+            first_writes = writes.statements
+            resync_writes = None
+            if args.resync:
+                writes.statements = 0
+                client.post("/v1/sync-swimmers", headers={"HX-Request": "true"})
+                resync_writes = writes.statements
+
+        return {
+            "athletes": size * len(clubs),
+            "status": response.status_code,
+            "wall_s": wall,
+            "requests": server.fake.requests,
+            "req_per_s": server.fake.requests / wall if wall else 0.0,
+            "upstream_errors": server.fake.errors,
+            "db_writes": first_writes,
+            "resync_writes": "-" if resync_writes is None else resync_writes,
+            "sync_peak_mib": sync_peak / (1024 * 1024),
+            "peak_mib": peak / (1024 * 1024),
+        }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10, 100, 1000])
+    parser.add_argument("--clubs", type=int, default=1, help="Clubs synced concurrently")
+    parser.add_argument("--pbs", type=int, default=12, help="PB rows per athlete")
+    parser.add_argument("--latency", type=float, default=0.0, help="Seconds of upstream latency per request")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fraction of upstream requests that answer 500")
+    parser.add_argument("--interval", type=float, default=0.0, help="Scraper rate limit interval (production uses 1s)")
+    parser.add_argument("--parse-workers", type=int, default=2, help="Parse pool processes, 0 parses on the event loop")
+    parser.add_argument("--resync", action="store_true", help="Run a second, no-op sync and count its writes")
+    parser.add_argument("--db", help="Database URL to sync into instead of a temporary SQLite file; every table in it is dropped first")
+    args = parser.parse_args()
+
+    columns = ("athletes", "status", "wall_s", "requests", "req_per_s", "upstream_errors",
+               "db_writes", "resync_writes", "sync_peak_mib", "peak_mib")
+    print(" ".join(f"{c:>16}" for c in columns))
+    for size in args.sizes:
+        result = run(size, args)
+        print(" ".join(
+            f"{result[c]:>16.2f}" if isinstance(result[c], float) else f"{result[c]:>16}"
+            for c in columns
+        ))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,193 @@
+from typing import Optional
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+from assets import brotli, pick_encoding
+from metrics import HTTP_COMPRESSION_BYTES_IN, HTTP_COMPRESSION_BYTES_OUT
+import zlib
+
+# Text formats worth compressing. Not `text/event-stream`: every sync
+# progress event has to reach the browser as soon as it is sent
+COMPRESSIBLE_TYPES = {
+    "text/html", "text/plain", "text/css", "text/csv", "text/javascript",
+    "application/javascript", "application/json", "application/xml", "image/svg+xml",
+}
+
+def available_encodings() -> list[str]:
+    """
+    Encodings the server can produce, preferred first.
+    """
+    return ["br", "gzip"] if brotli is not None else ["gzip"]
+
+class Compressor:
+    """
+    Incremental brotli or gzip compressor.
+
+    Attributes:
+        encoding (str): `br` or `gzip`, the `Content-Encoding` produced.
+    """
+    def __init__(self, encoding: str, gzip_level: int = 6, brotli_quality: int = 4):
+        self.encoding = encoding
+        if encoding == "br":
+            self._brotli = brotli.Compressor(quality=brotli_quality)
+        else:
+            self._zlib = zlib.compressobj(gzip_level, zlib.DEFLATED, 31) # 31: gzip container
+
+    def compress(self, data: bytes) -> bytes:
+        return self._brotli.process(data) if self.encoding == "br" else self._zlib.compress(data)
+
+    def finish(self) -> bytes:
+        return self._brotli.finish() if self.encoding == "br" else self._zlib.flush()
+
+def compress(data: bytes, encoding: str, gzip_level: int = 6, brotli_quality: int = 4) -> bytes:
+    """
+    Compresses a whole body in one go, as the middleware does for most responses.
+    """
+    compressor = Compressor(encoding, gzip_level, brotli_quality)
+    return compressor.compress(data) + compressor.finish()
+
+def is_compressible(headers: Headers, status: int) -> bool:
+    """
+    Whether a response with these headers may be compressed: a text content
+    type, not already encoded, not a partial or empty-by-definition
+    response, and not marked `no-transform`.
+    """
+    media_type = headers.get("content-type", "").partition(";")[0].strip().lower()
+    return (
+        media_type in COMPRESSIBLE_TYPES
+        and status >= 200 and status not in (204, 206, 304)
+        and "content-encoding" not in headers
+        and "content-range" not in headers
+        and "no-transform" not in headers.get("cache-control", "").lower()
+    )
+
+class CompressionMiddleware:
+    """
+    Compresses text responses with brotli (when the `brotli` package is
+    installed) or gzip, whichever the client prefers.
+
+    Bodies smaller than `minimum_size` are sent as they are, since the
+    saving wouldn't pay for the CPU time and the encoding overhead. Streamed
+    responses of a compressible type are compressed chunk by chunk; server
+    sent events and already encoded responses (precompressed static files)
+    are passed through untouched.
+
+    Attributes:
+        minimum_size (int): Smallest body compressed, in bytes.
+        gzip_level (int): zlib level, 1 (fast) to 9 (small).
+        brotli_quality (int): brotli quality, 0 (fast) to 11 (small).
+    """
+    def __init__(self, app: ASGIApp, minimum_size: int = 512, gzip_level: int = 6, brotli_quality: int = 4):
+        self.app = app
+        self.minimum_size = minimum_size
+        self.gzip_level = gzip_level
+        self.brotli_quality = brotli_quality
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        encoding = pick_encoding(Headers(scope=scope).get("accept-encoding", ""), available_encodings())
+        if encoding is None:
+            await self.app(scope, receive, send)
+            return
+
+        responder = _CompressingResponder(self, encoding, send)
+        await self.app(scope, receive, responder.send)
+
+class _CompressingResponder:
+    def __init__(self, middleware: CompressionMiddleware, encoding: str, send: Send):
+        self.middleware = middleware
+        self.encoding = encoding
+        self._send = send
+        self.start: Optional[Message] = None
+        self.length: Optional[int] = None
+        self.buffer = bytearray()
+        self.compressor: Optional[Compressor] = None
+        self.finished = False
+        self.passthrough = False
+
+    async def send(self, message: Message) -> None:
+        if message["type"] == "http.response.start":
+            # Held back until enough of the body arrived to decide
+            self.start = message
+            headers = Headers(raw=message["headers"])
+            length = headers.get("content-length")
+            self.length = int(length) if length and length.isdigit() else None
+            self.passthrough = (
+                not is_compressible(headers, message["status"])
+                or (self.length is not None and self.length < self.middleware.minimum_size)
+            )
+            if self.passthrough:
+                self.start = None
+                await self._send(message)
+            return
+
+        if self.passthrough or message["type"] != "http.response.body":
+            if self.start is not None:
+                await self._flush_uncompressed(more_body=True)
+            await self._send(message)
+            return
+
+        if self.finished:
+            # Only the empty closing chunk after a body of known length is left
+            await self._send({"type": "http.response.body", "body": b"", "more_body": message.get("more_body", False)})
+            return
+        if self.compressor is not None:
+            await self._send_compressed(message.get("body", b""), message.get("more_body", False))
+            return
+
+        # Wrapping middleware (e.g. `BaseHTTPMiddleware`) streams every body:
+        # bodies of known length are collected whole so the compressed one
+        # gets a Content-Length, others until the size threshold is reached
+        self.buffer += message.get("body", b"")
+        more_body = message.get("more_body", False)
+        wanted = self.length if self.length is not None else self.middleware.minimum_size
+        if more_body and len(self.buffer) < wanted:
+            return
+        complete = not more_body or len(self.buffer) == self.length
+        if complete and len(self.buffer) < self.middleware.minimum_size:
+            await self._flush_uncompressed(more_body=more_body)
+            return
+
+        headers = MutableHeaders(raw=self.start["headers"])
+        headers["Content-Encoding"] = self.encoding
+        headers.add_vary_header("Accept-Encoding")
+        if "etag" in headers and not headers["etag"].startswith("W/"):
+            # Same entity, different bytes: only weakly equal to the unencoded one
+            headers["ETag"] = "W/" + headers["etag"]
+        self.compressor = Compressor(self.encoding, self.middleware.gzip_level, self.middleware.brotli_quality)
+        body, self.buffer = bytes(self.buffer), bytearray()
+
+        if not complete:
+            del headers["Content-Length"]
+            await self._send(self.start)
+            self.start = None
+            await self._send_compressed(body, more_body=True)
+        else:
+            compressed = self.compressor.compress(body) + self.compressor.finish()
+            self._count(len(body), len(compressed))
+            headers["Content-Length"] = str(len(compressed))
+            self.finished = True
+            await self._send(self.start)
+            self.start = None
+            await self._send({"type": "http.response.body", "body": compressed, "more_body": more_body})
+
+    async def _flush_uncompressed(self, more_body: bool) -> None:
+        self.passthrough = True
+        start, self.start = self.start, None
+        await self._send(start)
+        if self.buffer or not more_body:
+            body, self.buffer = bytes(self.buffer), bytearray()
+            await self._send({"type": "http.response.body", "body": body, "more_body": more_body})
+
+    async def _send_compressed(self, body: bytes, more_body: bool) -> None:
+        compressed = self.compressor.compress(body)
+        if not more_body:
+            compressed += self.compressor.finish()
+        self._count(len(body), len(compressed))
+        await self._send({"type": "http.response.body", "body": compressed, "more_body": more_body})
+
+    def _count(self, size_in: int, size_out: int) -> None:
+        HTTP_COMPRESSION_BYTES_IN.inc(size_in, encoding=self.encoding)
+        HTTP_COMPRESSION_BYTES_OUT.inc(size_out, encoding=self.encoding)
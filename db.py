@@ -1,16 +1,17 @@
-from typing import Generator
+from datetime import datetime, timezone
+from typing import Generator, Iterable, Optional, Sequence
+from fastapi import Request
 from sqlalchemy.orm import declarative_base, sessionmaker, Session, relationship
-from sqlalchemy import Date, ForeignKey, create_engine, Column, Integer, String, DateTime, Time
-from dotenv import load_dotenv
-import os
-
-load_dotenv()
-db_location_env = os.getenv("DB_LOCATION")
-if not db_location_env:
-    raise RuntimeError("DB_LOCATION is not set in .env file!!!\n")
+from sqlalchemy import BigInteger, Boolean, Date, ForeignKey, Index, UniqueConstraint, create_engine, delete, event, exists, func, inspect, make_url, text, select, Column, Integer, String, DateTime, Time, Engine
+from sqlalchemy.pool import StaticPool
+from sqlalchemy.dialects import postgresql, sqlite
+import csv
+import io
 
 Base = declarative_base()
 
+DEFAULT_CLUB_ID = 73626 # SCWR
+
 class Token(Base):
     """
     Stores authentication tokens for admin functionality.
@@ -38,15 +39,27 @@ class ClubSwimmer(Base):
         first_name (str): First name of the swimmer.
         last_name (str): Last name of the swimmer (including middle names).
         gender (int): Gender of the swimmer (0: man, 1: woman).
+        sw_club_id (int): swimrankings.net id of the club this row belongs to.
+        pbs_checked_at (DateTime): When sync last compared this swimmer's pbs with swimrankings.net.
+        pbs_changed_at (DateTime): When sync last inserted, changed or deleted one of this swimmer's pbs.
+        updated_at (DateTime): When the row was inserted or one of its `DETAIL_COLUMNS` last changed through the ORM (None for rows older than the column).
     """
     __tablename__ = 'scwr_swimmers'
+    # Every per-club lookup (roster, sync diff) goes through this index, so one
+    # club's queries never scan another club's rows; unique, an athlete is on
+    # a club's roster once
+    __table_args__ = (Index('ix_scwr_swimmers_club_sw_id', 'sw_club_id', 'sw_id', unique=True),)
 
     id = Column(Integer, primary_key=True)
+    sw_club_id = Column(Integer, nullable=False, default=DEFAULT_CLUB_ID)
     sw_id = Column(Integer, nullable=False)
     birth_year = Column(Integer, nullable=False)
     first_name = Column(String, nullable=False)
     last_name = Column(String, nullable=False)
     gender = Column(Integer, nullable=False)  # 0: man, 1: woman
+    pbs_checked_at = Column(DateTime(timezone=True), nullable=True)
+    pbs_changed_at = Column(DateTime(timezone=True), nullable=True)
+    updated_at = Column(DateTime(timezone=True), nullable=True, default=lambda: datetime.now(timezone.utc))
     pbs = relationship(
         'ClubSwimmerPb',
         back_populates='athlete',
@@ -54,6 +67,16 @@ class ClubSwimmer(Base):
         passive_deletes=True
     )
 
+# What a swimmer is, as opposed to bookkeeping (`pbs_checked_at`, ...) that
+# every sync writes; only these move `ClubSwimmer.updated_at`
+DETAIL_COLUMNS = ("sw_club_id", "sw_id", "birth_year", "first_name", "last_name", "gender")
+
+@event.listens_for(ClubSwimmer, "before_update")
+def _touch_details(mapper, connection, target: ClubSwimmer) -> None:
+    state = inspect(target)
+    if any(state.attrs[column].history.has_changes() for column in DETAIL_COLUMNS):
+        target.updated_at = datetime.now(timezone.utc)
+
 class ClubSwimmerPb(Base):
     """
     Stores the pbs of a ClubSwimmer scraped from swimrankings.net
@@ -72,7 +95,7 @@ class ClubSwimmerPb(Base):
         date (Date): Date of the pb.
         city (str): The name of the city the pb was swam in.
         meet_name (str): The name of the meet at which the pb was swum.
-        last_scraped (DateTime): The time and date the last time this pb was scraped for.
+        last_scraped (DateTime): When sync last inserted or changed this row (see `ClubSwimmer.pbs_checked_at` for when it was last compared).
     """
     __tablename__ = 'athlete_pbs'
 
@@ -93,14 +116,354 @@ class ClubSwimmerPb(Base):
 
     athlete = relationship('ClubSwimmer', back_populates='pbs')
 
-engine = create_engine(db_location_env)
-Base.metadata.create_all(engine)
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+class SyncTarget(Base):
+    """
+    A swimrankings.net ranking page that sync reads a club's roster from.
+
+    A club can have several targets (seasons, courses, strokes); its roster is
+    the union of all of them.
+
+    Attributes:
+        id (int): Unique primary key.
+        sw_club_id (int): swimrankings.net club id.
+        season (int): Ranking season.
+        course (str): `LCM` or `SCM`.
+        stroke (int): swimrankings.net stroke/ranking id.
+        active (bool): Whether sync uses this target.
+    """
+    __tablename__ = 'sync_targets'
+
+    id = Column(Integer, primary_key=True)
+    sw_club_id = Column(Integer, nullable=False, index=True)
+    season = Column(Integer, nullable=False)
+    course = Column(String, nullable=False, default='LCM')
+    stroke = Column(Integer, nullable=False, default=9)
+    active = Column(Boolean, nullable=False, default=True)
+
+class DiscoveryView(Base):
+    """
+    Cache of which athletes one ranking page (view) listed for a club.
+
+    Sync uses these to pick the fewest pages that still cover the known roster
+    instead of re-scanning every view every time.
+
+    Attributes:
+        id (int): Unique primary key.
+        sw_club_id (int): swimrankings.net club id.
+        season (int): Ranking season of the view.
+        course (str): `LCM` or `SCM`.
+        stroke (int): swimrankings.net stroke/ranking id.
+        sw_ids (str): Comma separated swimrankings.net ids listed on the page.
+        scanned_at (DateTime): When the page was last scraped.
+    """
+    __tablename__ = 'discovery_views'
+    __table_args__ = (UniqueConstraint('sw_club_id', 'season', 'course', 'stroke'),)
+
+    id = Column(Integer, primary_key=True)
+    sw_club_id = Column(Integer, nullable=False, index=True)
+    season = Column(Integer, nullable=False)
+    course = Column(String, nullable=False)
+    stroke = Column(Integer, nullable=False)
+    sw_ids = Column(String, nullable=False, default='')
+    scanned_at = Column(DateTime(timezone=True), nullable=False)
+
+class KnownAthlete(Base):
+    """
+    Every athlete the scraper has come across (club ranking pages, name
+    searches), whether or not they're on a synced roster. Feeds the local
+    name index add-swimmer resolves names against before searching
+    swimrankings.net.
+
+    Attributes:
+        sw_id (int): swimrankings.net athlete id, primary key.
+        birth_year (int): Birth year of the athlete.
+        first_name (str): First name as listed by swimrankings.net.
+        last_name (str): Last name as listed by swimrankings.net.
+        gender (int): Gender of the athlete (0: man, 1: woman).
+        seen_at (DateTime): When the athlete was first seen or their details last changed.
+    """
+    __tablename__ = 'known_athletes'
+
+    sw_id = Column(Integer, primary_key=True, autoincrement=False)
+    birth_year = Column(Integer, nullable=False)
+    first_name = Column(String, nullable=False)
+    last_name = Column(String, nullable=False)
+    gender = Column(Integer, nullable=False)
+    seen_at = Column(DateTime(timezone=True), nullable=False)
+
+class ClubMeetResult(Base):
+    """
+    A club athlete's result at a meet, stored by the live results poller as
+    soon as swimrankings.net lists it.
+
+    Attributes:
+        id (int): Unique primary key.
+        sw_meet_id (int): swimrankings.net meet id.
+        sw_club_id (int): swimrankings.net club id the results page was read for.
+        sw_result_id (int): swimrankings.net result id, unique within the meet.
+        sw_id (int): swimrankings.net athlete id.
+        first_name (str): First name of the athlete.
+        last_name (str): Last name of the athlete.
+        sw_style_id (int): swimrankings.net style id of the event.
+        event (str): String of the event (distance(m) stroke).
+        course (int): Pool length in meters.
+        time (Time): The swum time.
+        pts (int): FINA points.
+        seen_at (DateTime): When the result first appeared or last changed.
+    """
+    __tablename__ = 'meet_results'
+    __table_args__ = (UniqueConstraint('sw_meet_id', 'sw_result_id'),)
+
+    id = Column(Integer, primary_key=True)
+    sw_meet_id = Column(Integer, nullable=False)
+    sw_club_id = Column(Integer, nullable=False)
+    sw_result_id = Column(BigInteger, nullable=False)
+    sw_id = Column(Integer, nullable=False)
+    first_name = Column(String, nullable=False)
+    last_name = Column(String, nullable=False)
+    sw_style_id = Column(Integer, nullable=False)
+    event = Column(String, nullable=False)
+    course = Column(Integer, nullable=False)
+    time = Column(Time, nullable=False)
+    pts = Column(Integer, nullable=False)
+    seen_at = Column(DateTime(timezone=True), nullable=False)
+
+# Columns added to existing tables after release: (table, column, constraints for ALTER TABLE)
+_ADDED_COLUMNS = (
+    ('scwr_swimmers', 'sw_club_id', f'NOT NULL DEFAULT {DEFAULT_CLUB_ID}'),
+    ('scwr_swimmers', 'pbs_checked_at', ''),
+    ('scwr_swimmers', 'updated_at', ''),
+    ('scwr_swimmers', 'pbs_changed_at', ''),
+)
+
+# Drivers whose raw connections can stream `COPY ... FROM STDIN` (see `copy_rows`)
+COPY_DRIVERS = ("psycopg", "psycopg2")
+
+def make_engine(db_location: str, pool_size: int = 5, max_overflow: int = 10) -> Engine:
+    """
+    Creates the engine for `db_location` without connecting to it.
+
+    In-memory SQLite URLs share a single connection so every session sees
+    the same database, which is what isolated test apps need.
+
+    Server databases (PostgreSQL) get a pool of `pool_size` connections plus
+    up to `max_overflow` extra under load, per process, so size them by the
+    number of app workers. Connections are checked before use and recycled
+    every 30 minutes, so a restarted database or a proxy dropping idle
+    connections doesn't fail requests. `postgres://` URLs (as handed out by
+    most hosts) use psycopg 3.
+
+    SQLite connections enforce foreign keys (see `enforce_foreign_keys`).
+    """
+    if db_location in ("sqlite://", "sqlite:///:memory:"):
+        return enforce_foreign_keys(create_engine(
+            db_location,
+            connect_args={"check_same_thread": False},
+            poolclass=StaticPool
+        ))
+
+    url = make_url(db_location)
+    if url.drivername == "postgres":
+        url = url.set(drivername="postgresql+psycopg")
+    if url.get_backend_name() == "sqlite":
+        return enforce_foreign_keys(create_engine(url))
+    return create_engine(
+        url,
+        pool_size=pool_size,
+        max_overflow=max_overflow,
+        pool_pre_ping=True,
+        pool_recycle=1800
+    )
+
+def enforce_foreign_keys(engine: Engine) -> Engine:
+    """
+    Turns on `PRAGMA foreign_keys` for every connection of a SQLite engine.
+    SQLite ignores foreign keys (and so `ON DELETE CASCADE`) per connection
+    unless told otherwise, which left the pbs of deleted swimmers behind.
+    """
+    @event.listens_for(engine, "connect")
+    def _connect(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        cursor.execute("PRAGMA foreign_keys=ON")
+        cursor.close()
+
+    return engine
+
+def as_utc(value: datetime) -> datetime:
+    """
+    Returns a stored timestamp as an aware UTC datetime. SQLite hands back
+    naive datetimes (they're stored as UTC), PostgreSQL aware ones in the
+    session's time zone.
+    """
+    if value.tzinfo is None:
+        return value.replace(tzinfo=timezone.utc)
+    return value.astimezone(timezone.utc)
+
+def supports_copy(db: Session) -> bool:
+    dialect = db.get_bind().dialect
+    return dialect.name == "postgresql" and dialect.driver in COPY_DRIVERS
+
+def insert_missing(db: Session, model, *index_elements) -> postgresql.Insert | sqlite.Insert:
+    """
+    Returns an INSERT into `model` that skips rows conflicting with an
+    existing row on the unique `index_elements`, e.g. a row another
+    session committed since they were looked up. With `.returning(...)`
+    only the inserted rows come back.
+
+    Only for SQLite and PostgreSQL sessions.
+    """
+    dialect = postgresql if db.get_bind().dialect.name == "postgresql" else sqlite
+    return dialect.insert(model).on_conflict_do_nothing(index_elements=list(index_elements))
+
+def copy_rows(db: Session, table: str, columns: Sequence[str], rows: Iterable[tuple]) -> None:
+    """
+    Streams `rows` into `table` with PostgreSQL's `COPY ... FROM STDIN`, in
+    the session's transaction. Much cheaper than INSERTs for bulk loads:
+    one statement and no per-row parameter binding.
+
+    Only for sessions where `supports_copy(db)` is true.
+
+    Args:
+        db (Session): Session on a psycopg or psycopg2 engine.
+        table (str): Table to load, e.g. a temporary staging table.
+        columns (Sequence[str]): Columns of `table` in the order of each row.
+        rows (Iterable[tuple]): Rows to load; consumed lazily with psycopg.
+    """
+    sql = f"COPY {table} ({', '.join(columns)}) FROM STDIN"
+    dbapi_connection = db.connection().connection.dbapi_connection
+
+    with dbapi_connection.cursor() as cursor:
+        if db.get_bind().dialect.driver == "psycopg":
+            with cursor.copy(sql) as copy:
+                for row in rows:
+                    copy.write_row(row)
+        else:
+            buffer = io.StringIO()
+            csv.writer(buffer).writerows(rows)
+            buffer.seek(0)
+            cursor.copy_expert(f"{sql} WITH (FORMAT csv)", buffer)
+
+def init_db(engine: Engine) -> None:
+    """
+    Creates any missing tables. Called from the app lifespan, not at import.
+
+    Side effects:
+    - Adds columns introduced since (`_ADDED_COLUMNS`) and their indexes to older databases.
+    - Deletes duplicate swimmers of older databases before making `(sw_club_id, sw_id)` unique.
+    - Seeds the default SCWR sync target if none are configured.
+    """
+    inspector = inspect(engine)
+    for table_name, column_name, constraints in _ADDED_COLUMNS:
+        if not inspector.has_table(table_name):
+            continue
+        columns = {c['name'] for c in inspector.get_columns(table_name)}
+        if column_name not in columns:
+            column_type = Base.metadata.tables[table_name].c[column_name].type.compile(dialect=engine.dialect)
+            with engine.begin() as conn:
+                conn.execute(text(f'ALTER TABLE {table_name} ADD COLUMN {column_name} {column_type} {constraints}'.rstrip()))
+
+    Base.metadata.create_all(engine)
+    _dedupe_swimmers(engine)
+
+    # create_all skips tables that already exist, so add indexes introduced since
+    for table in Base.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(engine, checkfirst=True)
+
+    with make_session_factory(engine)() as db:
+        if db.execute(select(SyncTarget.id).limit(1)).first() is None:
+            db.add(SyncTarget(sw_club_id=DEFAULT_CLUB_ID, season=2025, course='LCM', stroke=9))
+            db.commit()
+
+def _dedupe_swimmers(engine: Engine) -> None:
+    """
+    Makes `(sw_club_id, sw_id)` unique on databases that predate it: ones
+    without the index at all and ones with the old non-unique index, which
+    let a double submitted add create the same swimmer twice. The oldest
+    row of every duplicate is kept, the others are retired with their pbs;
+    `init_db` then creates the unique index.
+    """
+    indexes = {index['name']: index for index in inspect(engine).get_indexes('scwr_swimmers')}
+    index = indexes.get('ix_scwr_swimmers_club_sw_id')
+    if index is not None and index['unique']:
+        return
+
+    with make_session_factory(engine)() as db:
+        oldest = select(func.min(ClubSwimmer.id)).group_by(ClubSwimmer.sw_club_id, ClubSwimmer.sw_id)
+        removed = retire_athletes(db, ClubSwimmer.id.not_in(oldest))
+        db.commit()
+    if removed:
+        print(f"Removed {removed} duplicate swimmers")
+    if index is not None:
+        with engine.begin() as conn:
+            conn.execute(text('DROP INDEX ix_scwr_swimmers_club_sw_id'))
+
+def retire_athletes(db: Session, *criteria) -> int:
+    """
+    Deletes every swimmer matching `criteria` (e.g. `ClubSwimmer.id.in_(ids)`)
+    and all their pbs, in two statements however many swimmers match: the
+    pbs first, by subquery, so nothing is left behind even on a connection
+    without foreign key enforcement, then the swimmers.
+
+    No ORM objects are loaded. Objects of deleted rows already in the
+    session are not expired, don't use them afterwards.
+
+    Does not commit.
+
+    Returns:
+        int: Swimmers deleted.
+    """
+    athletes = select(ClubSwimmer.id).where(*criteria)
+    options = {"synchronize_session": False}
+    db.execute(delete(ClubSwimmerPb).where(ClubSwimmerPb.athlete_id.in_(athletes)), execution_options=options)
+    return db.execute(delete(ClubSwimmer).where(*criteria), execution_options=options).rowcount
+
+def purge_orphans(db: Session) -> int:
+    """
+    Deletes pbs whose swimmer no longer exists, e.g. left behind by deletes
+    on a SQLite connection without foreign key enforcement. One statement.
+
+    Does not commit.
+
+    Returns:
+        int: Pbs deleted.
+    """
+    orphaned = ~exists().where(ClubSwimmer.id == ClubSwimmerPb.athlete_id)
+    return db.execute(delete(ClubSwimmerPb).where(orphaned), execution_options={"synchronize_session": False}).rowcount
+
+def database_size(engine: Engine) -> Optional[int]:
+    """
+    Returns the size of the database in bytes, None for in-memory SQLite.
+    """
+    if engine.dialect.name == "sqlite":
+        with engine.connect() as conn:
+            pages = conn.execute(text("PRAGMA page_count")).scalar_one()
+            page_size = conn.execute(text("PRAGMA page_size")).scalar_one()
+        return pages * page_size if engine.url.database not in (None, "", ":memory:") else None
+    with engine.connect() as conn:
+        return conn.execute(select(func.pg_database_size(func.current_database()))).scalar_one()
 
-def get_db() -> Generator[Session, None, None]:
+def vacuum(engine: Engine) -> None:
+    """
+    Returns the space of deleted rows to the file system (SQLite: rebuilds
+    the file) or marks it reusable and refreshes planner statistics
+    (PostgreSQL: `VACUUM ANALYZE`). Runs outside a transaction; SQLite
+    locks the whole database meanwhile.
+    """
+    statement = "VACUUM" if engine.dialect.name == "sqlite" else "VACUUM ANALYZE"
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        conn.execute(text(statement))
+
+def make_session_factory(engine: Engine) -> sessionmaker:
+    return sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+def get_db(request: Request) -> Generator[Session, None, None]:
     """
     Provides a transactional scope around a series of database operations.
 
+    Args:
+        request (Request): The current request, whose app holds the session factory.
+
     Yields:
         Session: SQLAlchemy database session.
 
@@ -108,7 +471,19 @@ def get_db() -> Generator[Session, None, None]:
         This generator is intended to be used with FastAPI dependencies to
         provide a database session that is properly closed after use.
     """
-    db = SessionLocal()
+    db = request.app.state.session_factory()
+    try:
+        yield db
+    finally:
+        db.close()
+
+def get_read_db(request: Request) -> Generator[Session, None, None]:
+    """
+    Like `get_db`, but the session reads the current read snapshot (see
+    `snapshots.SnapshotStore`) instead of the database sync writes to.
+    Public pages use this so they never wait on or see a sync in progress.
+    """
+    db = request.app.state.snapshots.session_factory()()
     try:
         yield db
     finally:
@@ -0,0 +1,170 @@
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta, timezone
+from typing import Optional
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+from db import DiscoveryView, SyncTarget, as_utc
+from name_index import remember_athletes
+from scraper.base_scraper import ScraperError
+from scraper.swimrankings import SwimrankingsScraper, Swimmer
+from tracing import tracer
+
+# (season, course, stroke)
+View = tuple[int, str, int]
+
+COURSES = ("LCM", "SCM")
+# swimrankings.net style ids of the individual events a club ranking can be filtered on
+STROKES = (1, 2, 3, 5, 6, 8, 9, 10, 11, 13, 14, 15, 16, 17, 18, 26, 27, 28)
+# How long cached views are trusted before every view is scanned again
+RESCAN_AFTER = timedelta(days=30)
+
+@dataclass
+class Discovery:
+    """
+    A club roster assembled from several ranking views.
+
+    Attributes:
+        athletes (dict[int, Swimmer]): Athletes seen on a page scanned this run, keyed by `sw_id`.
+        keep (set[int]): Ids from cached views that failed to re-scan; they must not be deleted.
+        complete (bool): False if a never-seen view failed, so the roster may be missing people.
+        pages (int): Ranking pages requested this run.
+    """
+    athletes: dict[int, Swimmer] = field(default_factory=dict)
+    keep: set[int] = field(default_factory=set)
+    complete: bool = True
+    pages: int = 0
+
+def candidate_views(targets: list[SyncTarget], courses=COURSES, strokes=STROKES) -> list[View]:
+    """
+    Every view worth scanning for a club: its explicit targets, plus every
+    course/stroke combination of each targeted season.
+    """
+    views: dict[View, None] = {}
+    for target in targets:
+        views[(target.season, target.course, target.stroke)] = None
+    for season in sorted({t.season for t in targets}):
+        for course in courses:
+            for stroke in strokes:
+                views[(season, course, stroke)] = None
+    return list(views)
+
+def greedy_cover(ids: set[int], views: dict[View, set[int]]) -> list[View]:
+    """
+    Picks views until every id in `ids` is listed on at least one of them,
+    always taking the view that covers the most still-uncovered ids.
+
+    Greedy set cover isn't guaranteed minimal, but it is within a log factor
+    of it and rosters are small enough that it usually finds the optimum.
+    """
+    uncovered = set(ids)
+    remaining = dict(views)
+    cover = []
+
+    while uncovered and remaining:
+        view, members = max(remaining.items(), key=lambda item: len(item[1] & uncovered))
+        if not members & uncovered:
+            break
+        cover.append(view)
+        uncovered -= members
+        del remaining[view]
+
+    return cover
+
+def _load_cache(db: Session, sw_club_id: int) -> dict[View, DiscoveryView]:
+    stmt = select(DiscoveryView).filter_by(sw_club_id=sw_club_id)
+    return {(v.season, v.course, v.stroke): v for v in db.execute(stmt).scalars()}
+
+def _ids(view: DiscoveryView) -> set[int]:
+    return {int(i) for i in view.sw_ids.split(",") if i}
+
+@tracer.traced("sync.discovery")
+async def discover_roster(
+    db: Session,
+    scraper: SwimrankingsScraper,
+    sw_club_id: int,
+    targets: list[SyncTarget],
+    now: Optional[datetime] = None,
+    full: bool = False
+) -> Discovery:
+    """
+    Finds a club's athletes across many ranking views using as few requests as possible.
+
+    The first run (and every `RESCAN_AFTER`) scans every candidate view and
+    caches who each one listed. In between, only never-seen views plus a greedy
+    cover of the cached views are fetched. Anyone known who vanished from their
+    covering page is chased through the other cached views they appeared on,
+    so an athlete only drops off the roster once every view that listed them
+    has been re-scanned without them. `full` forces scanning every view.
+
+    Side effects:
+    - Scrapes swimrankings.net once per scanned view.
+    - Updates `discovery_views` and records every athlete listed in `known_athletes` (does not commit).
+
+    Raises:
+        ScraperError: If every page failed
+    """
+    now = now or datetime.now(timezone.utc)
+    result = Discovery()
+    cache = _load_cache(db, sw_club_id)
+    candidates = candidate_views(targets)
+    cached = {v: _ids(cache[v]) for v in candidates if v in cache}
+
+    oldest = min((as_utc(cache[v].scanned_at) for v in cached), default=None)
+    full = full or oldest is None or now - oldest > RESCAN_AFTER
+
+    if full:
+        to_scan = list(candidates)
+    else:
+        known = set().union(*cached.values())
+        to_scan = [v for v in candidates if v not in cached] + greedy_cover(known, cached)
+
+    scanned: dict[View, set[int]] = {}
+    failed: list[View] = []
+
+    async def scan(view: View) -> None:
+        season, course, stroke = view
+        result.pages += 1
+        try:
+            athletes = await scraper.fetch_club_athletes(sw_club_id, season, course, stroke)
+        except ScraperError as e:
+            print(e)
+            failed.append(view)
+            return
+
+        scanned[view] = {a.sw_id for a in athletes}
+        for athlete in athletes:
+            result.athletes.setdefault(athlete.sw_id, athlete)
+
+        row = cache.get(view)
+        if row is None:
+            row = DiscoveryView(sw_club_id=sw_club_id, season=season, course=course, stroke=stroke)
+            db.add(row)
+            cache[view] = row
+        row.sw_ids = ",".join(str(i) for i in sorted(scanned[view]))
+        row.scanned_at = now
+
+    for view in to_scan:
+        await scan(view)
+
+    if not full:
+        # Chase anyone who disappeared from the page that was covering them
+        known = set().union(*cached.values())
+        while True:
+            missing = known - set(result.athletes)
+            options = {v: ids & missing for v, ids in cached.items() if v not in scanned and v not in failed}
+            options = {v: ids for v, ids in options.items() if ids}
+            if not options:
+                break
+            await scan(max(options, key=lambda v: len(options[v])))
+
+    if failed and not scanned:
+        raise ScraperError(f"Failed to fetch any ranking page for club {sw_club_id}")
+
+    for view in failed:
+        if view in cached:
+            result.keep |= cached[view]
+        else:
+            result.complete = False
+
+    remember_athletes(db, result.athletes.values(), now)
+    return result
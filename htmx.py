@@ -1,13 +1,13 @@
 from fastapi import APIRouter, Request, Header, Depends
-from fastapi.responses import HTMLResponse, RedirectResponse
-from fastapi.templating import Jinja2Templates
-from typing import Annotated, Union
+from fastapi.responses import HTMLResponse, RedirectResponse, Response
+from typing import Annotated, Optional, Union
 from sqlalchemy import select
 from sqlalchemy.orm import Session
-from db import get_db, ClubSwimmer
+from db import get_read_db, ClubSwimmer
+from analytics import get_rankings
+from templating import templates
 
 router = APIRouter(prefix="/htmx")
-templates = Jinja2Templates(directory='templates/htmx')
 
 @router.get(
     "/page/home",
@@ -18,7 +18,7 @@ templates = Jinja2Templates(directory='templates/htmx')
 async def htmx_home(request: Request, hx_request: Annotated[Union[str, None], Header()] = None):
     if hx_request:
         response = templates.TemplateResponse(
-            request=request, name="index.html"
+            request=request, name="htmx/index.html"
         )
 
         response.headers["Hx-Push-Url"] = "/"
@@ -30,19 +30,22 @@ async def htmx_home(request: Request, hx_request: Annotated[Union[str, None], He
     "/page/athletes",
     response_class=HTMLResponse,
     summary='Returns the athletes page htmx fragment',
-    description='The page is just a list of swimmers in the db.'
+    description='The page is just a list of swimmers in the db, optionally only those of one `club`.'
 )
 async def htmx_athletes_page(
     request: Request,
-    db: Session = Depends(get_db),
+    db: Session = Depends(get_read_db),
+    club: Optional[int] = None,
     hx_request: Annotated[Union[str, None], Header()] = None
 ):
     stmt = select(ClubSwimmer)
+    if club is not None:
+        stmt = stmt.filter_by(sw_club_id=club)
     swimmers = db.execute(stmt).scalars().all()
 
     if hx_request:
         response = templates.TemplateResponse(
-            request=request, name="athletes.html", context={'swimmers': swimmers}
+            request=request, name="htmx/athletes.html", context={'swimmers': swimmers}
         )
 
         response.headers["HX-Push-Url"] = "/athletes"
@@ -54,30 +57,57 @@ async def htmx_athletes_page(
     "/page/athlete",
     response_class=HTMLResponse,
     summary='Returns portfolio of a specific swimmer as an htmx fragment',
-    description='Uses the `swimmer_id` to fetch data about that swimmer from the db. If that id isn\'t in the db, user gets redirected back to `/athletes`.'
+    description='Uses the `swimmer_id` to fetch data about that swimmer from the db, ranked within `club` if given (else the first club they are listed under). If that id isn\'t in the db, user gets redirected back to `/athletes`.'
 )
 async def htmx_specific_athlete_page(
     request: Request,
     sw_id: int,
-    db: Session = Depends(get_db),
+    db: Session = Depends(get_read_db),
+    club: Optional[int] = None,
     hx_request: Annotated[Union[str, None], Header()] = None
 ):
     if hx_request:
         stmt = select(ClubSwimmer).filter_by(sw_id=sw_id)
-        swimmer = db.execute(stmt).scalar_one_or_none()
+        if club is not None:
+            stmt = stmt.filter_by(sw_club_id=club)
+        swimmer = db.execute(stmt).scalars().first() # same athlete can be listed under several clubs
         if swimmer:
             if hx_request:
+                rankings = get_rankings(db).for_athlete(swimmer.id)
                 response = templates.TemplateResponse(
-                    request=request, name="athlete.html", context={'swimmer': swimmer}
+                    request=request, name="htmx/athlete.html", context={'swimmer': swimmer, 'rankings': rankings}
                 )
 
-                response.headers["HX-Push-Url"] = f"/athlete?sw_id={sw_id}"
+                response.headers["HX-Push-Url"] = f"/athlete?sw_id={sw_id}" if club is None else f"/athlete?sw_id={sw_id}&club={club}"
 
                 return response
         else:
             return RedirectResponse("/athletes", status_code=302)
     return RedirectResponse("/", status_code=302)
 
+@router.get(
+    "/page/rankings",
+    response_class=HTMLResponse,
+    summary='Returns the club rankings page htmx fragment',
+    description='Ranks every swimmer\'s PB against the rest of their club per event, course and gender, for every club or only `club`.'
+)
+async def htmx_rankings_page(
+    request: Request,
+    db: Session = Depends(get_read_db),
+    club: Optional[int] = None,
+    hx_request: Annotated[Union[str, None], Header()] = None
+):
+    if hx_request:
+        rankings = get_rankings(db)
+        response = templates.TemplateResponse(
+            request=request, name="htmx/rankings.html", context={'groups': rankings.groups(club), 'clubs': rankings.clubs(), 'club': club}
+        )
+
+        response.headers["HX-Push-Url"] = "/rankings" if club is None else f"/rankings?club={club}"
+
+        return response
+    return RedirectResponse("/", status_code=302)
+
 @router.get(
     "/page/records",
     response_class=HTMLResponse,
@@ -87,7 +117,7 @@ async def htmx_specific_athlete_page(
 async def htmx_records_page(request: Request, hx_request: Annotated[Union[str, None], Header()] = None):
     if hx_request:
         response = templates.TemplateResponse(
-            request=request, name="records.html"
+            request=request, name="htmx/records.html"
         )
 
         response.headers["Hx-Push-Url"] = "/records"
@@ -99,12 +129,16 @@ async def htmx_records_page(request: Request, hx_request: Annotated[Union[str, N
     "/page/meets",
     response_class=HTMLResponse,
     summary='Returns the meets page htmx fragment',
-    description='W.I.P.'
+    description='Shows the results of the meet followed live, if any, updated as they come in. While a meet is live the browser is sent to the full `/meets` page instead, the only public page loading the SSE extension.'
 )
 async def meets_page(request: Request, hx_request: Annotated[Union[str, None], Header()] = None):
     if hx_request:
+        live = request.app.state.live_meet
+        if live is not None and not live.done:
+            return Response(headers={"HX-Redirect": "/meets"})
+
         response = templates.TemplateResponse(
-            request=request, name="meets.html"
+            request=request, name="htmx/meets.html", context={'live': live}
         )
 
         response.headers["HX-Push-Url"] = "/meets"
@@ -0,0 +1,237 @@
+from dataclasses import astuple
+from datetime import datetime, timezone
+from typing import Callable, Iterable, Optional
+from fastapi import FastAPI
+from jinja2 import Environment
+from sqlalchemy import bindparam, insert, select
+from sqlalchemy.orm import Session, sessionmaker
+from db import ClubMeetResult, DEFAULT_CLUB_ID
+from metrics import LIVE_POLL_INTERVAL, LIVE_POLLS, LIVE_RESULTS
+from scraper.base_scraper import ScraperError
+from scraper.swimrankings import MeetResult, SwimrankingsScraper
+from snapshots import SnapshotStore
+from sync_events import EventLog
+from tracing import tracer
+import asyncio
+import time
+
+LIVE_MIN_INTERVAL = 15.0 # seconds between polls while results keep coming
+LIVE_MAX_INTERVAL = 300.0 # ceiling the interval backs off to when nothing changes
+LIVE_BACKOFF = 1.5 # interval growth per poll without new results
+LIVE_IDLE_TIMEOUT = 3 * 60 * 60 # a meet with nothing new for this long is over
+
+RESULT_COLUMNS = ("sw_result_id", "sw_id", "first_name", "last_name", "sw_style_id", "event", "course", "time", "pts")
+
+def next_interval(interval: float, changed: bool, min_interval: float, max_interval: float) -> float:
+    """
+    Seconds until the next poll: back to `min_interval` as soon as a poll
+    finds something new, otherwise `LIVE_BACKOFF` times longer, up to
+    `max_interval`.
+    """
+    if changed:
+        return min_interval
+    return min(max(interval, min_interval) * LIVE_BACKOFF, max_interval)
+
+def load_meet_results(db: Session, sw_meet_id: int, sw_club_id: int) -> dict[int, MeetResult]:
+    """
+    Returns the stored results of a club at a meet keyed by `sw_result_id`,
+    oldest first.
+    """
+    stmt = (
+        select(*(getattr(ClubMeetResult, column) for column in RESULT_COLUMNS))
+        .where(ClubMeetResult.sw_meet_id == sw_meet_id, ClubMeetResult.sw_club_id == sw_club_id)
+        .order_by(ClubMeetResult.seen_at, ClubMeetResult.id)
+    )
+    return {row.sw_result_id: MeetResult(*row) for row in db.execute(stmt)}
+
+def store_meet_results(
+    db: Session,
+    sw_meet_id: int,
+    sw_club_id: int,
+    results: Iterable[MeetResult],
+    stored: dict[int, MeetResult],
+    now: Optional[datetime] = None
+) -> tuple[list[MeetResult], list[MeetResult]]:
+    """
+    Diffs scraped results against `stored` (see `load_meet_results`) and
+    writes only the difference: new results in one bulk insert, corrected
+    ones (e.g. a time fixed or a disqualification) in one executemany
+    update. Results no longer listed are kept.
+
+    Does not commit.
+
+    Side effects:
+    - Updates `stored` to match what was written.
+
+    Returns:
+        tuple[list[MeetResult], list[MeetResult]]: The new and the changed results.
+    """
+    now = now or datetime.now(timezone.utc)
+    new, changed = [], []
+    for result in results:
+        old = stored.get(result.sw_result_id)
+        if old is None:
+            new.append(result)
+        elif old != result:
+            changed.append(result)
+
+    if new:
+        db.execute(insert(ClubMeetResult), [
+            {**dict(zip(RESULT_COLUMNS, astuple(result))), "sw_meet_id": sw_meet_id, "sw_club_id": sw_club_id, "seen_at": now}
+            for result in new
+        ])
+    if changed:
+        table = ClubMeetResult.__table__
+        stmt = (
+            table.update()
+            .where(table.c.sw_meet_id == sw_meet_id, table.c.sw_result_id == bindparam("b_sw_result_id"))
+            .values({**{column: bindparam(f"b_{column}") for column in RESULT_COLUMNS[1:]}, "seen_at": now})
+        )
+        db.execute(stmt, [{f"b_{column}": value for column, value in zip(RESULT_COLUMNS, astuple(result))} for result in changed])
+
+    for result in new + changed:
+        stored[result.sw_result_id] = result
+    return new, changed
+
+class LiveMeet(EventLog):
+    """
+    Follows one in-progress meet: polls the club's results page of
+    `sw_meet_id`, stores what's new and pushes only the new (and corrected)
+    result rows to every page listening, as server-sent events.
+
+    The poll interval adapts to the meet: it drops to `min_interval` when a
+    poll finds new results and grows by `LIVE_BACKOFF` with every poll that
+    doesn't, up to `max_interval`, so a session break or the night between
+    meet days costs a handful of requests. Polls go through the scraper's
+    shared rate limit, so a sync running at the same time slows the live
+    mode down instead of doubling the load on swimrankings.net. The meet is
+    considered over after `LIVE_IDLE_TIMEOUT` seconds without anything new.
+
+    Attributes:
+        sw_meet_id (int): swimrankings.net meet id.
+        sw_club_id (int): Club whose results are followed.
+        interval (float): Seconds until the next poll.
+        results (dict[int, MeetResult]): Every result stored so far by `sw_result_id`, in the order they appeared.
+        polls (int): Polls done so far.
+        last_poll (Optional[datetime]): When the last poll finished.
+        task (Optional[asyncio.Task]): The task polling the meet.
+    """
+    def __init__(self, sw_meet_id: int, sw_club_id: int = DEFAULT_CLUB_ID,
+                 min_interval: float = LIVE_MIN_INTERVAL, max_interval: float = LIVE_MAX_INTERVAL,
+                 env: Optional[Environment] = None):
+        super().__init__(env)
+        self.sw_meet_id = sw_meet_id
+        self.sw_club_id = sw_club_id
+        self.min_interval = min_interval
+        self.max_interval = max(max_interval, min_interval)
+        self.interval = min_interval
+        self.results: dict[int, MeetResult] = {}
+        self.polls = 0
+        self.last_poll: Optional[datetime] = None
+        self.task: Optional[asyncio.Task] = None
+        self._last_change = time.monotonic()
+        self._stop = asyncio.Event()
+
+    @property
+    def stopping(self) -> bool:
+        return self._stop.is_set() and not self.done
+
+    def stop(self) -> None:
+        """
+        Asks the poller to stop. A poll in flight (which may be retrying)
+        finishes first.
+        """
+        self._stop.set()
+
+    @tracer.traced("live.poll", root=True)
+    async def poll(self, scraper: SwimrankingsScraper, session_factory: sessionmaker) -> bool:
+        """
+        Fetches the results page once and publishes what changed.
+
+        Returns:
+            bool: Whether there were new or corrected results.
+        """
+        try:
+            results = await scraper.fetch_meet_results(self.sw_meet_id, self.sw_club_id)
+        except (ScraperError, ValueError) as e:
+            print(e)
+            LIVE_POLLS.inc(outcome="failed")
+            return False
+        finally:
+            self.polls += 1
+            self.last_poll = datetime.now(timezone.utc)
+
+        with session_factory() as db:
+            new, changed = store_meet_results(db, self.sw_meet_id, self.sw_club_id, results, self.results, self.last_poll)
+            db.commit()
+
+        LIVE_POLLS.inc(outcome="changed" if new or changed else "unchanged")
+        if not new and not changed:
+            return False
+
+        LIVE_RESULTS.inc(len(new), kind="new")
+        LIVE_RESULTS.inc(len(changed), kind="changed")
+        html = self.env.get_template("htmx/live_results_event.html").render(new=new, changed=changed)
+        self.publish("results", html)
+        return True
+
+    async def run(
+        self,
+        session_factory: sessionmaker,
+        scraper_factory: Callable[[], SwimrankingsScraper],
+        snapshots: Optional[SnapshotStore] = None
+    ) -> None:
+        try:
+            with session_factory() as db:
+                self.results = load_meet_results(db, self.sw_meet_id, self.sw_club_id)
+
+            async with scraper_factory() as scraper:
+                while not self._stop.is_set():
+                    changed = await self.poll(scraper, session_factory)
+                    if changed:
+                        self._last_change = time.monotonic()
+                    elif time.monotonic() - self._last_change > LIVE_IDLE_TIMEOUT:
+                        break
+                    self.interval = next_interval(self.interval, changed, self.min_interval, self.max_interval)
+                    LIVE_POLL_INTERVAL.set(self.interval)
+                    try:
+                        await asyncio.wait_for(self._stop.wait(), self.interval)
+                    except TimeoutError:
+                        pass
+
+            if snapshots is not None:
+                await snapshots.publish_async()
+        except Exception as e:
+            print(e)
+        finally:
+            self.done = True
+            LIVE_POLL_INTERVAL.set(0)
+            self.publish("done", self.env.get_template("htmx/live_results_event.html").render(live=self))
+
+def start_live_meet(
+    app: FastAPI,
+    scraper_factory: Callable[[], SwimrankingsScraper],
+    sw_meet_id: int,
+    sw_club_id: int = DEFAULT_CLUB_ID
+) -> LiveMeet:
+    """
+    Returns the app's live meet for `sw_meet_id`, starting to follow it if
+    it isn't already. Only one meet is followed at a time: a live meet of
+    another meet is stopped.
+
+    Side effects:
+    - Sets `app.state.live_meet`.
+    """
+    live = app.state.live_meet
+    if live is not None and not live.done:
+        if (live.sw_meet_id, live.sw_club_id) == (sw_meet_id, sw_club_id):
+            return live
+        live.stop()
+
+    settings = app.state.settings
+    live = LiveMeet(
+        sw_meet_id, sw_club_id, settings.live_min_interval, settings.live_max_interval, app.state.templates.env
+    )
+    live.task = asyncio.create_task(live.run(app.state.session_factory, scraper_factory, app.state.snapshots))
+    app.state.live_meet = live
+    return live
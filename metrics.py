@@ -0,0 +1,253 @@
+from fastapi import APIRouter, Request
+from fastapi.responses import PlainTextResponse
+from sqlalchemy import Engine, event
+from typing import Iterable
+import threading
+import time
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+class _Metric:
+    """
+    Base class for a labelled metric rendered in the Prometheus text format.
+    """
+    kind = "untyped"
+
+    def __init__(self, name: str, documentation: str, labelnames: Iterable[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        REGISTRY.append(self)
+
+    def _key(self, labels: dict) -> tuple:
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def _fmt_labels(self, key: tuple, extra: str = "") -> str:
+        parts = [f'{n}="{_escape(v)}"' for n, v in zip(self.labelnames, key)]
+        if extra:
+            parts.append(extra)
+        return "{" + ",".join(parts) + "}" if parts else ""
+
+    def samples(self) -> list[str]:
+        raise NotImplementedError
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        lines.extend(self.samples())
+        return "\n".join(lines)
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._values: dict[tuple, float] = {}
+
+    def inc(self, amount: float = 1.0, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def value(self, **labels) -> float:
+        return self._values.get(self._key(labels), 0.0)
+
+    def samples(self) -> list[str]:
+        with self._lock:
+            items = list(self._values.items())
+        return [f"{self.name}{self._fmt_labels(k)} {_fmt(v)}" for k, v in items]
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def set(self, value: float, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Iterable[str] = (), buckets: tuple = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # key -> [bucket counts..., sum, count]
+        self._values: dict[tuple, list[float]] = {}
+
+    def observe(self, value: float, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            data = self._values.get(key)
+            if data is None:
+                data = [0.0] * (len(self.buckets) + 2)
+                self._values[key] = data
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    data[i] += 1
+            data[-2] += value
+            data[-1] += 1
+
+    def samples(self) -> list[str]:
+        with self._lock:
+            items = [(k, list(v)) for k, v in self._values.items()]
+        lines = []
+        for key, data in items:
+            for bound, count in zip(self.buckets, data):
+                le = 'le="' + _fmt(bound) + '"'
+                lines.append(f"{self.name}_bucket{self._fmt_labels(key, le)} {_fmt(count)}")
+            le = 'le="+Inf"'
+            lines.append(f"{self.name}_bucket{self._fmt_labels(key, le)} {_fmt(data[-1])}")
+            lines.append(f"{self.name}_sum{self._fmt_labels(key)} {_fmt(data[-2])}")
+            lines.append(f"{self.name}_count{self._fmt_labels(key)} {_fmt(data[-1])}")
+        return lines
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def _fmt(value: float) -> str:
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+REGISTRY: list[_Metric] = []
+
+HTTP_REQUEST_DURATION = Histogram(
+    "http_request_duration_seconds", "Time spent handling a request.", ("method", "route", "status")
+)
+HTTP_COMPRESSION_BYTES_IN = Counter(
+    "http_compression_bytes_in_total", "Response body bytes before compression.", ("encoding",)
+)
+HTTP_COMPRESSION_BYTES_OUT = Counter(
+    "http_compression_bytes_out_total", "Response body bytes sent after compression.", ("encoding",)
+)
+DB_QUERIES = Counter(
+    "db_queries_total", "SQL statements executed.", ("statement",)
+)
+DB_QUERY_DURATION = Histogram(
+    "db_query_duration_seconds", "Time spent executing SQL statements.", ("statement",)
+)
+SCRAPER_FETCH_DURATION = Histogram(
+    "scraper_fetch_duration_seconds", "Latency of upstream swimrankings.net fetches."
+)
+SCRAPER_FETCH_RESPONSES = Counter(
+    "scraper_fetch_responses_total", "Upstream fetches by HTTP status code.", ("status",)
+)
+SCRAPER_RATE_LIMIT_WAIT = Histogram(
+    "scraper_rate_limit_wait_seconds", "Time fetches spent waiting on the rate limiter.",
+    buckets=(0.01, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+)
+SCRAPER_CIRCUIT_OPEN = Counter(
+    "scraper_circuit_open_total", "Times the scraper circuit breaker paused fetching."
+)
+SCRAPER_RETRIES = Counter(
+    "scraper_retries_total", "Upstream fetches that were retried."
+)
+SCRAPER_COALESCED = Counter(
+    "scraper_coalesced_total", "Scrapes that joined an identical one already in flight instead of fetching.", ("parser",)
+)
+SCRAPER_ARCHIVED_PAGES = Counter(
+    "scraper_archived_pages_total", "Fetched pages written to the page archive (new content or a duplicate of a stored body).", ("stored",)
+)
+SCRAPER_ARCHIVED_BYTES = Counter(
+    "scraper_archived_bytes_total", "Compressed bytes written to the page archive."
+)
+TRACE_SPANS = Counter(
+    "trace_spans_total", "Finished trace spans by export outcome (exported, dropped, failed).", ["outcome"]
+)
+NAME_INDEX_LOOKUPS = Counter(
+    "name_index_lookups_total", "Add-swimmer name lookups by outcome (hit: resolved locally, miss: searched swimrankings.net).", ("result",)
+)
+SYNC_LAST_DURATION = Gauge(
+    "sync_last_duration_seconds", "Wall time of the last swimmer sync."
+)
+SYNC_LAST_TIMESTAMP = Gauge(
+    "sync_last_timestamp_seconds", "Unix time the last swimmer sync finished."
+)
+SYNC_LAST_ROWS = Gauge(
+    "sync_last_rows", "Rows touched by the last swimmer sync.", ("kind",)
+)
+SYNC_LAST_PEAK_MEMORY = Gauge(
+    "sync_last_peak_memory_bytes", "Peak Python heap of the last swimmer sync run with memory tracing."
+)
+LIVE_POLLS = Counter(
+    "live_polls_total", "Polls of a live meet's results page by outcome (changed, unchanged, failed).", ("outcome",)
+)
+LIVE_RESULTS = Counter(
+    "live_results_total", "Meet results pushed by the live mode.", ("kind",)
+)
+LIVE_POLL_INTERVAL = Gauge(
+    "live_poll_interval_seconds", "Current adaptive interval between live meet polls, 0 when no meet is followed."
+)
+SNAPSHOT_TIMESTAMP = Gauge(
+    "read_snapshot_timestamp_seconds", "Unix time the read snapshot public pages are served from was published."
+)
+SNAPSHOT_PUBLISH_DURATION = Histogram(
+    "read_snapshot_publish_duration_seconds", "Time spent copying the database into a new read snapshot."
+)
+
+def render() -> str:
+    return "\n".join(metric.render() for metric in REGISTRY) + "\n"
+
+def statement_kind(statement: str) -> str:
+    word = statement.lstrip().split(None, 1)[0].lower() if statement.strip() else ""
+    return word if word in ("select", "insert", "update", "delete") else "other"
+
+def instrument_engine(engine: Engine) -> None:
+    """
+    Counts and times every statement executed on `engine`, failed ones
+    included.
+
+    The start time lives on the statement's execution context rather than
+    the connection, so a statement that raises leaves nothing behind on a
+    pooled connection.
+    """
+    @event.listens_for(engine, "before_cursor_execute")
+    def _before(conn, cursor, statement, parameters, context, executemany):
+        if context is not None:
+            context._metrics_start = time.perf_counter()
+
+    def observe(statement: str, context) -> None:
+        start = getattr(context, "_metrics_start", None)
+        if start is None:
+            return
+        del context._metrics_start
+        kind = statement_kind(statement)
+        DB_QUERIES.inc(statement=kind)
+        DB_QUERY_DURATION.observe(time.perf_counter() - start, statement=kind)
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def _after(conn, cursor, statement, parameters, context, executemany):
+        observe(statement, context)
+
+    @event.listens_for(engine, "handle_error")
+    def _error(exception_context):
+        if exception_context.statement is not None:
+            observe(exception_context.statement, exception_context.execution_context)
+
+async def metrics_middleware(request: Request, call_next):
+    """
+    Records request latency labelled by route template rather than raw path,
+    so `/athlete?sw_id=...` doesn't explode the label set.
+    """
+    start = time.perf_counter()
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+        return response
+    finally:
+        route = request.scope.get("route")
+        path = getattr(route, "path", None) or "unmatched"
+        HTTP_REQUEST_DURATION.observe(
+            time.perf_counter() - start,
+            method=request.method, route=path, status=status
+        )
+
+router = APIRouter()
+
+@router.get(
+    "/metrics",
+    response_class=PlainTextResponse,
+    summary='Prometheus metrics',
+    description='Request, database, scraper and sync metrics in the Prometheus text format.'
+)
+async def metrics_endpoint():
+    return PlainTextResponse(render(), media_type="text/plain; version=0.0.4; charset=utf-8")
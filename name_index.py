@@ -0,0 +1,195 @@
+from collections import Counter
+from datetime import datetime, timezone
+from typing import Iterable, Optional
+from sqlalchemy import func, insert, select, update
+from sqlalchemy.orm import Session
+from db import ClubSwimmer, KnownAthlete
+from scraper.swimrankings import Gender, Swimmer
+import re
+import unicodedata
+import weakref
+
+# Letters NFKD doesn't decompose into a base letter plus accent
+_FOLD = str.maketrans({"ø": "o", "ł": "l", "đ": "d", "ħ": "h", "ı": "i", "æ": "ae", "œ": "oe", "þ": "th"})
+_NON_WORD = re.compile(r"[\W_]+")
+
+def normalize(name: str) -> str:
+    """
+    Lower-cases a name and strips accents and punctuation, so
+    `"Müller-Lüdenscheidt, José"` becomes `"muller ludenscheidt jose"`.
+    """
+    decomposed = unicodedata.normalize("NFKD", name.casefold().translate(_FOLD))
+    stripped = "".join(c for c in decomposed if not unicodedata.combining(c))
+    return " ".join(_NON_WORD.sub(" ", stripped).split())
+
+def name_key(name: str) -> tuple[str, ...]:
+    """
+    The normalized tokens of a name in sorted order, so `"First, Last"` and
+    `"Last First"` get the same key.
+    """
+    return tuple(sorted(normalize(name).split()))
+
+def trigrams(name: str) -> set[str]:
+    """
+    Character trigrams of every token, padded like PostgreSQL's `pg_trgm`
+    (two spaces in front, one behind), so short names and word starts count.
+    """
+    grams = set()
+    for token in normalize(name).split():
+        padded = f"  {token} "
+        grams.update(padded[i:i + 3] for i in range(len(padded) - 2))
+    return grams
+
+class NameIndex:
+    """
+    In-memory index over athlete names for resolving typed names to athletes.
+
+    Exact lookups go through a dict keyed by `name_key` (accent, case,
+    punctuation and word order insensitive). Suggestions rank athletes by
+    trigram similarity (shared trigrams over the union, like `pg_trgm`),
+    scoring only athletes that share at least one trigram with the query.
+
+    Attributes:
+        athletes (list[Swimmer]): Every indexed athlete, one per `sw_id`.
+    """
+    def __init__(self, athletes: Iterable[Swimmer]):
+        self.athletes: list[Swimmer] = []
+        self._by_id: dict[int, int] = {}
+        self._by_key: dict[tuple[str, ...], list[int]] = {}
+        self._postings: dict[str, list[int]] = {}
+        self._sizes: list[int] = []
+
+        for athlete in athletes:
+            if athlete.sw_id in self._by_id:
+                continue
+            i = len(self.athletes)
+            self.athletes.append(athlete)
+            self._by_id[athlete.sw_id] = i
+            full_name = f"{athlete.first_name} {athlete.last_name}"
+            self._by_key.setdefault(name_key(full_name), []).append(i)
+            grams = trigrams(full_name)
+            self._sizes.append(len(grams))
+            for gram in grams:
+                self._postings.setdefault(gram, []).append(i)
+
+    def __len__(self) -> int:
+        return len(self.athletes)
+
+    def get(self, sw_id: int) -> Optional[Swimmer]:
+        i = self._by_id.get(sw_id)
+        return self.athletes[i] if i is not None else None
+
+    def matches(self, name: str) -> list[Swimmer]:
+        """
+        Returns every athlete whose name is `name` up to accents, case,
+        punctuation and word order.
+        """
+        return [self.athletes[i] for i in self._by_key.get(name_key(name), ())]
+
+    def resolve(self, name: str) -> Optional[Swimmer]:
+        """
+        Returns the athlete called `name`, or None if nobody or more than one
+        athlete has that name.
+        """
+        hits = self.matches(name)
+        return hits[0] if len(hits) == 1 else None
+
+    def suggest(self, name: str, limit: int = 5, min_score: float = 0.3) -> list[tuple[Swimmer, float]]:
+        """
+        Returns up to `limit` athletes with names similar to `name`, most
+        similar first, with their similarity score (0 to 1).
+        """
+        grams = trigrams(name)
+        shared = Counter()
+        for gram in grams:
+            shared.update(self._postings.get(gram, ()))
+
+        scored = []
+        for i, n in shared.items():
+            score = n / (len(grams) + self._sizes[i] - n)
+            if score >= min_score:
+                scored.append((score, i))
+        scored.sort(key=lambda item: (-item[0], self.athletes[item[1]].last_name, self.athletes[item[1]].first_name))
+        return [(self.athletes[i], score) for score, i in scored[:limit]]
+
+def remember_athletes(db: Session, athletes: Iterable[Swimmer], now: Optional[datetime] = None) -> None:
+    """
+    Records athletes the scraper has seen in `known_athletes`. New athletes
+    are inserted and ones whose details changed updated, in one bulk
+    statement each; athletes seen before without changes aren't written.
+
+    Does not commit.
+    """
+    now = now or datetime.now(timezone.utc)
+    athletes = {athlete.sw_id: athlete for athlete in athletes}
+    if not athletes:
+        return
+
+    stmt = (
+        select(KnownAthlete.sw_id, KnownAthlete.birth_year, KnownAthlete.first_name, KnownAthlete.last_name, KnownAthlete.gender)
+        .where(KnownAthlete.sw_id.in_(list(athletes)))
+    )
+    stored = {row.sw_id: tuple(row) for row in db.execute(stmt)}
+    inserts, updates = [], []
+
+    for athlete in athletes.values():
+        row = {
+            "sw_id": athlete.sw_id,
+            "birth_year": athlete.birth_year,
+            "first_name": athlete.first_name,
+            "last_name": athlete.last_name,
+            "gender": athlete.gender.value,
+        }
+        old = stored.get(athlete.sw_id)
+        if old == tuple(row.values()):
+            continue
+        row["seen_at"] = now
+        (inserts if old is None else updates).append(row)
+
+    if inserts:
+        db.execute(insert(KnownAthlete), inserts)
+    if updates:
+        db.execute(update(KnownAthlete), updates)
+
+def data_version(db: Session) -> tuple:
+    """
+    Returns a cheap fingerprint of the athletes the index is built from.
+    """
+    known_stmt = select(func.count(KnownAthlete.sw_id), func.max(KnownAthlete.seen_at))
+    swimmer_stmt = select(func.count(ClubSwimmer.id), func.max(ClubSwimmer.id), func.max(ClubSwimmer.updated_at))
+    return tuple(db.execute(known_stmt).one()) + tuple(db.execute(swimmer_stmt).one())
+
+def load_name_index(db: Session) -> NameIndex:
+    """
+    Builds the index from `known_athletes` plus the synced rosters (which
+    cover athletes added before `known_athletes` existed).
+    """
+    known = db.execute(select(
+        KnownAthlete.sw_id, KnownAthlete.birth_year, KnownAthlete.first_name, KnownAthlete.last_name, KnownAthlete.gender
+    ))
+    rostered = db.execute(select(
+        ClubSwimmer.sw_id, ClubSwimmer.birth_year, ClubSwimmer.first_name, ClubSwimmer.last_name, ClubSwimmer.gender
+    ))
+    return NameIndex(
+        Swimmer(sw_id, birth_year, first_name, last_name, Gender(gender))
+        for rows in (known, rostered)
+        for sw_id, birth_year, first_name, last_name, gender in rows
+    )
+
+# Keyed by engine so separate apps (e.g. tests) never share an index
+_cache: "weakref.WeakKeyDictionary[object, tuple[tuple, NameIndex]]" = weakref.WeakKeyDictionary()
+
+def get_name_index(db: Session) -> NameIndex:
+    """
+    Returns the name index, rebuilding it only when the data version changed.
+    """
+    version = data_version(db)
+    engine = db.get_bind()
+    cached: Optional[tuple[tuple, NameIndex]] = _cache.get(engine)
+
+    if cached is not None and cached[0] == version:
+        return cached[1]
+
+    index = load_name_index(db)
+    _cache[engine] = (version, index)
+    return index
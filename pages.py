@@ -1,12 +1,13 @@
-from fastapi import APIRouter, Request, Depends
-from fastapi.responses import HTMLResponse, RedirectResponse
-from fastapi.templating import Jinja2Templates
+from fastapi import APIRouter, Request, Depends, Header, status
+from fastapi.responses import HTMLResponse, RedirectResponse, Response, StreamingResponse
 from sqlalchemy.orm import Session
+from typing import Annotated, Optional, Union
 from sqlalchemy import select
-from db import get_db, ClubSwimmer
+from db import get_read_db, ClubSwimmer
+from analytics import get_rankings
+from templating import templates
 
 router = APIRouter()
-templates = Jinja2Templates(directory="templates")
 
 @router.get(
     "/",
@@ -23,13 +24,16 @@ async def index(request: Request):
     "/athletes",
     response_class=HTMLResponse,
     summary='Returns the athletes page',
-    description='The page is just a list of swimmers in the db.'
+    description='The page is just a list of swimmers in the db, optionally only those of one `club`.'
 )
 async def athletes_page(
     request: Request,
-    db: Session = Depends(get_db),
+    db: Session = Depends(get_read_db),
+    club: Optional[int] = None,
 ):
     stmt = select(ClubSwimmer)
+    if club is not None:
+        stmt = stmt.filter_by(sw_club_id=club)
     swimmers = db.execute(stmt).scalars().all()
 
     return templates.TemplateResponse(
@@ -40,23 +44,44 @@ async def athletes_page(
     "/athlete",
     response_class=HTMLResponse,
     summary='Returns portfolio of a specific swimmer',
-    description='Uses the `sw_id` to fetch data about that swimmer from the db. If that id isn\'t in the db, user gets redirected back to `/athletes`.'
+    description='Uses the `sw_id` to fetch data about that swimmer from the db, ranked within `club` if given (else the first club they are listed under). If that id isn\'t in the db, user gets redirected back to `/athletes`.'
 )
 async def specific_athlete_page(
     request: Request,
     sw_id: int,
-    db: Session = Depends(get_db),
+    db: Session = Depends(get_read_db),
+    club: Optional[int] = None,
 ):
     stmt = select(ClubSwimmer).filter_by(sw_id=sw_id)
-    swimmer = db.execute(stmt).scalar_one_or_none()
+    if club is not None:
+        stmt = stmt.filter_by(sw_club_id=club)
+    swimmer = db.execute(stmt).scalars().first() # same athlete can be listed under several clubs
     if swimmer:
+        rankings = get_rankings(db).for_athlete(swimmer.id)
         return templates.TemplateResponse(
-            request=request, name="athlete.html", context={'swimmer': swimmer}
+            request=request, name="athlete.html", context={'swimmer': swimmer, 'rankings': rankings}
         )
     
     else:
         return RedirectResponse("/athletes", status_code=302)
 
+@router.get(
+    "/rankings",
+    response_class=HTMLResponse,
+    summary='Returns the club rankings page',
+    description='Ranks every swimmer\'s PB against the rest of their club per event, course and gender, for every club or only `club`.'
+)
+async def rankings_page(
+    request: Request,
+    db: Session = Depends(get_read_db),
+    club: Optional[int] = None,
+):
+    rankings = get_rankings(db)
+
+    return templates.TemplateResponse(
+        request=request, name="rankings.html", context={'groups': rankings.groups(club), 'clubs': rankings.clubs(), 'club': club}
+    )
+
 @router.get(
     "/records",
     response_class=HTMLResponse,
@@ -72,9 +97,33 @@ async def records_page(request: Request):
     "/meets",
     response_class=HTMLResponse,
     summary='Returns the meets page',
-    description='W.I.P.'
+    description='Shows the results of the meet followed live, if any, updated as they come in.'
 )
 async def meets_page(request: Request):
     return templates.TemplateResponse(
-        request=request, name="meets.html"
+        request=request, name="meets.html", context={'live': request.app.state.live_meet}
+    )
+
+@router.get(
+    "/meets/live/events",
+    summary='Server-sent events with the new results of the meet followed live',
+    description='Streams a `results` event with the rows of every batch of new (or corrected) results from message `start` on (the meets page passes how many it already rendered), and a final `done` event when the live mode stops. Reconnecting with `Last-Event-ID` resumes the stream.'
+)
+async def live_meet_events(
+    request: Request,
+    start: int = 0,
+    last_event_id: Annotated[Union[str, None], Header(alias="Last-Event-ID")] = None
+):
+    live = request.app.state.live_meet
+
+    if live is not None and last_event_id:
+        start = live.parse_event_id(last_event_id)
+    if live is None or start is None:
+        # Nothing followed, or a reconnect to a live mode that's gone: 204 stops the browser retrying
+        return Response(status_code=status.HTTP_204_NO_CONTENT)
+
+    return StreamingResponse(
+        live.stream(start),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
     )
@@ -0,0 +1,127 @@
+from collections import Counter
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from typing import Optional
+from fastapi import Request
+from sqlalchemy import Engine, event
+from starlette.middleware.base import BaseHTTPMiddleware
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+class QueryBudgetExceeded(Exception):
+    """A request issued more SQL statements than its configured budget."""
+
+@dataclass
+class QueryProfile:
+    """
+    Every SQL statement issued while handling one request.
+
+    Attributes:
+        statements (list[tuple[str, float]]): Statement text and duration in seconds, in order.
+    """
+    statements: list[tuple[str, float]] = field(default_factory=list)
+
+    @property
+    def count(self) -> int:
+        return len(self.statements)
+
+    @property
+    def duration(self) -> float:
+        return sum(d for _, d in self.statements)
+
+    def repeated(self, threshold: int) -> dict[str, int]:
+        """
+        Returns statements issued at least `threshold` times.
+
+        Statements are compared on their parameterised text, so the same
+        `SELECT ... WHERE id = ?` run once per row shows up here as a probable N+1.
+        """
+        counts = Counter(statement for statement, _ in self.statements)
+        return {s: n for s, n in counts.items() if n >= threshold}
+
+_current: ContextVar[Optional[QueryProfile]] = ContextVar("query_profile", default=None)
+
+def instrument_engine(engine: Engine) -> None:
+    """
+    Records statements on `engine` into the profile of the current request, if any.
+    """
+    @event.listens_for(engine, "before_cursor_execute")
+    def _before(conn, cursor, statement, parameters, context, executemany):
+        if _current.get() is not None and context is not None:
+            # On the execution context, so a failing statement leaves nothing
+            # behind on the pooled connection
+            context._profile_start = time.perf_counter()
+
+    def record(statement: str, context) -> None:
+        profile = _current.get()
+        start = getattr(context, "_profile_start", None)
+        if profile is not None and start is not None:
+            del context._profile_start
+            profile.statements.append((statement, time.perf_counter() - start))
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def _after(conn, cursor, statement, parameters, context, executemany):
+        record(statement, context)
+
+    @event.listens_for(engine, "handle_error")
+    def _error(exception_context):
+        if exception_context.statement is not None:
+            record(exception_context.statement, exception_context.execution_context)
+
+class QueryProfilerMiddleware(BaseHTTPMiddleware):
+    """
+    Opt-in per-request SQL profiler.
+
+    Adds a `Server-Timing` header with the statement count and total DB time,
+    logs statements repeated `repeat_threshold` or more times as probable N+1s,
+    and enforces a budget (max statements per request): `budgets` of the
+    route's path (e.g. `/athlete/{sw_id}`), else `budget`. With `strict` a
+    request over budget raises `QueryBudgetExceeded`, which is how tests fail
+    on it.
+    """
+    def __init__(
+        self,
+        app,
+        budget: Optional[int] = None,
+        repeat_threshold: int = 5,
+        strict: bool = False,
+        budgets: Optional[dict[str, int]] = None
+    ):
+        super().__init__(app)
+        self.budget = budget
+        self.budgets = budgets or {}
+        self.repeat_threshold = repeat_threshold
+        self.strict = strict
+
+    def budget_for(self, route: str) -> Optional[int]:
+        return self.budgets.get(route, self.budget)
+
+    async def dispatch(self, request: Request, call_next):
+        profile = QueryProfile()
+        token = _current.set(profile)
+        try:
+            response = await call_next(request)
+        finally:
+            _current.reset(token)
+
+        route = getattr(request.scope.get("route"), "path", request.url.path)
+        repeated = profile.repeated(self.repeat_threshold)
+
+        for statement, n in repeated.items():
+            logger.warning("Probable N+1 on %s %s: %d x %s", request.method, route, n, " ".join(statement.split()))
+
+        timing = f'db;dur={profile.duration * 1000:.2f};desc="{profile.count} queries"'
+        if repeated:
+            timing += f', db-repeat;desc="{len(repeated)} repeated statements"'
+        response.headers.append("Server-Timing", timing)
+
+        budget = self.budget_for(route)
+        if budget is not None and profile.count > budget:
+            message = f"{request.method} {route} issued {profile.count} queries (budget {budget})"
+            if self.strict:
+                raise QueryBudgetExceeded(message)
+            logger.warning(message)
+
+        return response
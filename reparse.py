@@ -0,0 +1,188 @@
+from concurrent.futures import Executor
+from dataclasses import dataclass, field
+from itertools import repeat
+from datetime import datetime, timedelta, timezone
+from typing import Iterable, Iterator, Optional
+from urllib.parse import parse_qs, urlsplit
+from sqlalchemy import select
+from sqlalchemy.orm import Session, sessionmaker
+from db import ClubSwimmer, as_utc
+from live import load_meet_results, store_meet_results
+from name_index import remember_athletes
+from scraper.archive import ArchivedPage, PageArchive
+from scraper.base_scraper import ScraperError
+from scraper.swimrankings import Swimmer, page_parser, parse_athlete_pbs, parse_athlete_search, parse_meet_results
+from sync import COPY_BATCH, SyncResult, write_pbs
+from tracing import tracer
+
+PARSE_WINDOW = 256 # archived pages in flight to the parse pool
+CHECK_SLACK = timedelta(minutes=10) # sync stamps pbs_checked_at a little after it fetched the page
+
+@dataclass
+class ReparseResult:
+    """
+    Totals of a re-parse of the page archive.
+
+    Attributes:
+        pages (int): Archived pages read (the latest fetch of every URL).
+        skipped (int): Athlete pages older than the pbs already stored (see `reparse_archive`).
+        failed (list[str]): URLs whose archived page couldn't be read or parsed.
+        athletes_seen (int): Athletes recorded in `known_athletes` from ranking and search pages.
+        meet_results (int): Meet results inserted or corrected.
+        pbs (SyncResult): Pb writes, counted like a sync.
+    """
+    pages: int = 0
+    skipped: int = 0
+    failed: list[str] = field(default_factory=list)
+    athletes_seen: int = 0
+    meet_results: int = 0
+    pbs: SyncResult = field(default_factory=SyncResult)
+
+    def rows(self) -> dict[str, int]:
+        return {
+            "pages": self.pages,
+            "pages_skipped": self.skipped,
+            "pages_failed": len(self.failed),
+            "athletes_seen": self.athletes_seen,
+            "meet_results": self.meet_results,
+            "pbs_inserted": self.pbs.pbs_inserted,
+            "pbs_updated": self.pbs.pbs_updated,
+            "pbs_unchanged": self.pbs.pbs_unchanged,
+            "pbs_deleted": self.pbs.pbs_deleted,
+        }
+
+def parse_archived(root: str, page: ArchivedPage) -> tuple[ArchivedPage, object, Optional[str]]:
+    """
+    Reads one archived page and parses it with the current parser for its
+    URL. Module level so a worker process can run it.
+
+    Returns:
+        tuple[ArchivedPage, object, Optional[str]]: The page, what the parser returned and an error message (parsed is None then).
+    """
+    try:
+        return page, page_parser(page.url)(PageArchive(root).read(page)), None
+    except (OSError, ScraperError, ValueError) as e:
+        return page, None, f"{type(e).__name__}: {e}"
+
+def _query_int(url: str, name: str) -> int:
+    return int(parse_qs(urlsplit(url).query)[name][0])
+
+def _parsed_pages(archive: PageArchive, pages: list[ArchivedPage], pool: Optional[Executor]) -> Iterator[tuple]:
+    if pool is None:
+        yield from map(parse_archived, repeat(archive.root), pages)
+        return
+
+    # `Executor.map` submits everything at once and keeps every result until
+    # it is consumed, so submit a window at a time, the next one while the
+    # current one is written. Results come back in order, a few pages per
+    # round trip to keep IPC cheap.
+    pending = None
+    for start in range(0, len(pages), PARSE_WINDOW):
+        window = pages[start:start + PARSE_WINDOW]
+        submitted = pool.map(parse_archived, repeat(archive.root, len(window)), window, chunksize=16)
+        if pending is not None:
+            yield from pending
+        pending = submitted
+    if pending is not None:
+        yield from pending
+
+def _write_athlete_pages(
+    db: Session,
+    parsed: list[tuple[ArchivedPage, object]],
+    result: ReparseResult,
+    force: bool
+) -> None:
+    by_sw_id = {_query_int(page.url, "athleteId"): (page, pbs) for page, pbs in parsed}
+    swimmers = db.execute(select(ClubSwimmer).where(ClubSwimmer.sw_id.in_(list(by_sw_id)))).scalars().all()
+
+    items, checked = [], []
+    for swimmer in swimmers:
+        page, pbs = by_sw_id[swimmer.sw_id]
+        if not force and swimmer.pbs_checked_at is not None and as_utc(swimmer.pbs_checked_at) > page.fetched_at + CHECK_SLACK:
+            # A sync stored newer pbs than this page has (e.g. archiving was off for a while)
+            result.skipped += 1
+            continue
+        items.append((swimmer, pbs))
+        checked.append((swimmer, page.fetched_at))
+
+    write_pbs(db, items, result.pbs)
+    for swimmer, fetched_at in checked:
+        # As of the fetch, not of the re-parse, so incremental syncs still re-check them
+        swimmer.pbs_checked_at = fetched_at
+    result.pbs.swimmers += len(items)
+
+@tracer.traced("reparse", root=True)
+def reparse_archive(
+    session_factory: sessionmaker,
+    archive: PageArchive,
+    pool: Optional[Executor] = None,
+    since: Optional[datetime] = None,
+    force: bool = False,
+    batch_size: int = COPY_BATCH
+) -> ReparseResult:
+    """
+    Parses the latest archived copy of every page again with the current
+    parsers and writes the results like a sync would, without any network
+    traffic: pbs of the club swimmers an athlete page belongs to, the
+    athletes on ranking and search pages into `known_athletes` and meet
+    pages into `meet_results`.
+
+    Pages are read and parsed on `pool` (in order, while the previous batch
+    is written) and written `batch_size` athlete pages per commit. An athlete
+    page fetched well before the swimmer's pbs were last checked (more than
+    `CHECK_SLACK`, i.e. by a later sync that wasn't archived) is skipped
+    unless `force`: re-parsing it would roll newer pbs back. Swimmers keep the fetch
+    time of their page as `pbs_checked_at`.
+
+    Args:
+        session_factory (sessionmaker): Sessions on the database to write to.
+        archive (PageArchive): Archive to read.
+        pool (Optional[Executor]): Process pool parsing pages, inline when None.
+        since (Optional[datetime]): Only re-parse pages fetched since then.
+        force (bool): Also re-parse athlete pages older than the stored pbs.
+        batch_size (int): Athlete pages written per transaction.
+    """
+    result = ReparseResult()
+    pages = [page for page in archive.latest(since) if page.status == 200 and page_parser(page.url) is not None]
+    result.pages = len(pages)
+
+    athlete_pages, athletes = [], []
+    with session_factory() as db:
+        for page, parsed, error in _parsed_pages(archive, pages, pool):
+            parser = page_parser(page.url)
+            if error is not None:
+                print(f"Failed to re-parse {page.url} - {error}")
+                result.failed.append(page.url)
+            elif parser is parse_athlete_pbs:
+                athlete_pages.append((page, parsed))
+            elif parser is parse_athlete_search:
+                athletes.append((parsed, page.fetched_at))
+            elif parser is parse_meet_results:
+                meet_id, club_id = _query_int(page.url, "meetId"), _query_int(page.url, "clubId")
+                stored = load_meet_results(db, meet_id, club_id)
+                new, changed = store_meet_results(db, meet_id, club_id, parsed, stored, page.fetched_at)
+                result.meet_results += len(new) + len(changed)
+            else:
+                athletes.extend((athlete, page.fetched_at) for athlete in parsed)
+
+            if len(athlete_pages) >= batch_size:
+                _write_athlete_pages(db, athlete_pages, result, force)
+                db.commit()
+                db.expunge_all()
+                athlete_pages = []
+
+        if athlete_pages:
+            _write_athlete_pages(db, athlete_pages, result, force)
+        _remember(db, athletes, result)
+        db.commit()
+
+    return result
+
+def _remember(db: Session, athletes: Iterable[tuple[Swimmer, datetime]], result: ReparseResult) -> None:
+    latest: dict[int, tuple[Swimmer, datetime]] = {}
+    for athlete, fetched_at in athletes:
+        if athlete.sw_id not in latest or latest[athlete.sw_id][1] <= fetched_at:
+            latest[athlete.sw_id] = (athlete, fetched_at)
+    if latest:
+        remember_athletes(db, (athlete for athlete, _ in latest.values()), datetime.now(timezone.utc))
+    result.athletes_seen = len(latest)
@@ -1,6 +1,6 @@
 #!/bin/bash
 
-fastapi dev app.py --host 0.0.0.0 &
+DEBUG=1 uvicorn --factory app:create_app --reload --host 0.0.0.0 &
 PID=$!
 
 sleep 3s
@@ -0,0 +1,257 @@
+"""
+Headless sync for cron jobs and other batch runs, outside the web server.
+
+Usage (from the repo root):
+    python -m scraper sync                        # every active sync target
+    python -m scraper sync --full                 # also re-scan every ranking view
+    python -m scraper sync --incremental 24       # skip athletes checked in the last 24 hours
+    python -m scraper sync --athlete 5012345      # re-check one athlete's pbs
+    python -m scraper sync --club 73626 --concurrency 2 --interval 1.5 --parse-workers 4
+    python -m scraper reparse                     # re-parse the page archive (PAGE_ARCHIVE_DIR), no network
+    python -m scraper reparse --since 2025-09-01 --workers 4
+    python -m scraper compact                     # purge orphaned pbs and VACUUM the database
+
+Reads `DB_LOCATION` (and the scraper and snapshot settings) from `.env` like
+the app, and publishes a new read snapshot for the server when done.
+Prints one JSON summary to stdout, everything else goes to stderr. Exits
+with 1 if a club, an athlete or the lookup failed, 2 on bad arguments.
+"""
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import redirect_stdout
+from datetime import datetime, timedelta, timezone
+from typing import Optional
+import argparse
+import asyncio
+import json
+import multiprocessing
+import sys
+import time
+
+from db import database_size, make_engine, make_session_factory, init_db, purge_orphans, vacuum
+from reparse import ReparseResult, reparse_archive
+from settings import Settings
+from snapshots import SnapshotStore
+from tracing import configure_tracing, instrument_engine, tracer
+from sync import PREFETCH_PAGES, SYNC_CHUNK, SyncEvent, SyncOptions, SyncResult, active_targets, sync_athlete, sync_targets
+from .archive import PageArchive
+from .base_scraper import BaseScraper, RetryPolicy
+from .swimrankings import SwimrankingsScraper
+
+def _print_progress(event: SyncEvent) -> None:
+    print(f"club {event.sw_club_id} [{event.done}/{event.total}] {event.status}: "
+          f"{event.first_name} {event.last_name} ({event.sw_id})", file=sys.stderr)
+
+async def run_sync(args, settings: Settings, parse_pool: Optional[ProcessPoolExecutor]) -> SyncResult:
+    engine = make_engine(settings.db_location, settings.db_pool_size, settings.db_max_overflow)
+    if configure_tracing(settings).enabled:
+        instrument_engine(engine)
+    init_db(engine)
+    session_factory = make_session_factory(engine)
+    policy = RetryPolicy(attempts=settings.scraper_attempts, timeout=settings.scraper_timeout)
+    archive = PageArchive(settings.page_archive_dir) if settings.page_archive_dir else None
+
+    try:
+        async with SwimrankingsScraper(policy, parse_pool, archive) as scraper:
+            if args.base_url:
+                scraper.url_book.base = args.base_url
+            if args.athlete is not None:
+                with session_factory() as db:
+                    result = await sync_athlete(db, scraper, args.athlete)
+            else:
+                with session_factory() as db:
+                    targets = active_targets(db)
+                if args.club:
+                    targets = [t for t in targets if t.sw_club_id in args.club]
+
+                options = SyncOptions(
+                    full_discovery=args.full,
+                    checked_before=(
+                        datetime.now(timezone.utc) - timedelta(hours=args.incremental)
+                        if args.incremental is not None else None
+                    ),
+                    prefetch=args.prefetch,
+                    max_clubs=args.concurrency,
+                    chunk_size=args.chunk_size,
+                    trace_memory=args.trace_memory
+                )
+                progress = _print_progress if args.progress else None
+                result = await sync_targets(session_factory, scraper, targets, progress, options)
+
+        # A running server picks the new snapshot up on its next public request
+        SnapshotStore(engine, settings.snapshot_dir).publish()
+        return result
+    finally:
+        engine.dispose()
+        tracer.shutdown()
+
+def sync_command(args) -> int:
+    settings = Settings.from_env(require_password=False)
+    if args.attempts is not None:
+        settings.scraper_attempts = args.attempts
+    if args.timeout is not None:
+        settings.scraper_timeout = args.timeout
+    if args.parse_workers is not None:
+        settings.parse_workers = args.parse_workers
+    if args.interval is not None:
+        BaseScraper._request.min_interval = args.interval
+
+    mode = "athlete" if args.athlete is not None else "full" if args.full else "incremental" if args.incremental is not None else "standard"
+    started_at = datetime.now(timezone.utc)
+    start = time.perf_counter()
+
+    parse_pool = None
+    if settings.parse_workers > 0:
+        parse_pool = ProcessPoolExecutor(settings.parse_workers, mp_context=multiprocessing.get_context("spawn"))
+
+    try:
+        # The sync reports per-athlete problems with print(), keep stdout for the summary
+        with redirect_stdout(sys.stderr):
+            result = asyncio.run(run_sync(args, settings, parse_pool))
+    finally:
+        if parse_pool is not None:
+            parse_pool.shutdown()
+
+    ok = not result.failed and not result.failed_clubs and not (mode == "athlete" and result.swimmers == 0)
+    summary = {
+        "mode": mode,
+        "ok": ok,
+        "started_at": started_at.isoformat(),
+        "duration_s": round(time.perf_counter() - start, 3),
+        **result.rows(),
+        "failed": result.failed,
+        "failed_clubs": result.failed_clubs,
+    }
+    if result.peak_memory is not None:
+        summary["peak_memory_bytes"] = result.peak_memory
+    if mode == "athlete" and result.swimmers == 0:
+        summary["error"] = f"No athlete with sw_id {args.athlete} in the database"
+
+    print(json.dumps(summary))
+    return 0 if ok else 1
+
+def run_reparse(args, settings: Settings, parse_pool: Optional[ProcessPoolExecutor]) -> ReparseResult:
+    engine = make_engine(settings.db_location, settings.db_pool_size, settings.db_max_overflow)
+    if configure_tracing(settings).enabled:
+        instrument_engine(engine)
+    init_db(engine)
+    try:
+        since = datetime.fromisoformat(args.since) if args.since else None
+        if since is not None and since.tzinfo is None:
+            since = since.replace(tzinfo=timezone.utc)
+        result = reparse_archive(make_session_factory(engine), PageArchive(args.archive), parse_pool, since, args.force)
+        SnapshotStore(engine, settings.snapshot_dir).publish()
+        return result
+    finally:
+        engine.dispose()
+        tracer.shutdown()
+
+def reparse_command(args) -> int:
+    settings = Settings.from_env(require_password=False)
+    args.archive = args.archive or settings.page_archive_dir
+    if not args.archive:
+        print(json.dumps({"mode": "reparse", "ok": False, "error": "No archive: set PAGE_ARCHIVE_DIR or pass --archive"}))
+        return 1
+    workers = args.workers if args.workers is not None else settings.parse_workers
+
+    started_at = datetime.now(timezone.utc)
+    start = time.perf_counter()
+    parse_pool = None
+    if workers > 0:
+        parse_pool = ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context("spawn"))
+
+    try:
+        with redirect_stdout(sys.stderr):
+            result = run_reparse(args, settings, parse_pool)
+    finally:
+        if parse_pool is not None:
+            parse_pool.shutdown()
+
+    print(json.dumps({
+        "mode": "reparse",
+        "ok": not result.failed,
+        "started_at": started_at.isoformat(),
+        "duration_s": round(time.perf_counter() - start, 3),
+        **result.rows(),
+        "failed": result.failed,
+    }))
+    return 0 if not result.failed else 1
+
+def compact_command(args) -> int:
+    settings = Settings.from_env(require_password=False)
+    started_at = datetime.now(timezone.utc)
+    start = time.perf_counter()
+    engine = make_engine(settings.db_location, settings.db_pool_size, settings.db_max_overflow)
+    try:
+        init_db(engine)
+        size_before = database_size(engine)
+        with make_session_factory(engine)() as db:
+            orphans = purge_orphans(db)
+            db.commit()
+        if not args.no_vacuum:
+            vacuum(engine)
+        size_after = database_size(engine)
+    finally:
+        engine.dispose()
+
+    print(json.dumps({
+        "mode": "compact",
+        "ok": True,
+        "started_at": started_at.isoformat(),
+        "duration_s": round(time.perf_counter() - start, 3),
+        "orphaned_pbs_deleted": orphans,
+        "vacuumed": not args.no_vacuum,
+        "size_before_bytes": size_before,
+        "size_after_bytes": size_after,
+    }))
+    return 0
+
+def main(argv: Optional[list[str]] = None) -> int:
+    parser = argparse.ArgumentParser(prog="python -m scraper", description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    sync = commands.add_parser("sync", help="Sync rosters and pbs from swimrankings.net")
+    mode = sync.add_mutually_exclusive_group()
+    mode.add_argument("--full", action="store_true", help="Re-scan every ranking view instead of the cached cover")
+    mode.add_argument("--incremental", type=float, metavar="HOURS", help="Only check pbs of athletes not checked in the last HOURS")
+    mode.add_argument("--athlete", type=int, metavar="SW_ID", help="Only re-check this athlete's pbs")
+    sync.add_argument("--club", type=int, nargs="+", metavar="CLUB_ID", help="Only sync these clubs' active targets")
+    sync.add_argument("--concurrency", type=int, help="Clubs synced at the same time (default: all)")
+    sync.add_argument("--interval", type=float, help="Seconds between requests to swimrankings.net (default: 1)")
+    sync.add_argument("--prefetch", type=int, default=PREFETCH_PAGES, help="Athlete pages fetched ahead of the writes")
+    sync.add_argument("--chunk-size", type=int, default=SYNC_CHUNK, help="Athletes read from the database at a time")
+    sync.add_argument("--trace-memory", action="store_true", help="Report the sync's peak Python memory (tracemalloc, slower)")
+    sync.add_argument("--parse-workers", type=int, help="Parse pool processes, 0 parses inline (default: PARSE_WORKERS)")
+    sync.add_argument("--attempts", type=int, help="Tries per page (default: SCRAPER_ATTEMPTS)")
+    sync.add_argument("--timeout", type=float, help="Seconds per request (default: SCRAPER_TIMEOUT)")
+    sync.add_argument("--progress", action="store_true", help="Log every athlete to stderr")
+    sync.add_argument("--base-url", help="Scrape this instead of swimrankings.net (e.g. benchmarks.fake_swimrankings)")
+
+    reparse = commands.add_parser("reparse", help="Parse the archived pages again and write the results, without scraping")
+    reparse.add_argument("--archive", metavar="DIR", help="Page archive to read (default: PAGE_ARCHIVE_DIR)")
+    reparse.add_argument("--since", metavar="DATE", help="Only pages fetched since this ISO date/time (UTC unless given)")
+    reparse.add_argument("--workers", type=int, help="Parse pool processes, 0 parses inline (default: PARSE_WORKERS)")
+    reparse.add_argument("--force", action="store_true", help="Also re-parse athlete pages older than the pbs stored")
+
+    compact = commands.add_parser("compact", help="Delete orphaned pbs and VACUUM the database")
+    compact.add_argument("--no-vacuum", action="store_true", help="Only delete orphans (VACUUM locks a SQLite database while it runs)")
+
+    args = parser.parse_args(argv)
+    if args.command == "sync":
+        if args.prefetch < 1 or args.chunk_size < 1 or (args.concurrency is not None and args.concurrency < 1):
+            parser.error("--prefetch, --chunk-size and --concurrency must be at least 1")
+        return sync_command(args)
+    if args.command == "reparse":
+        if args.workers is not None and args.workers < 0:
+            parser.error("--workers can't be negative")
+        if args.since:
+            try:
+                datetime.fromisoformat(args.since)
+            except ValueError:
+                parser.error("--since must be an ISO date, e.g. 2025-09-01")
+        return reparse_command(args)
+    if args.command == "compact":
+        return compact_command(args)
+    return 2
+
+if __name__ == "__main__":
+    sys.exit(main())
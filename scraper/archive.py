@@ -0,0 +1,122 @@
+from dataclasses import asdict, dataclass
+from datetime import datetime, timezone
+from typing import Iterator, Optional
+from metrics import SCRAPER_ARCHIVED_BYTES, SCRAPER_ARCHIVED_PAGES
+import gzip
+import hashlib
+import json
+import os
+
+INDEX = "index.jsonl"
+GZIP_LEVEL = 6
+
+@dataclass(frozen=True)
+class ArchivedPage:
+    """
+    One archived fetch.
+
+    Attributes:
+        url (str): URL fetched.
+        sha256 (str): Hash of the response body, names its object in the archive.
+        fetched_at (datetime): When the page was fetched (UTC).
+        status (int): HTTP status of the response.
+        encoding (str): Charset the body decodes with.
+        size (int): Uncompressed body size in bytes.
+    """
+    url: str
+    sha256: str
+    fetched_at: datetime
+    status: int
+    encoding: str
+    size: int
+
+class PageArchive:
+    """
+    Content-addressed, gzip compressed store of every page the scraper
+    fetched, so pages can be parsed again later (a fixed parser, a new
+    column) without asking swimrankings.net for them again.
+
+    Bodies are stored once per distinct content under
+    `objects/<first two hex digits>/<sha256>.gz`: an athlete page that didn't
+    change since the last sync costs an index line, not another copy. Every
+    fetch appends a line with its metadata to `index.jsonl`. Single line
+    appends are atomic, so several workers can share one archive.
+
+    Attributes:
+        root (str): Archive directory.
+    """
+    def __init__(self, root: str):
+        self.root = root
+
+    def object_path(self, sha256: str) -> str:
+        return os.path.join(self.root, "objects", sha256[:2], f"{sha256}.gz")
+
+    def store(self, url: str, content: bytes, encoding: str = "utf-8", status: int = 200,
+              fetched_at: Optional[datetime] = None) -> ArchivedPage:
+        """
+        Archives one fetched body. Blocking (compression and disk IO), call
+        it off the event loop.
+
+        Side effects:
+        - Writes the compressed body unless the same content is already stored.
+        - Appends the fetch to the index.
+        """
+        sha256 = hashlib.sha256(content).hexdigest()
+        path = self.object_path(sha256)
+        if os.path.exists(path):
+            SCRAPER_ARCHIVED_PAGES.inc(stored="duplicate")
+        else:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            compressed = gzip.compress(content, compresslevel=GZIP_LEVEL, mtime=0)
+            tmp_path = f"{path}.{os.getpid()}.tmp"
+            with open(tmp_path, "wb") as f:
+                f.write(compressed)
+            os.replace(tmp_path, path)
+            SCRAPER_ARCHIVED_PAGES.inc(stored="new")
+            SCRAPER_ARCHIVED_BYTES.inc(len(compressed))
+
+        page = ArchivedPage(url, sha256, fetched_at or datetime.now(timezone.utc), status, encoding, len(content))
+        line = json.dumps({**asdict(page), "fetched_at": page.fetched_at.isoformat()}) + "\n"
+        with open(os.path.join(self.root, INDEX), "a", encoding="utf-8") as f:
+            f.write(line)
+        return page
+
+    def entries(self) -> Iterator[ArchivedPage]:
+        """
+        Yields every archived fetch, oldest first. A line cut short by a crash
+        mid-write is skipped.
+        """
+        try:
+            f = open(os.path.join(self.root, INDEX), encoding="utf-8")
+        except FileNotFoundError:
+            return
+        with f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                    entry["fetched_at"] = datetime.fromisoformat(entry["fetched_at"])
+                    yield ArchivedPage(**entry)
+                except (ValueError, TypeError, KeyError):
+                    continue
+
+    def latest(self, since: Optional[datetime] = None) -> list[ArchivedPage]:
+        """
+        Returns the most recent fetch of every URL (fetched at or after
+        `since`, if given), in the order they were fetched.
+        """
+        latest: dict[str, ArchivedPage] = {}
+        for page in self.entries():
+            if since is None or page.fetched_at >= since:
+                latest.pop(page.url, None)
+                latest[page.url] = page
+        return list(latest.values())
+
+    def read(self, page: ArchivedPage) -> str:
+        """
+        Returns the body of an archived fetch as text.
+
+        Raises:
+            FileNotFoundError: If the object was deleted from the archive
+        """
+        with open(self.object_path(page.sha256), "rb") as f:
+            return gzip.decompress(f.read()).decode(page.encoding, errors="replace")
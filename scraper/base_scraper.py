@@ -1,9 +1,21 @@
-from bs4 import BeautifulSoup
+from collections import deque
+from concurrent.futures import Executor
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
 from functools import wraps
+from typing import Awaitable, Callable, Hashable, Optional, TypeVar
+from weakref import WeakKeyDictionary
+from .archive import PageArchive
+from metrics import SCRAPER_FETCH_DURATION, SCRAPER_FETCH_RESPONSES, SCRAPER_RATE_LIMIT_WAIT, SCRAPER_CIRCUIT_OPEN, SCRAPER_RETRIES, SCRAPER_COALESCED
+from tracing import tracer
 import asyncio
 import httpx
+import random
 import time
 
+T = TypeVar("T")
+
 class ScraperError(Exception):
     """Generic class for scraping related errors"""
 
@@ -16,48 +28,309 @@ class DataNotFoundError(ScraperError):
 class HTMLParsingError(ScraperError):
     """Failed to find requested html."""
 
+class InvalidNameError(ScraperError):
+    """A name to search for isn't in the expected format."""
+
 def rate_limited(min_interval: int = 1):
     """
     Decorator that enforces a minimum interval between calls of the wrapped coroutine.
-    Thread/async safe due to the shared lock.
+    Thread/async safe due to the shared lock (one per event loop, an asyncio
+    lock can't be awaited from a loop other than the one it was first used on).
+
+    The interval can be changed at runtime through the wrapper's `min_interval`
+    attribute (e.g. `BaseScraper._request.min_interval = 0` against a local server).
     """
     def decorator(func):
         last_time_called = 0.0
-        lock = asyncio.Lock()
+        locks: WeakKeyDictionary[asyncio.AbstractEventLoop, asyncio.Lock] = WeakKeyDictionary()
 
         @wraps(func)
         async def wrapper(*args, **kwargs):
             nonlocal last_time_called
+            queued = time.perf_counter()
+            queued_ns = time.time_ns()
+            lock = locks.setdefault(asyncio.get_running_loop(), asyncio.Lock())
             async with lock:
                 elapsed = time.time() - last_time_called
-                wait = min_interval - elapsed
+                wait = wrapper.min_interval - elapsed
                 if wait > 0:
                     await asyncio.sleep(wait)
+                SCRAPER_RATE_LIMIT_WAIT.observe(time.perf_counter() - queued)
+                tracer.record("scraper.rate_limit_wait", queued_ns)
                 result = await func(*args, **kwargs)
                 last_time_called = time.time()
                 return result
-        
+
+        wrapper.min_interval = min_interval
         return wrapper
     
     return decorator
 
+@dataclass
+class RetryPolicy:
+    """
+    How `BaseScraper._fetch` retries a failed request.
+
+    Attributes:
+        attempts (int): Total tries per URL, including the first one.
+        base_delay (float): Backoff before the first retry, doubled each retry.
+        max_delay (float): Upper bound of the exponential backoff.
+        max_retry_after (float): Upper bound for an upstream `Retry-After`.
+        timeout (float): httpx timeout per request, in seconds.
+        retry_statuses (tuple[int, ...]): Status codes worth retrying.
+    """
+    attempts: int = 4
+    base_delay: float = 1.0
+    max_delay: float = 30.0
+    max_retry_after: float = 120.0
+    timeout: float = 15.0
+    retry_statuses: tuple[int, ...] = (429, 500, 502, 503, 504)
+
+    def backoff(self, retry: int, retry_after: Optional[float] = None) -> float:
+        """
+        Full-jitter exponential backoff; a `Retry-After` from upstream wins if it is longer.
+        """
+        delay = random.uniform(0, min(self.max_delay, self.base_delay * 2 ** retry))
+        if retry_after is not None:
+            delay = max(delay, min(retry_after, self.max_retry_after))
+        return delay
+
+class CircuitBreaker:
+    """
+    Pauses all fetching when the recent upstream error rate spikes.
+
+    The breaker keeps the outcome of the last `window` requests. Once at least
+    `min_calls` are recorded and the error share reaches `threshold`, it opens
+    for `cooldown` seconds: every fetch waits until then instead of adding load
+    to a struggling server. After the cooldown the window starts over.
+    """
+    def __init__(self, window: int = 20, min_calls: int = 10, threshold: float = 0.5, cooldown: float = 60.0):
+        self.threshold = threshold
+        self.min_calls = min_calls
+        self.cooldown = cooldown
+        self._outcomes: deque[bool] = deque(maxlen=window)
+        self._open_until = 0.0
+
+    @property
+    def is_open(self) -> bool:
+        return time.monotonic() < self._open_until
+
+    async def wait(self) -> None:
+        remaining = self._open_until - time.monotonic()
+        if remaining > 0:
+            await asyncio.sleep(remaining)
+
+    def record(self, ok: bool) -> None:
+        self._outcomes.append(ok)
+        failures = self._outcomes.count(False)
+        if len(self._outcomes) >= self.min_calls and failures / len(self._outcomes) >= self.threshold:
+            self._open_until = time.monotonic() + self.cooldown
+            self._outcomes.clear()
+            SCRAPER_CIRCUIT_OPEN.inc()
+
+def _parse_retry_after(value: Optional[str]) -> Optional[float]:
+    if not value:
+        return None
+    try:
+        return max(float(value), 0.0)
+    except ValueError:
+        pass
+    try:
+        return max((parsedate_to_datetime(value) - datetime.now(timezone.utc)).total_seconds(), 0.0)
+    except (TypeError, ValueError):
+        return None
+
+class SingleFlight:
+    """
+    Merges concurrent identical scrapes into one upstream fetch.
+
+    The first caller for a key starts the work as a task, everyone who asks
+    for the same key while it is running awaits that task instead and gets
+    the same result (or exception). The key is forgotten as soon as the task
+    finishes, so nothing is cached: a later call fetches again.
+
+    The task is shielded, so a caller that is cancelled (e.g. a closed
+    request) doesn't cancel the fetch for the others waiting on it; the
+    scraper that started it keeps its client open until it's done (see
+    `BaseScraper.__aexit__`). Results are shared objects, callers must not
+    mutate them.
+
+    Attributes:
+        coalesced (int): Calls that joined an in-flight task, also exported as `scraper_coalesced_total`.
+    """
+    def __init__(self):
+        self.coalesced = 0
+        # Tasks belong to one event loop, keep one table per loop
+        self._calls: WeakKeyDictionary[asyncio.AbstractEventLoop, dict[Hashable, asyncio.Task]] = WeakKeyDictionary()
+
+    async def do(self, key: Hashable, work: Callable[[], Awaitable[T]], label: str = "") -> T:
+        """
+        Returns the result of `work()`, or of the in-flight call with the same `key`.
+
+        Args:
+            key (Hashable): Identifies identical calls, e.g. the URL and parser.
+            work (Callable[[], Awaitable[T]]): Starts the call when nothing is in flight for `key`.
+            label (str): `parser` label of the coalesced counter.
+        """
+        calls = self._calls.setdefault(asyncio.get_running_loop(), {})
+        task = calls.get(key)
+        if task is None:
+            task = asyncio.ensure_future(work())
+            calls[key] = task
+            task.add_done_callback(lambda _: calls.pop(key, None))
+        else:
+            self.coalesced += 1
+            SCRAPER_COALESCED.inc(parser=label)
+        return await asyncio.shield(task)
+
+# Shared by every scraper, like the rate limit, since they all hit the same server
+circuit_breaker = CircuitBreaker()
+single_flight = SingleFlight()
+# Clients waiting for the shared fetches still using them before closing
+_closing: set[asyncio.Task] = set()
+
 class BaseScraper:
-    def __init__(self, url_book):
+    def __init__(self, url_book, retry_policy: Optional[RetryPolicy] = None, parse_pool: Optional[Executor] = None,
+                 archive: Optional[PageArchive] = None):
         self.url_book = url_book
-        self.client = httpx.AsyncClient()
+        self.retry_policy = retry_policy or RetryPolicy()
+        self.parse_pool = parse_pool
+        self.archive = archive
+        self.breaker = circuit_breaker
+        self.single_flight = single_flight
+        self.client = httpx.AsyncClient(timeout=self.retry_policy.timeout)
+        # Shared scrapes running on `client`, other scrapers may be waiting on them
+        self._flights: set[asyncio.Task] = set()
 
     async def __aenter__(self):
         return self
 
     async def __aexit__(self, exc_type, exc, tb):
+        """
+        Closes the client. While a scrape this scraper started is still
+        running for other callers (this one was e.g. a request that got
+        cancelled), the client is closed once that scrape finishes instead.
+        """
+        if not self._flights:
+            await self.client.aclose()
+            return
+
+        task = asyncio.create_task(self._close_after(set(self._flights)))
+        _closing.add(task)
+        task.add_done_callback(_closing.discard)
+
+    async def _close_after(self, flights: set[asyncio.Task]) -> None:
+        await asyncio.wait(flights)
         await self.client.aclose()
 
     @rate_limited(1)
-    async def _fetch(self, url: str):
-        response = await self.client.get(url)
-        if response.status_code != 200 or not response.text:
-            raise ScrapingError(f"Failed to fetch {url} - status {response.status_code}")
-        return response
-
-    def _parse(self, html: str) -> BeautifulSoup:
-        return BeautifulSoup(html, 'lxml')
+    async def _request(self, url: str) -> httpx.Response:
+        start = time.perf_counter()
+        with tracer.span("scraper.request", **{"http.url": url}):
+            try:
+                response = await self.client.get(url)
+            except httpx.HTTPError:
+                SCRAPER_FETCH_RESPONSES.inc(status="error")
+                raise
+            finally:
+                SCRAPER_FETCH_DURATION.observe(time.perf_counter() - start)
+
+            SCRAPER_FETCH_RESPONSES.inc(status=response.status_code)
+            tracer.annotate(**{"http.status_code": response.status_code})
+            return response
+
+    @tracer.traced("scraper.fetch")
+    async def _fetch(self, url: str) -> httpx.Response:
+        """
+        GETs `url`, retrying transport errors, empty bodies and `retry_statuses`
+        with jittered exponential backoff. Every attempt goes through the rate
+        limiter and waits for the circuit breaker to close.
+
+        With an `archive`, the page fetched is stored there too (on a worker
+        thread); a failure to archive is logged, not raised.
+
+        Traced as `scraper.fetch`, with the rate limiter wait, circuit
+        breaker pause and every request as child spans.
+
+        Raises:
+            ScrapingError: If the status isn't retryable or all attempts failed
+        """
+        policy = self.retry_policy
+        error = ""
+        tracer.annotate(**{"http.url": url})
+
+        for attempt in range(policy.attempts):
+            if self.breaker.is_open:
+                with tracer.span("scraper.circuit_wait"):
+                    await self.breaker.wait()
+            retry_after = None
+            tracer.annotate(attempts=attempt + 1)
+
+            try:
+                response = await self._request(url)
+            except httpx.TransportError as e:
+                self.breaker.record(False)
+                error = f"{type(e).__name__}: {e}"
+            else:
+                if response.status_code == 200 and response.text:
+                    self.breaker.record(True)
+                    if self.archive is not None:
+                        await self._archive(url, response)
+                    return response
+
+                error = f"status {response.status_code}"
+                if response.status_code not in policy.retry_statuses and response.status_code != 200:
+                    self.breaker.record(True) # upstream is healthy, the request is just bad
+                    break
+
+                self.breaker.record(False)
+                retry_after = _parse_retry_after(response.headers.get("Retry-After"))
+
+            if attempt + 1 < policy.attempts:
+                SCRAPER_RETRIES.inc()
+                await asyncio.sleep(policy.backoff(attempt, retry_after))
+
+        raise ScrapingError(f"Failed to fetch {url} - {error}")
+
+    async def _archive(self, url: str, response: httpx.Response) -> None:
+        try:
+            await asyncio.to_thread(
+                self.archive.store, url, response.content, response.encoding or "utf-8", response.status_code
+            )
+        except OSError as e:
+            print(e)
+
+    async def _run_parser(self, parser: Callable[[str], T], html: str) -> T:
+        """
+        Runs `parser(html)` on `parse_pool`, or inline when there is no pool.
+
+        With a process pool `parser` must be a module level function and
+        return picklable data. Building the soup is the expensive part of a
+        scrape, so keeping it off the event loop lets the next fetch and
+        every other request carry on while a page is being parsed.
+        """
+        with tracer.span("scraper.parse", parser=parser.__name__, pool=self.parse_pool is not None, size=len(html)):
+            if self.parse_pool is None:
+                return parser(html)
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self.parse_pool, parser, html)
+
+    async def _scrape(self, url: str, parser: Callable[[str], T]) -> T:
+        """
+        Fetches `url` and parses it with `parser`. Identical scrapes already
+        in flight (same URL and parser, from any scraper) are joined instead
+        of fetching the page again, see `SingleFlight`.
+
+        Raises:
+            ScrapingError: If the page couldn't be fetched
+        """
+        async def scrape() -> T:
+            flight = asyncio.current_task()
+            self._flights.add(flight)
+            try:
+                response = await self._fetch(url)
+                return await self._run_parser(parser, response.text)
+            finally:
+                self._flights.discard(flight)
+
+        return await self.single_flight.do((url, parser), scrape, parser.__name__)
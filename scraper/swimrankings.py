@@ -1,15 +1,24 @@
+from array import array
+from contextlib import contextmanager
 from enum import Enum
-from dataclasses import dataclass
-from typing import AsyncGenerator
-from datetime import datetime, timezone, time, date
-from .base_scraper import BaseScraper, DataNotFoundError, HTMLParsingError
+from dataclasses import dataclass, fields
+from typing import AsyncGenerator, Callable, Iterator, Optional
+from fastapi import Depends, Request
+from datetime import datetime, time, date
+from concurrent.futures import Executor
+from bs4 import BeautifulSoup
+from urllib.parse import parse_qs, urlsplit
+from .archive import PageArchive
+from .base_scraper import BaseScraper, DataNotFoundError, HTMLParsingError, InvalidNameError, RetryPolicy
+from tracing import tracer
 import re
+import sys
 
 class Gender(Enum):
     MALE = 0
     FEMALE = 1
 
-@dataclass
+@dataclass(slots=True, frozen=True)
 class Swimmer:
     sw_id: int
     birth_year: int
@@ -17,12 +26,12 @@ class Swimmer:
     last_name: str
     gender: Gender
 
-@dataclass
+@dataclass(slots=True, frozen=True)
 class SwimmerPb:
     sw_style_id: int
     sw_result_id: int
     sw_meet_id: int
-    sw_default_fina: str 
+    sw_default_fina: str
     event: str
     course: int
     time: time
@@ -30,7 +39,97 @@ class SwimmerPb:
     date: date
     city: str
     meet_name: str
-    last_scraped: datetime
+
+PB_FIELDS = tuple(f.name for f in fields(SwimmerPb))
+
+@dataclass(slots=True, frozen=True)
+class MeetResult:
+    """
+    One swim of a club's athlete at a meet, as listed on the meet's club results page.
+    """
+    sw_result_id: int
+    sw_id: int
+    first_name: str
+    last_name: str
+    sw_style_id: int
+    event: str
+    course: int
+    time: time
+    pts: int
+
+def _time_to_us(t: time) -> int:
+    return ((t.hour * 60 + t.minute) * 60 + t.second) * 1_000_000 + t.microsecond
+
+def _us_to_time(us: int) -> time:
+    seconds, microsecond = divmod(us, 1_000_000)
+    minutes, second = divmod(seconds, 60)
+    hour, minute = divmod(minutes, 60)
+    return time(hour, minute, second, microsecond)
+
+class PbBatch:
+    """
+    Personal bests stored column by column, as they come off a pb table.
+
+    Numbers live in `array`s (times as microseconds since midnight, dates as
+    ordinals) and the handful of distinct strings are interned, so a pb costs
+    a few dozen bytes instead of an object per row plus one per time and date.
+    The batch pickles compactly out of the parse pool and `records()` feeds a
+    bulk insert directly; iterating still gives `SwimmerPb` rows.
+    """
+    __slots__ = PB_FIELDS
+
+    def __init__(self):
+        self.sw_style_id = array("i")
+        self.sw_result_id = array("q")
+        self.sw_meet_id = array("q")
+        self.sw_default_fina: list[str] = []
+        self.event: list[str] = []
+        self.course = array("i")
+        self.time = array("q")
+        self.pts = array("i")
+        self.date = array("i")
+        self.city: list[str] = []
+        self.meet_name: list[str] = []
+
+    def append(self, sw_style_id: int, sw_result_id: int, sw_meet_id: int, sw_default_fina: str, event: str,
+               course: int, time: time, pts: int, date: date, city: str, meet_name: str) -> None:
+        self.sw_style_id.append(sw_style_id)
+        self.sw_result_id.append(sw_result_id)
+        self.sw_meet_id.append(sw_meet_id)
+        self.sw_default_fina.append(sys.intern(sw_default_fina))
+        self.event.append(sys.intern(event))
+        self.course.append(course)
+        self.time.append(_time_to_us(time))
+        self.pts.append(pts)
+        self.date.append(date.toordinal())
+        self.city.append(sys.intern(city))
+        self.meet_name.append(sys.intern(meet_name))
+
+    def __len__(self) -> int:
+        return len(self.sw_result_id)
+
+    def records(self) -> Iterator[dict]:
+        """
+        Yields one dict per pb keyed by `SwimmerPb` field names.
+        """
+        for i in range(len(self)):
+            yield {
+                "sw_style_id": self.sw_style_id[i],
+                "sw_result_id": self.sw_result_id[i],
+                "sw_meet_id": self.sw_meet_id[i],
+                "sw_default_fina": self.sw_default_fina[i],
+                "event": self.event[i],
+                "course": self.course[i],
+                "time": _us_to_time(self.time[i]),
+                "pts": self.pts[i],
+                "date": date.fromordinal(self.date[i]),
+                "city": self.city[i],
+                "meet_name": self.meet_name[i],
+            }
+
+    def __iter__(self) -> Iterator[SwimmerPb]:
+        for record in self.records():
+            yield SwimmerPb(**record)
 
 class UrlBook:
     def __init__(self):
@@ -46,15 +145,36 @@ class UrlBook:
             f'&athlete_lastname={last_name}&athlete_firstname={first_name}'
         )
 
-    def club_athletes(self, clubid: int):
+    def meet_results(self, meet_id: int, clubid: int) -> str:
+        return f'{self.base}page=meetDetail&meetId={meet_id}&clubId={clubid}'
+
+    def club_athletes(self, clubid: int, season: int = 2025, course: str = "LCM", stroke: int = 9):
         return (
                 f'{self.base}page=rankingDetail&clubId={clubid}&gender=1'
-                f'&season=2025&course=LCM&agegroup=0&stroke=9'
+                f'&season={season}&course={course}&agegroup=0&stroke={stroke}'
         )
 
-class SwimrankingsScraper(BaseScraper):
-    def __init__(self):
-        super().__init__(UrlBook())
+class SwimrankingsParser:
+    """
+    Turns swimrankings.net pages into `Swimmer`/`SwimmerPb` data.
+
+    Holds no state and does no IO, so the module level `parse_*` functions
+    below can run it in a worker process: raw HTML goes in, plain picklable
+    dataclasses come back.
+    """
+    @contextmanager
+    def _soup(self, html: str) -> Iterator[BeautifulSoup]:
+        # Parse stages show up in traces when parsing inline (no parse pool)
+        with tracer.span("parse.soup"):
+            soup = BeautifulSoup(html, 'lxml')
+        try:
+            with tracer.span("parse.extract"):
+                yield soup
+        finally:
+            # A tree is full of parent/child cycles: break them now instead
+            # of leaving whole pages for the cyclic garbage collector
+            with tracer.span("parse.decompose"):
+                soup.decompose()
 
     def _parse_athlete_row(self, row, gender: Gender) -> Swimmer:
         td_name = row.find('td', attrs={'class': "name"})
@@ -136,8 +256,8 @@ class SwimrankingsScraper(BaseScraper):
 
         raise ValueError(f"Time string '{time_str}' is not in a recognized format")
 
-    def _parse_pb_table(self, rows, fina_text) -> list[SwimmerPb]:
-        pbs = []
+    def _parse_pb_table(self, rows, fina_text) -> PbBatch:
+        pbs = PbBatch()
 
         for row in rows:
             td_event = row.find('td', attrs={"class": "event"})
@@ -229,7 +349,7 @@ class SwimrankingsScraper(BaseScraper):
             meet_id = int(meet_id_re.group(1))
             meet_name = a_city.get('title') or city_str
 
-            pb = SwimmerPb(
+            pbs.append(
                 style_id,
                 result_id,
                 meet_id,
@@ -240,155 +360,298 @@ class SwimrankingsScraper(BaseScraper):
                 points,
                 datedate,
                 city_str,
-                meet_name,
-                datetime.now(timezone.utc)
+                meet_name
             )
 
-            pbs.append(pb)
-
-
         return pbs
 
-    async def _fetch_club_athletes(self, clubid: int) -> list[Swimmer]:
+    def parse_club_athletes(self, html: str) -> list[Swimmer]:
         """
-        Get swimmers registered as part of the SCWR swimming club
-
-        Side effects:
-        - Scrapes swimrankings.net. Many calls to this function (from experience 31 httpx in less than a second) in a short period of time can cause swimrankings.net to sh*t its pants and crash.
-            The reason for this is because its server os is Windows. lmaoo
-
-        Returns:
-            list[Swimmer]: A list of Swimmer objects containing swimmer data
+        Parses the boys' and girls' athlete lists of a club ranking page.
 
         Raises:
-            RuntimeError: If `response.status_code` isn't 200
+            HTMLParsingError: If the page doesn't look like a ranking page
         """
-        url = self.url_book.club_athletes(clubid)
-        response = await self._fetch(url)
-        soup = self._parse(response.text)
-
-        table1 = soup.find('table', attrs={'cellspacing': '0', 'cellpadding': '0', 'border': '0'})
+        with self._soup(html) as soup:
+            table1 = soup.find('table', attrs={'cellspacing': '0', 'cellpadding': '0', 'border': '0'})
 
-        if table1 is None:
-            raise HTMLParsingError("Failed to find required html! Tag: `table`, `cellspacing`: `0`")
+            if table1 is None:
+                raise HTMLParsingError("Failed to find required html! Tag: `table`, `cellspacing`: `0`")
 
-        tables = table1.find_all('table', attrs={'class': 'athleteList'})
+            tables = table1.find_all('table', attrs={'class': 'athleteList'})
 
-        if tables is None:
-            raise HTMLParsingError("Failed to find required html! Tag: `table`, `class`: `athleteList`")
+            if tables is None:
+                raise HTMLParsingError("Failed to find required html! Tag: `table`, `class`: `athleteList`")
 
-        boy_table = tables[0]
+            boy_table = tables[0]
 
-        if boy_table is None:
-            raise HTMLParsingError("Failed to find required html! Tag `table`, `class`: `athleteList` (boy_table)")
+            if boy_table is None:
+                raise HTMLParsingError("Failed to find required html! Tag `table`, `class`: `athleteList` (boy_table)")
 
-        girl_table = tables[1]
+            girl_table = tables[1]
 
-        if girl_table is None:
-            raise HTMLParsingError("Failed to find required html! Tag `table`, `class`: `athleteList` (girl_table)")
+            if girl_table is None:
+                raise HTMLParsingError("Failed to find required html! Tag `table`, `class`: `athleteList` (girl_table)")
 
-        athletes = []
+            athletes = []
 
-        rows = boy_table.find_all('tr', attrs={'class': ["athleteSearch0", "athleteSearch1"]})
+            rows = boy_table.find_all('tr', attrs={'class': ["athleteSearch0", "athleteSearch1"]})
 
-        if rows is None:
-            raise HTMLParsingError("Failed to find required html! Tag `tr`, `class`: [`athleteSearch0`, `athleteSearch1`]")
+            if rows is None:
+                raise HTMLParsingError("Failed to find required html! Tag `tr`, `class`: [`athleteSearch0`, `athleteSearch1`]")
 
-        for row in rows:
-            athlete = self._parse_athlete_row(row, Gender(0))
-            athletes.append(athlete)
+            for row in rows:
+                athlete = self._parse_athlete_row(row, Gender(0))
+                athletes.append(athlete)
 
-        rows = girl_table.find_all('tr', attrs={'class': ["athleteSearch0", "athleteSearch1"]})
+            rows = girl_table.find_all('tr', attrs={'class': ["athleteSearch0", "athleteSearch1"]})
 
-        if rows is None:
-            raise HTMLParsingError("Failed to find required html! Tag `tr`, `class`: [`athleteSearch0`, `athleteSearch1`]")
+            if rows is None:
+                raise HTMLParsingError("Failed to find required html! Tag `tr`, `class`: [`athleteSearch0`, `athleteSearch1`]")
 
-        for row in rows:
-            athlete = self._parse_athlete_row(row, Gender(1))
-            athletes.append(athlete)
+            for row in rows:
+                athlete = self._parse_athlete_row(row, Gender(1))
+                athletes.append(athlete)
 
-        return athletes
+            return athletes
 
+    def parse_athlete_search(self, html: str) -> Swimmer:
+        """
+        Parses the first hit of an athlete search page.
 
-    async def _fetch_athlete(self, full_name: str) -> Swimmer:
+        Raises:
+            HTMLParsingError: If the page has no results table
         """
-        Scrapes swimrankings to find data about a swimmer based on a comma seperated name that is provided
+        with self._soup(html) as soup:
+            table = soup.find("table", attrs={'class': 'athleteSearch'})
 
-        Side effects:
-        - Scrapes swimrankings.net. Many calls to this function (from experience 31 requests in less than a second) in a short period of time can cause swimrankings.net to sh*t its pants and crash.
-            The reason for this is because its server os is Windows. lmaoo
+            if table is None:
+                raise HTMLParsingError("Failed to find required html! Tag `table`, `class`: `athleteSearch`")
 
-        Args:
-            full_name (str): The full name of the swimmer seperated by a ', '
+            row = table.find('tr', attrs={'class': 'athleteSearch0'})
 
-        Returns:
-            Swimmer: A Swimmer object containing the swimmer's data
+            if row is None:
+                raise HTMLParsingError("Failed to find required html! Tag `tr`, `class`: `athleteSearch0`")
+        
+            athlete = self._parse_athlete_row(row, Gender(1))
+
+            return athlete
+
+    def parse_athlete_pbs(self, html: str) -> PbBatch:
+        """
+        Parses the personal best table of an athlete's portfolio page.
 
         Raises:
-            RuntimeError: If `response.status_code` isn't 200 and if `sw_id` isn't valid
+            HTMLParsingError: If the page has no pb table
+            ValueError: If a time or date cell isn't in the expected format
         """
-        first_name, last_name = full_name.split(', ')
-        url = self.url_book.swimmer_portfolio_page_by_full_name(first_name, last_name)
-        response = await self._fetch(url)
-        soup = self._parse(response.text)
+        with self._soup(html) as soup:
+            select = soup.find("select", attrs={"name": "points"})
 
-        table = soup.find("table", attrs={'class': 'athleteSearch'})
+            if not select:
+                raise HTMLParsingError("Failed to find required html! Tag `select`, `name`: `points`")
 
-        if table is None:
-            raise HTMLParsingError("Failed to find required html! Tag `table`, `class`: `athleteSearch`")
+            default_option = select.find('option', selected=True)
 
-        row = table.find('tr', attrs={'class': 'athleteSearch0'})
+            if not default_option:
+                raise HTMLParsingError("Failed to find required html! Tag `option`, `selected`: ``")
 
-        if row is None:
-            raise HTMLParsingError("Failed to find required html! Tag `tr`, `class`: `athleteSearch0`")
-        
-        athlete = self._parse_athlete_row(row, Gender(1))
+            fina_text = default_option.get_text()
 
-        return athlete
+            pb_table = soup.find("table", attrs={"class": "athleteBest"})
 
-    async def _fetch_athlete_pbs(self, athlete_id: int) -> list[SwimmerPb]:
-        url = self.url_book.swimmer_portfolio_page_by_id(athlete_id)
-        response = await self._fetch(url)
-        soup = self._parse(response.text)
+            if not pb_table:
+                raise HTMLParsingError("Failed to find required html! Tag `table`, `class`: `athleteBest`")
+
+            pb_rows = pb_table.find_all("tr")
+
+            if not pb_rows:
+                raise HTMLParsingError("Failed to find required html! Tag `tr`")
 
-        select = soup.find("select", attrs={"name": "points"})
+            pb_rows.pop(0) # Remove the headers
 
-        if not select:
-            raise HTMLParsingError("Failed to find required html! Tag `select`, `name`: `points`")
 
-        default_option = select.find('option', selected=True)
+            pbs = self._parse_pb_table(pb_rows, fina_text)
 
-        if not default_option:
-            raise HTMLParsingError("Failed to find required html! Tag `option`, `selected`: ``")
+            return pbs
 
-        fina_text = default_option.get_text()
+    def parse_meet_results(self, html: str) -> list[MeetResult]:
+        """
+        Parses the results table of a meet's club results page. A meet that
+        hasn't started yet has an empty table.
 
-        pb_table = soup.find("table", attrs={"class": "athleteBest"})
+        Raises:
+            HTMLParsingError: If the page has no results table
+            ValueError: If a time cell isn't in the expected format
+        """
+        with self._soup(html) as soup:
+            table = soup.find("table", attrs={"class": "meetResult"})
+
+            if table is None:
+                raise HTMLParsingError("Failed to find required html! Tag `table`, `class`: `meetResult`")
+
+            results = []
+
+            for row in table.find_all('tr', attrs={'class': ["meetResult0", "meetResult1"]}):
+                a_name = row.select_one('td.name a')
+                a_event = row.select_one('td.event a')
+                td_course = row.find('td', attrs={'class': 'course'})
+                a_time = row.select_one('td.time a')
+                td_points = row.find('td', attrs={'class': 'code'})
+
+                if None in (a_name, a_event, td_course, a_time, td_points):
+                    raise HTMLParsingError(f"Failed to find required html! Result row: `{row}`")
+
+                athlete_re = re.search(r'athleteId=(\d+)', a_name.get('href', ''))
+                style_re = re.search(r'styleId=(\d+)', a_event.get('href', ''))
+                result_re = re.search(r'id=(\d+)', a_time.get('href', ''))
+                course_re = re.search(r'(\d{2})', td_course.get_text())
+
+                if None in (athlete_re, style_re, result_re, course_re):
+                    raise HTMLParsingError(f"Failed to parse ids from result row: `{row}`")
+
+                last_name, first_name = a_name.get_text().split(', ')
+                points_text = td_points.get_text()
+
+                results.append(MeetResult(
+                    int(result_re.group(1)),
+                    int(athlete_re.group(1)),
+                    first_name,
+                    last_name.title(),
+                    int(style_re.group(1)),
+                    a_event.get_text(),
+                    int(course_re.group(1)),
+                    self._parse_time_str(a_time.get_text()),
+                    int(points_text) if points_text != '-' else 0
+                ))
+
+            return results
+
+_parser = SwimrankingsParser()
+
+# Module level so they can be pickled and sent to a worker process
+def parse_club_athletes(html: str) -> list[Swimmer]:
+    return _parser.parse_club_athletes(html)
+
+def parse_athlete_search(html: str) -> Swimmer:
+    return _parser.parse_athlete_search(html)
+
+def parse_athlete_pbs(html: str) -> PbBatch:
+    return _parser.parse_athlete_pbs(html)
+
+def parse_meet_results(html: str) -> list[MeetResult]:
+    return _parser.parse_meet_results(html)
+
+def page_parser(url: str) -> Optional[Callable[[str], object]]:
+    """
+    Returns the parser for a page URL built by `UrlBook`, or None if nothing
+    parses that kind of page.
+    """
+    query = parse_qs(urlsplit(url).query)
+    if query.get("internalRequest") == ["athleteFind"]:
+        return parse_athlete_search
+    return {
+        "athleteDetail": parse_athlete_pbs,
+        "rankingDetail": parse_club_athletes,
+        "meetDetail": parse_meet_results,
+    }.get(query.get("page", [""])[0])
 
-        if not pb_table:
-            raise HTMLParsingError("Failed to find required html! Tag `table`, `class`: `athleteBest`")
+class SwimrankingsScraper(BaseScraper):
+    def __init__(self, retry_policy: Optional[RetryPolicy] = None, parse_pool: Optional[Executor] = None,
+                 archive: Optional[PageArchive] = None):
+        super().__init__(UrlBook(), retry_policy, parse_pool, archive)
 
-        pb_rows = pb_table.find_all("tr")
+    async def _fetch_club_athletes(self, clubid: int, season: int, course: str, stroke: int) -> list[Swimmer]:
+        """
+        Get swimmers registered as part of a club, as listed on one ranking page
 
-        if not pb_rows:
-            raise HTMLParsingError("Failed to find required html! Tag `tr`")
+        Side effects:
+        - Scrapes swimrankings.net. Many calls to this function (from experience 31 httpx in less than a second) in a short period of time can cause swimrankings.net to sh*t its pants and crash.
+            The reason for this is because its server os is Windows. lmaoo
 
-        pb_rows.pop(0) # Remove the headers
+        Args:
+            clubid (int): swimrankings.net club id
+            season (int): Ranking season
+            course (str): `LCM` or `SCM`
+            stroke (int): swimrankings.net stroke/ranking id
 
+        Returns:
+            list[Swimmer]: A list of Swimmer objects containing swimmer data
 
-        pbs = self._parse_pb_table(pb_rows, fina_text)
+        Raises:
+            ScrapingError: If the page couldn't be fetched
+        """
+        url = self.url_book.club_athletes(clubid, season, course, stroke)
+        return await self._scrape(url, parse_club_athletes)
 
-        return pbs
+    async def _fetch_athlete(self, full_name: str) -> Swimmer:
+        """
+        Scrapes swimrankings to find data about a swimmer based on a comma seperated name that is provided
+
+        Side effects:
+        - Scrapes swimrankings.net. Many calls to this function (from experience 31 requests in less than a second) in a short period of time can cause swimrankings.net to sh*t its pants and crash.
+            The reason for this is because its server os is Windows. lmaoo
+
+        Args:
+            full_name (str): The full name of the swimmer seperated by a ', '
+
+        Returns:
+            Swimmer: A Swimmer object containing the swimmer's data
 
-    async def fetch_club_athletes(self, clubid: int = 73626) -> list[Swimmer]:
-        return await self._fetch_club_athletes(clubid)
+        Raises:
+            InvalidNameError: If `full_name` isn't two names seperated by a ', ' (nothing is fetched)
+            RuntimeError: If `response.status_code` isn't 200 and if `sw_id` isn't valid
+        """
+        names = full_name.split(', ')
+        if len(names) != 2 or not all(name.strip() for name in names):
+            raise InvalidNameError(f"Expected a 'First, Last' name, got `{full_name}`")
+        first_name, last_name = names
+        url = self.url_book.swimmer_portfolio_page_by_full_name(first_name, last_name)
+        return await self._scrape(url, parse_athlete_search)
+
+    async def _fetch_athlete_pbs(self, athlete_id: int) -> PbBatch:
+        url = self.url_book.swimmer_portfolio_page_by_id(athlete_id)
+        return await self._scrape(url, parse_athlete_pbs)
+
+    async def _fetch_meet_results(self, meet_id: int, clubid: int) -> list[MeetResult]:
+        url = self.url_book.meet_results(meet_id, clubid)
+        return await self._scrape(url, parse_meet_results)
+
+    async def fetch_club_athletes(
+        self,
+        clubid: int = 73626,
+        season: int = 2025,
+        course: str = "LCM",
+        stroke: int = 9
+    ) -> list[Swimmer]:
+        return await self._fetch_club_athletes(clubid, season, course, stroke)
 
     async def fetch_athlete(self, full_name: str) -> Swimmer:
         return await self._fetch_athlete(full_name)
 
-    async def fetch_athlete_personal_bests(self, athlete_id: int) -> list[SwimmerPb]:
+    async def fetch_athlete_personal_bests(self, athlete_id: int) -> PbBatch:
         return await self._fetch_athlete_pbs(athlete_id)
 
-async def get_scraper() -> AsyncGenerator[SwimrankingsScraper, None]:
-    async with SwimrankingsScraper() as scraper:
+    async def fetch_meet_results(self, meet_id: int, clubid: int = 73626) -> list[MeetResult]:
+        return await self._fetch_meet_results(meet_id, clubid)
+
+def get_scraper_factory(request: Request) -> Callable[[], SwimrankingsScraper]:
+    """
+    Returns a function building scrapers configured from the app settings,
+    for work that outlives the request (e.g. a background sync).
+    """
+    settings = request.app.state.settings
+    parse_pool = request.app.state.parse_pool
+    archive = request.app.state.page_archive
+
+    def factory() -> SwimrankingsScraper:
+        policy = RetryPolicy(attempts=settings.scraper_attempts, timeout=settings.scraper_timeout)
+        return SwimrankingsScraper(policy, parse_pool, archive)
+
+    return factory
+
+async def get_scraper(
+    factory: Callable[[], SwimrankingsScraper] = Depends(get_scraper_factory)
+) -> AsyncGenerator[SwimrankingsScraper, None]:
+    async with factory() as scraper:
         yield scraper
@@ -0,0 +1,130 @@
+from dataclasses import dataclass, field
+from typing import Optional
+from dotenv import load_dotenv
+import os
+
+def _env_flag(name: str) -> bool:
+    return os.getenv(name, "").lower() in ("1", "true", "yes")
+
+def _env_budgets(name: str) -> dict[str, int]:
+    """
+    Parses `route=count` pairs, e.g. `/athletes=4,/athlete/{sw_id}=8`.
+    """
+    budgets = {}
+    for pair in filter(None, os.getenv(name, "").replace(" ", "").split(",")):
+        route, _, count = pair.rpartition("=")
+        budgets[route] = int(count)
+    return budgets
+
+@dataclass
+class Settings:
+    """
+    Runtime configuration for the app, normally read from `.env`.
+
+    Attributes:
+        db_location (str): SQLAlchemy database URL (SQLite file or PostgreSQL).
+        password_hash (str): bcrypt hash of the admin password.
+        debug (bool): Development mode (template auto-reload etc.).
+        template_cache_dir (Optional[str]): Directory for compiled template bytecode, disabled when None.
+        template_strip_whitespace (bool): Collapse template indentation and blank lines when compiling.
+        compress_min_size (Optional[int]): Smallest response body compressed, in bytes; no compression when None.
+        compress_gzip_level (int): gzip level for compressed responses, 1-9.
+        compress_brotli_quality (int): brotli quality for compressed responses, 0-11 (needs the `brotli` package).
+        sql_profiling (bool): Enable the per-request SQL profiler middleware.
+        query_budget (Optional[int]): Max SQL statements per request before the profiler complains.
+        query_budgets (dict[str, int]): Budgets of single routes keyed by route path (e.g. `/athlete/{sw_id}`), overriding `query_budget`.
+        query_budget_strict (bool): Raise instead of logging when a request exceeds its budget.
+        scraper_attempts (int): Tries per upstream URL before giving up.
+        scraper_timeout (float): Timeout per upstream request, in seconds.
+        parse_workers (int): Processes parsing scraped pages, 0 parses on the event loop.
+        db_pool_size (int): Connections kept open per process to a PostgreSQL database.
+        db_max_overflow (int): Extra connections per process under load, on top of `db_pool_size`.
+        static_build_dir (Optional[str]): Directory for fingerprinted, precompressed static files, plain `/static` when None.
+        snapshot_dir (Optional[str]): Directory for the read snapshots public pages are served from, disabled when None.
+        page_archive_dir (Optional[str]): Directory every scraped page is archived in for offline re-parsing, disabled when None.
+        sync_trace_memory (bool): Measure the peak Python memory of every sync with `tracemalloc` (slower syncs).
+        live_min_interval (float): Seconds between live meet polls while new results keep appearing.
+        live_max_interval (float): Longest interval live meet polling backs off to when nothing changes.
+        trace_sample_rate (float): Share of requests (and syncs, live meet polls) traced, 0 to 1.
+        trace_file (Optional[str]): File trace spans are appended to as JSON lines.
+        trace_otlp_endpoint (Optional[str]): OTLP/HTTP collector spans are sent to instead, e.g. `http://localhost:4318`; no tracing when neither is set.
+        trace_trusted_clients (tuple[str, ...]): Addresses/networks (e.g. a reverse proxy) whose `traceparent` header is honoured.
+    """
+    db_location: str
+    password_hash: str
+    debug: bool = False
+    template_cache_dir: Optional[str] = None
+    template_strip_whitespace: bool = False
+    compress_min_size: Optional[int] = 512
+    compress_gzip_level: int = 6
+    compress_brotli_quality: int = 4
+    sql_profiling: bool = False
+    query_budget: Optional[int] = None
+    query_budgets: dict[str, int] = field(default_factory=dict)
+    query_budget_strict: bool = False
+    scraper_attempts: int = 4
+    scraper_timeout: float = 15.0
+    parse_workers: int = 2
+    db_pool_size: int = 5
+    db_max_overflow: int = 10
+    static_build_dir: Optional[str] = None
+    snapshot_dir: Optional[str] = None
+    page_archive_dir: Optional[str] = None
+    sync_trace_memory: bool = False
+    live_min_interval: float = 15.0
+    live_max_interval: float = 300.0
+    trace_sample_rate: float = 0.01
+    trace_file: Optional[str] = None
+    trace_otlp_endpoint: Optional[str] = None
+    trace_trusted_clients: tuple[str, ...] = ()
+
+    @classmethod
+    def from_env(cls, require_password: bool = True) -> "Settings":
+        """
+        Builds settings from the environment, loading `.env` first.
+
+        Args:
+            require_password (bool): False for tools that never serve the admin panel (e.g. the sync CLI).
+
+        Raises:
+            RuntimeError: If `DB_LOCATION` or (when required) `PASSWORD` is not set
+        """
+        load_dotenv()
+
+        db_location = os.getenv("DB_LOCATION")
+        if not db_location:
+            raise RuntimeError("DB_LOCATION is not set in .env file!!!\n")
+
+        password_hash = os.getenv("PASSWORD", "")
+        if not password_hash and require_password:
+            raise RuntimeError("PASSWORD (bcrypt hash) is not set in .env!!!\n")
+
+        return cls(
+            db_location=db_location,
+            password_hash=password_hash,
+            debug=_env_flag("DEBUG"),
+            template_cache_dir=os.getenv("TEMPLATE_CACHE_DIR", ".cache/jinja") or None,
+            template_strip_whitespace=_env_flag("TEMPLATE_STRIP_WHITESPACE"),
+            compress_min_size=int(os.getenv("COMPRESS_MIN_SIZE", "512")) if os.getenv("COMPRESS_MIN_SIZE", "512") else None,
+            compress_gzip_level=int(os.getenv("COMPRESS_GZIP_LEVEL", "6")),
+            compress_brotli_quality=int(os.getenv("COMPRESS_BROTLI_QUALITY", "4")),
+            sql_profiling=_env_flag("SQL_PROFILING"),
+            query_budget=int(os.environ["QUERY_BUDGET"]) if os.getenv("QUERY_BUDGET") else None,
+            query_budgets=_env_budgets("QUERY_BUDGETS"),
+            query_budget_strict=_env_flag("QUERY_BUDGET_STRICT"),
+            scraper_attempts=int(os.getenv("SCRAPER_ATTEMPTS", "4")),
+            scraper_timeout=float(os.getenv("SCRAPER_TIMEOUT", "15")),
+            parse_workers=int(os.getenv("PARSE_WORKERS", "2")),
+            db_pool_size=int(os.getenv("DB_POOL_SIZE", "5")),
+            db_max_overflow=int(os.getenv("DB_MAX_OVERFLOW", "10")),
+            static_build_dir=os.getenv("STATIC_BUILD_DIR", ".cache/static") or None,
+            snapshot_dir=os.getenv("SNAPSHOT_DIR", ".cache/snapshots") or None,
+            page_archive_dir=os.getenv("PAGE_ARCHIVE_DIR") or None,
+            sync_trace_memory=_env_flag("SYNC_TRACE_MEMORY"),
+            live_min_interval=float(os.getenv("LIVE_MIN_INTERVAL", "15")),
+            live_max_interval=float(os.getenv("LIVE_MAX_INTERVAL", "300")),
+            trace_sample_rate=float(os.getenv("TRACE_SAMPLE_RATE", "0.01")),
+            trace_file=os.getenv("TRACE_FILE") or None,
+            trace_otlp_endpoint=os.getenv("TRACE_OTLP_ENDPOINT") or None,
+            trace_trusted_clients=tuple(filter(None, os.getenv("TRACE_TRUSTED_CLIENTS", "").replace(" ", "").split(",")))
+        )
@@ -0,0 +1,171 @@
+from dataclasses import dataclass
+from typing import Callable, Iterable, Optional
+from sqlalchemy import Engine, create_engine
+from sqlalchemy.orm import sessionmaker
+from db import make_session_factory
+from metrics import SNAPSHOT_PUBLISH_DURATION, SNAPSHOT_TIMESTAMP
+import asyncio
+import os
+import sqlite3
+import threading
+import time
+
+PREFIX = "scwr-"
+SUFFIX = ".db"
+
+@dataclass
+class Snapshot:
+    """
+    One published read snapshot.
+
+    Attributes:
+        path (str): The snapshot file.
+        engine (Engine): Read-only engine on `path`.
+        session_factory (sessionmaker): Sessions bound to `engine`.
+    """
+    path: str
+    engine: Engine
+    session_factory: sessionmaker
+
+def _snapshot_number(name: str) -> Optional[int]:
+    if not (name.startswith(PREFIX) and name.endswith(SUFFIX)):
+        return None
+    number = name[len(PREFIX):-len(SUFFIX)]
+    return int(number) if number.isdigit() else None
+
+class SnapshotStore:
+    """
+    Serves public reads from a copy of the database that sync never writes to.
+
+    Sync and the admin panel keep writing to the primary database. Once they
+    are done, `publish()` copies the committed database into a new read-only
+    file with SQLite's backup API and makes it the current snapshot, so
+    readers never wait on a sync's writes or see a half-synced roster.
+
+    Any process can publish (e.g. `python -m scraper sync`): the store picks
+    up the newest file in `directory` whenever the directory changes. The
+    last `keep` files are kept so readers of the previous snapshot can finish.
+
+    Only file based SQLite databases are snapshotted. For other databases
+    (or in-memory SQLite, or without a `directory`) the store is disabled
+    and reads go to the primary database.
+
+    Attributes:
+        engine (Engine): The primary database.
+        directory (Optional[str]): Where snapshot files are written.
+        keep (int): Snapshot files kept on disk, at least 2.
+        instruments (tuple): Called with every snapshot engine, e.g. `metrics.instrument_engine`.
+    """
+    def __init__(
+        self,
+        engine: Engine,
+        directory: Optional[str],
+        keep: int = 2,
+        instruments: Iterable[Callable[[Engine], None]] = ()
+    ):
+        self.engine = engine
+        self.instruments = tuple(instruments)
+        self.keep = max(keep, 2)
+        database = engine.url.database
+        enabled = engine.dialect.name == "sqlite" and database not in (None, "", ":memory:") and bool(directory)
+        self.directory = directory if enabled else None
+        self._primary = make_session_factory(engine)
+        self._current: Optional[Snapshot] = None
+        self._seen_mtime: Optional[int] = None
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        return self.directory is not None
+
+    def session_factory(self) -> sessionmaker:
+        """
+        Returns the session factory of the newest snapshot, or of the primary
+        database when there is none (yet).
+        """
+        if not self.enabled:
+            return self._primary
+        try:
+            mtime = os.stat(self.directory).st_mtime_ns
+        except FileNotFoundError:
+            return self._primary
+        if mtime != self._seen_mtime:
+            with self._lock:
+                self._open_newest()
+                self._seen_mtime = mtime
+        return self._current.session_factory if self._current is not None else self._primary
+
+    def publish(self) -> Optional[str]:
+        """
+        Copies the committed state of the primary database into a new
+        snapshot and makes it current. Blocking, async code should use
+        `publish_async()`.
+
+        Returns:
+            Optional[str]: Path of the new snapshot, None if the store is disabled.
+
+        Side effects:
+        - Writes a new file to `directory` and deletes all but the newest `keep`.
+        """
+        if not self.enabled:
+            return None
+
+        start = time.perf_counter()
+        os.makedirs(self.directory, exist_ok=True)
+        path = os.path.join(self.directory, f"{PREFIX}{time.time_ns()}{SUFFIX}")
+        tmp_path = path + ".tmp"
+
+        # A plain connection instead of the engine's pool: the backup only
+        # ever sees committed data and can run on any thread
+        source = sqlite3.connect(self.engine.url.database)
+        target = sqlite3.connect(tmp_path)
+        try:
+            with target:
+                source.backup(target)
+        finally:
+            target.close()
+            source.close()
+        os.replace(tmp_path, path) # readers only ever see complete files
+
+        with self._lock:
+            self._open_newest()
+            self._seen_mtime = os.stat(self.directory).st_mtime_ns
+        SNAPSHOT_PUBLISH_DURATION.observe(time.perf_counter() - start)
+        return path
+
+    async def publish_async(self) -> Optional[str]:
+        """
+        `publish()` on a worker thread, so the event loop keeps serving while the database is copied.
+        """
+        return await asyncio.to_thread(self.publish)
+
+    def _open_newest(self) -> None:
+        numbered = sorted(
+            (n, name) for name in os.listdir(self.directory)
+            if (n := _snapshot_number(name)) is not None
+        )
+        if not numbered:
+            return
+
+        newest = os.path.join(self.directory, numbered[-1][1])
+        if self._current is None or self._current.path != newest:
+            engine = create_engine(f"sqlite:///file:{os.path.abspath(newest)}?mode=ro&uri=true")
+            for instrument in self.instruments:
+                instrument(engine)
+            previous = self._current
+            self._current = Snapshot(newest, engine, make_session_factory(engine))
+            SNAPSHOT_TIMESTAMP.set(numbered[-1][0] / 1e9)
+            if previous is not None:
+                # Sessions still reading it keep their connection until they close
+                previous.engine.dispose(close=False)
+
+        for _, name in numbered[:-self.keep]:
+            try:
+                os.remove(os.path.join(self.directory, name))
+            except OSError:
+                pass
+
+    def close(self) -> None:
+        if self._current is not None:
+            self._current.engine.dispose()
+            self._current = None
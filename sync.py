@@ -0,0 +1,671 @@
+from collections import deque
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+from itertools import groupby
+from typing import AsyncIterator, Callable, Iterable, Iterator, Optional
+from sqlalchemy import func, or_, select, delete, insert, text, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session, sessionmaker
+from db import ClubSwimmer, ClubSwimmerPb, SyncTarget, as_utc, copy_rows, insert_missing, retire_athletes, supports_copy
+from metrics import SYNC_LAST_DURATION, SYNC_LAST_PEAK_MEMORY, SYNC_LAST_TIMESTAMP, SYNC_LAST_ROWS
+from scraper.base_scraper import ScraperError
+from scraper.swimrankings import PbBatch, SwimrankingsScraper, Swimmer
+from discovery import discover_roster
+from tracing import tracer
+import asyncio
+import time
+import tracemalloc
+
+# The scraped content of a pb. Bookkeeping columns (`athlete_id`, `last_scraped`)
+# are left out so re-scraping an unchanged pb doesn't count as a change
+PB_FIELDS = ("sw_style_id", "sw_meet_id", "sw_default_fina", "event",
+             "course", "time", "pts", "date", "city", "meet_name")
+# Portfolio pages fetched ahead of the athlete being written, so the next
+# fetch (and the parse pool) stay busy while the DB work happens
+PREFETCH_PAGES = 4
+# Athletes whose pbs are merged (and committed) together on PostgreSQL, see
+# `copy_pbs`; other databases write and commit one athlete at a time
+COPY_BATCH = 50
+# Athletes read from the database at a time during a sync; only these (plus
+# the prefetched ones) are held in memory, whatever the roster size
+SYNC_CHUNK = 200
+
+@dataclass
+class SyncResult:
+    """
+    What a sync did.
+
+    Attributes:
+        swimmers (int): Swimmers on the synced rosters.
+        swimmers_added (int): New `scwr_swimmers` rows.
+        swimmers_removed (int): Swimmers deleted because they left a roster.
+        pbs_inserted (int): New `athlete_pbs` rows.
+        pbs_updated (int): Existing pbs with at least one changed column in `PB_FIELDS`.
+        pbs_unchanged (int): Existing pbs scraped again without changes (not written).
+        pbs_deleted (int): Stored pbs no longer listed for their athlete (superseded results).
+        failed (list[str]): Names of athletes whose pbs couldn't be scraped.
+        failed_clubs (list[int]): Clubs whose roster couldn't be scraped (left untouched).
+        roster_pages (int): Ranking pages requested to discover the rosters.
+        swimmers_skipped (int): Swimmers whose pbs weren't checked because they were checked recently.
+        peak_memory (Optional[int]): Peak Python heap during the sync in bytes, with `SyncOptions.trace_memory`.
+    """
+    swimmers: int = 0
+    swimmers_added: int = 0
+    swimmers_removed: int = 0
+    pbs_inserted: int = 0
+    pbs_updated: int = 0
+    pbs_unchanged: int = 0
+    pbs_deleted: int = 0
+    failed: list[str] = field(default_factory=list)
+    failed_clubs: list[int] = field(default_factory=list)
+    roster_pages: int = 0
+    swimmers_skipped: int = 0
+    peak_memory: Optional[int] = None
+
+    def merge(self, other: "SyncResult") -> None:
+        self.swimmers += other.swimmers
+        self.swimmers_added += other.swimmers_added
+        self.swimmers_removed += other.swimmers_removed
+        self.pbs_inserted += other.pbs_inserted
+        self.pbs_updated += other.pbs_updated
+        self.pbs_unchanged += other.pbs_unchanged
+        self.pbs_deleted += other.pbs_deleted
+        self.failed.extend(other.failed)
+        self.failed_clubs.extend(other.failed_clubs)
+        self.roster_pages += other.roster_pages
+        self.swimmers_skipped += other.swimmers_skipped
+
+    def rows(self) -> dict[str, int]:
+        return {
+            "swimmers": self.swimmers,
+            "swimmers_added": self.swimmers_added,
+            "swimmers_removed": self.swimmers_removed,
+            "pbs_inserted": self.pbs_inserted,
+            "pbs_updated": self.pbs_updated,
+            "pbs_unchanged": self.pbs_unchanged,
+            "pbs_deleted": self.pbs_deleted,
+            "athletes_failed": len(self.failed),
+            "clubs_failed": len(self.failed_clubs),
+            "roster_pages": self.roster_pages,
+            "swimmers_skipped": self.swimmers_skipped,
+        }
+
+@dataclass
+class SyncOptions:
+    """
+    How thorough a sync is and how hard it works.
+
+    Attributes:
+        full_discovery (bool): Scan every ranking view instead of the cached cover (see `discover_roster`).
+        checked_before (Optional[datetime]): Only check pbs of swimmers last checked before this; None checks everyone.
+        prefetch (int): Portfolio pages fetched ahead of the writes (see `prefetch_pbs`).
+        max_clubs (Optional[int]): Clubs synced at the same time; None syncs them all at once.
+        chunk_size (int): Athletes read from the database at a time (see `swimmer_chunks`).
+        trace_memory (bool): Record the sync's peak Python memory with `tracemalloc` in `SyncResult.peak_memory` (slows the sync down).
+    """
+    full_discovery: bool = False
+    checked_before: Optional[datetime] = None
+    prefetch: int = PREFETCH_PAGES
+    max_clubs: Optional[int] = None
+    chunk_size: int = SYNC_CHUNK
+    trace_memory: bool = False
+
+@dataclass
+class SyncEvent:
+    """
+    Progress of a running sync, reported once per athlete it touches.
+
+    Attributes:
+        status (str): `added`, `removed` (roster changes), then `updated`, `unchanged` or `failed` once their pbs were checked.
+        sw_club_id (int): Club being synced.
+        id (int): `scwr_swimmers.id` of the athlete.
+        sw_id (int): swimrankings.net id of the athlete.
+        birth_year (int): As on `ClubSwimmer`.
+        first_name (str): As on `ClubSwimmer`.
+        last_name (str): As on `ClubSwimmer`.
+        gender (int): As on `ClubSwimmer`.
+        done (int): Athletes of this club whose pbs have been checked so far.
+        total (int): Athletes on this club's roster.
+    """
+    status: str
+    sw_club_id: int
+    id: int
+    sw_id: int
+    birth_year: int
+    first_name: str
+    last_name: str
+    gender: int
+    done: int
+    total: int
+
+    @classmethod
+    def of(cls, status: str, swimmer: ClubSwimmer, done: int = 0, total: int = 0) -> "SyncEvent":
+        return cls(status, swimmer.sw_club_id, swimmer.id, swimmer.sw_id, swimmer.birth_year,
+                   swimmer.first_name, swimmer.last_name, swimmer.gender, done, total)
+
+Progress = Callable[[SyncEvent], None]
+# `ClubSwimmer` columns a `SyncEvent` is made of, in field order
+EVENT_COLUMNS = ("sw_club_id", "id", "sw_id", "birth_year", "first_name", "last_name", "gender")
+
+def new_club_swimmer(swimmer: Swimmer, sw_club_id: int) -> ClubSwimmer:
+    return ClubSwimmer(
+        sw_club_id = sw_club_id,
+        sw_id = swimmer.sw_id,
+        birth_year = swimmer.birth_year,
+        first_name = swimmer.first_name,
+        last_name = swimmer.last_name,
+        gender = swimmer.gender.value
+    )
+
+def add_club_swimmer(db: Session, swimmer: Swimmer, sw_club_id: int) -> tuple[ClubSwimmer, bool]:
+    """
+    Returns the row of `swimmer` on the roster of `sw_club_id`, adding it if
+    there is none. A concurrent add of the same swimmer (e.g. a double
+    submitted form) ends on the unique `(sw_club_id, sw_id)` index and gets
+    the row the other one added.
+
+    Side effects:
+    - Commits the new row, or rolls back the failed add.
+
+    Returns:
+        tuple[ClubSwimmer, bool]: The row, and whether it was added.
+    """
+    stmt = select(ClubSwimmer).filter_by(sw_club_id=sw_club_id, sw_id=swimmer.sw_id)
+    existing = db.execute(stmt).scalar_one_or_none()
+    if existing is not None:
+        return existing, False
+
+    row = new_club_swimmer(swimmer, sw_club_id)
+    db.add(row)
+    try:
+        db.commit()
+    except IntegrityError:
+        db.rollback()
+        return db.execute(stmt).scalar_one(), False
+    return row, True
+
+@tracer.traced("pbs.upsert")
+def upsert_pbs(
+    db: Session,
+    swimmer: ClubSwimmer,
+    pbs: PbBatch,
+    result: SyncResult,
+    now: Optional[datetime] = None
+) -> None:
+    """
+    Makes the stored pbs of `swimmer` match `pbs`, matched on `sw_result_id`.
+
+    New results are inserted, rows with a changed `PB_FIELDS` column are
+    updated and results swimrankings.net no longer lists (beaten by a newer
+    pb) are deleted. Unchanged rows are left alone, so re-syncing an athlete
+    without new results only writes their `pbs_checked_at`; any change also
+    stamps `pbs_changed_at`, which cached rankings are keyed on.
+
+    Works on plain rows and bulk statements (one per kind of change), no
+    `ClubSwimmerPb` objects are built.
+
+    Does not commit.
+    """
+    now = now or datetime.now(timezone.utc)
+    stmt = (
+        select(ClubSwimmerPb.id, ClubSwimmerPb.sw_result_id, *(getattr(ClubSwimmerPb, f) for f in PB_FIELDS))
+        .filter_by(athlete_id=swimmer.id)
+    )
+    stored, stale = {}, []
+    for row in db.execute(stmt):
+        if row.sw_result_id in stored:
+            stale.append(row.id) # duplicate of a result already stored
+        else:
+            stored[row.sw_result_id] = row
+    inserts, updates = [], []
+
+    for record in pbs.records():
+        row = stored.pop(record["sw_result_id"], None)
+
+        if row is None:
+            record["athlete_id"] = swimmer.id
+            record["last_scraped"] = now
+            inserts.append(record)
+            continue
+
+        changed = {f: record[f] for f in PB_FIELDS if getattr(row, f) != record[f]}
+        if changed:
+            changed["id"] = row.id
+            changed["last_scraped"] = now
+            updates.append(changed)
+        else:
+            result.pbs_unchanged += 1
+
+    if inserts:
+        db.execute(insert(ClubSwimmerPb), inserts)
+        result.pbs_inserted += len(inserts)
+    if updates:
+        db.execute(update(ClubSwimmerPb), updates)
+        result.pbs_updated += len(updates)
+    stale += [row.id for row in stored.values()]
+    if stale:
+        db.execute(delete(ClubSwimmerPb).where(ClubSwimmerPb.id.in_(stale)))
+        result.pbs_deleted += len(stale)
+
+    swimmer.pbs_checked_at = now
+    if inserts or updates or stale:
+        swimmer.pbs_changed_at = datetime.now(timezone.utc)
+
+@tracer.traced("pbs.copy")
+def copy_pbs(
+    db: Session,
+    items: list[tuple[ClubSwimmer, PbBatch]],
+    result: SyncResult,
+    now: Optional[datetime] = None
+) -> set[int]:
+    """
+    `upsert_pbs` for many athletes at once, for PostgreSQL.
+
+    Every scraped pb is streamed with `COPY` into a temporary staging table,
+    which is then merged into `athlete_pbs` with three set-based statements:
+    delete stored results that are no longer listed (or duplicated), update
+    rows whose `PB_FIELDS` differ and insert new results. The statement count
+    doesn't grow with the number of athletes or pbs.
+
+    Returns:
+        set[int]: Ids of the swimmers whose pbs changed.
+
+    Does not commit.
+    """
+    now = now or datetime.now(timezone.utc)
+    ids = [swimmer.id for swimmer, _ in items]
+    columns = ("athlete_id", "sw_result_id", *PB_FIELDS)
+    fields = ", ".join(PB_FIELDS)
+
+    db.execute(text(
+        f"CREATE TEMPORARY TABLE IF NOT EXISTS pb_staging AS "
+        f"SELECT {', '.join(columns)} FROM athlete_pbs WITH NO DATA"
+    ))
+    db.execute(text("TRUNCATE pb_staging"))
+    copy_rows(db, "pb_staging", columns, (
+        (swimmer.id, *(record[c] for c in columns[1:]))
+        for swimmer, pbs in items for record in pbs.records()
+    ))
+
+    deleted = db.execute(text(
+        "DELETE FROM athlete_pbs p WHERE p.athlete_id = ANY(:ids) AND ("
+        " NOT EXISTS (SELECT 1 FROM pb_staging s WHERE s.athlete_id = p.athlete_id AND s.sw_result_id = p.sw_result_id)"
+        " OR EXISTS (SELECT 1 FROM athlete_pbs d WHERE d.athlete_id = p.athlete_id AND d.sw_result_id = p.sw_result_id AND d.id < p.id)"
+        ") RETURNING p.athlete_id"
+    ), {"ids": ids}).scalars().all()
+
+    staged = "(SELECT DISTINCT ON (athlete_id, sw_result_id) * FROM pb_staging)"
+    updated = db.execute(text(
+        f"UPDATE athlete_pbs p SET {', '.join(f'{f} = s.{f}' for f in PB_FIELDS)}, last_scraped = :now"
+        f" FROM {staged} s"
+        f" WHERE p.athlete_id = s.athlete_id AND p.sw_result_id = s.sw_result_id"
+        f" AND ({', '.join(f'p.{f}' for f in PB_FIELDS)}) IS DISTINCT FROM ({', '.join(f's.{f}' for f in PB_FIELDS)})"
+        f" RETURNING p.athlete_id"
+    ), {"now": now}).scalars().all()
+
+    inserted = db.execute(text(
+        f"INSERT INTO athlete_pbs (athlete_id, sw_result_id, {fields}, last_scraped)"
+        f" SELECT athlete_id, sw_result_id, {fields}, :now FROM {staged} s"
+        f" WHERE NOT EXISTS (SELECT 1 FROM athlete_pbs p WHERE p.athlete_id = s.athlete_id AND p.sw_result_id = s.sw_result_id)"
+        f" RETURNING athlete_id"
+    ), {"now": now}).scalars().all()
+
+    result.pbs_deleted += len(deleted)
+    result.pbs_updated += len(updated)
+    result.pbs_inserted += len(inserted)
+    staged_count = sum(len(set(pbs.sw_result_id)) for _, pbs in items)
+    result.pbs_unchanged += staged_count - len(updated) - len(inserted)
+
+    changed = set(deleted) | set(updated) | set(inserted)
+    changed_at = datetime.now(timezone.utc)
+    for swimmer, _ in items:
+        swimmer.pbs_checked_at = now
+        if swimmer.id in changed:
+            swimmer.pbs_changed_at = changed_at
+    return changed
+
+def write_pbs(
+    db: Session,
+    items: list[tuple[ClubSwimmer, PbBatch]],
+    result: SyncResult,
+    now: Optional[datetime] = None
+) -> set[int]:
+    """
+    Upserts the pbs of every `(swimmer, pbs)` in `items`: with one `COPY`
+    and merge on PostgreSQL (`copy_pbs`), athlete by athlete otherwise
+    (`upsert_pbs`).
+
+    Returns:
+        set[int]: Ids of the swimmers whose pbs changed.
+
+    Does not commit.
+    """
+    if supports_copy(db):
+        return copy_pbs(db, items, result, now)
+
+    changed = set()
+    for swimmer, pbs in items:
+        writes = result.pbs_inserted + result.pbs_updated + result.pbs_deleted
+        upsert_pbs(db, swimmer, pbs, result, now)
+        if result.pbs_inserted + result.pbs_updated + result.pbs_deleted > writes:
+            changed.add(swimmer.id)
+    return changed
+
+async def prefetch_pbs(
+    scraper: SwimrankingsScraper,
+    swimmers: Iterable[ClubSwimmer],
+    window: int = PREFETCH_PAGES
+) -> AsyncIterator[tuple[ClubSwimmer, Optional[PbBatch], Optional[Exception]]]:
+    """
+    Yields `(swimmer, pbs, error)` in roster order while keeping up to
+    `window` pbs fetches in flight. `error` is set (and `pbs` None) when the
+    athlete's page couldn't be fetched or parsed.
+
+    The fetches still queue on the scraper's rate limit; what overlaps is
+    one page's parsing and upsert with the next page's download.
+
+    `swimmers` is only read as far as the window reaches, so it can be a
+    generator over a roster too big to load at once.
+    """
+    pending = iter(swimmers)
+    in_flight = deque()
+
+    def schedule() -> None:
+        swimmer = next(pending, None)
+        if swimmer is not None:
+            in_flight.append((swimmer, asyncio.ensure_future(scraper.fetch_athlete_personal_bests(swimmer.sw_id))))
+
+    for _ in range(window):
+        schedule()
+
+    try:
+        while in_flight:
+            swimmer, task = in_flight.popleft()
+            schedule()
+            try:
+                pbs, error = await task, None
+            except (ScraperError, ValueError) as e:
+                pbs, error = None, e
+            yield swimmer, pbs, error
+    finally:
+        for _, task in in_flight:
+            task.cancel()
+
+def swimmer_chunks(
+    db: Session,
+    sw_club_id: int,
+    checked_before: Optional[datetime] = None,
+    chunk_size: int = SYNC_CHUNK
+) -> Iterator[list[ClubSwimmer]]:
+    """
+    Yields the club's swimmers (only those last checked before
+    `checked_before`, if given) in id order, `chunk_size` at a time.
+
+    Each chunk is its own keyset-paginated query, so the rows of earlier
+    chunks can be expunged and freed while later ones are read, and commits
+    in between don't skip or repeat anyone.
+    """
+    last_id = 0
+    while True:
+        stmt = select(ClubSwimmer).where(ClubSwimmer.sw_club_id == sw_club_id, ClubSwimmer.id > last_id)
+        if checked_before is not None:
+            stmt = stmt.where(or_(ClubSwimmer.pbs_checked_at.is_(None), ClubSwimmer.pbs_checked_at < as_utc(checked_before)))
+        chunk = db.execute(stmt.order_by(ClubSwimmer.id).limit(chunk_size)).scalars().all()
+        if not chunk:
+            return
+        yield chunk
+        last_id = chunk[-1].id
+
+@tracer.traced("sync.club")
+async def sync_club(
+    db: Session,
+    scraper: SwimrankingsScraper,
+    sw_club_id: int,
+    targets: list[SyncTarget],
+    progress: Optional[Progress] = None,
+    options: Optional[SyncOptions] = None
+) -> SyncResult:
+    """
+    Syncs one club's roster and the pbs of every athlete on it (or, with
+    `options.checked_before`, of those not checked since).
+
+    `progress` (if given) is called with a `SyncEvent` for every athlete
+    added, removed or checked, right after that change is committed.
+
+    Memory doesn't grow with the roster: athletes are read
+    `options.chunk_size` at a time (see `swimmer_chunks`), scraped pbs are
+    streamed through (see `prefetch_pbs`), and every athlete is expunged
+    from the session once their pbs are committed.
+
+    Side effects:
+    - Scrapes swimrankings.net for the roster (see `discover_roster`) plus once per athlete,
+        a few athletes ahead of the writes (see `prefetch_pbs`).
+    - Adds new athletes, deletes athletes that left the club and upserts pbs (see `write_pbs`),
+        committing per athlete (per `COPY_BATCH` athletes on PostgreSQL).
+
+    Raises:
+        ScraperError: If no roster page could be scraped (nothing is written)
+    """
+    options = options or SyncOptions()
+    result = SyncResult()
+    tracer.annotate(sw_club_id=sw_club_id)
+    discovery = await discover_roster(db, scraper, sw_club_id, targets, full=options.full_discovery)
+    result.roster_pages = discovery.pages
+
+    if not discovery.athletes:
+        db.commit()
+        return result
+
+    stmt = select(ClubSwimmer.sw_id).filter_by(sw_club_id=sw_club_id)
+    known = set(db.execute(stmt).scalars())
+    new = [swimmer for sw_id, swimmer in discovery.athletes.items() if sw_id not in known]
+
+    # Plain rows instead of `ClubSwimmer` objects, a chunk per statement, so
+    # a first sync of a big club doesn't build an object per athlete. An
+    # admin can add one of them meanwhile, those rows are skipped
+    added = []
+    stmt = (
+        insert_missing(db, ClubSwimmer, ClubSwimmer.sw_club_id, ClubSwimmer.sw_id)
+        .returning(*(getattr(ClubSwimmer, c) for c in EVENT_COLUMNS))
+    )
+    for i in range(0, len(new), options.chunk_size):
+        added += db.execute(stmt, [
+            {
+                "sw_club_id": sw_club_id,
+                "sw_id": swimmer.sw_id,
+                "birth_year": swimmer.birth_year,
+                "first_name": swimmer.first_name,
+                "last_name": swimmer.last_name,
+                "gender": swimmer.gender.value,
+            }
+            for swimmer in new[i:i + options.chunk_size]
+        ]).all()
+    result.swimmers_added = len(added)
+
+    # If a view we had never seen failed, someone might only be listed there
+    removed = []
+    if discovery.complete:
+        stmt = (
+            select(*(getattr(ClubSwimmer, c) for c in EVENT_COLUMNS))
+            .where(ClubSwimmer.sw_club_id == sw_club_id)
+            .where(ClubSwimmer.sw_id.notin_(list(discovery.athletes.keys() | discovery.keep)))
+        )
+        removed = [SyncEvent("removed", *row, 0, 0) for row in db.execute(stmt)]
+        if removed:
+            retire_athletes(db, ClubSwimmer.id.in_([e.id for e in removed]))
+        result.swimmers_removed = len(removed)
+
+    count = select(func.count()).select_from(ClubSwimmer).where(ClubSwimmer.sw_club_id == sw_club_id)
+    result.swimmers = db.execute(count).scalar_one()
+    added = [SyncEvent("added", *row, 0, result.swimmers) for row in added]
+    db.commit()
+    # The roster is in the database now, nothing of it needs to stay in
+    # memory for the (long) pb part
+    db.expunge_all()
+    del discovery, known, new
+    # Only this session writes these rows during the sync, so there's no
+    # need to reload every swimmer after each commit
+    db.expire_on_commit = False
+
+    if progress:
+        for event in removed + added:
+            progress(event)
+    del removed, added
+
+    due = result.swimmers
+    if options.checked_before is not None:
+        checked_before = as_utc(options.checked_before)
+        due = db.execute(count.where(or_(
+            ClubSwimmer.pbs_checked_at.is_(None), ClubSwimmer.pbs_checked_at < checked_before
+        ))).scalar_one()
+        result.swimmers_skipped = result.swimmers - due
+
+    batch_size = COPY_BATCH if supports_copy(db) else 1
+    pending: list[tuple[ClubSwimmer, PbBatch, int]] = []
+
+    def write_pending() -> None:
+        changed = write_pbs(db, [(swimmer, pbs) for swimmer, pbs, _ in pending], result)
+        db.commit()
+        for swimmer, _, done in pending:
+            if progress:
+                progress(SyncEvent.of("updated" if swimmer.id in changed else "unchanged", swimmer, done, due))
+            db.expunge(swimmer)
+        pending.clear()
+
+    chunks = swimmer_chunks(db, sw_club_id, options.checked_before, options.chunk_size)
+    swimmers = (swimmer for chunk in chunks for swimmer in chunk)
+    done = 0
+    async for swimmer, pbs, error in prefetch_pbs(scraper, swimmers, options.prefetch):
+        done += 1
+        if error is not None:
+            # One bad page shouldn't throw away the rest of the sync,
+            # this athlete just keeps their previous pbs
+            print(error)
+            result.failed.append(f"{swimmer.first_name} {swimmer.last_name}")
+            if pending:
+                write_pending() # keep progress events in roster order
+            if progress:
+                progress(SyncEvent.of("failed", swimmer, done, due))
+            db.expunge(swimmer)
+            continue
+
+        pending.append((swimmer, pbs, done))
+        if len(pending) >= batch_size:
+            write_pending()
+
+    if pending:
+        write_pending()
+
+    return result
+
+@tracer.traced("sync.athlete", root=True)
+async def sync_athlete(db: Session, scraper: SwimrankingsScraper, sw_id: int) -> SyncResult:
+    """
+    Re-checks the pbs of one athlete already in the database (every club
+    row with that `sw_id`), leaving rosters alone.
+
+    `result.swimmers` is 0 if nobody has that id.
+
+    Side effects:
+    - Scrapes swimrankings.net once.
+    - Upserts the athlete's pbs and commits.
+    """
+    result = SyncResult()
+    swimmers = db.execute(select(ClubSwimmer).filter_by(sw_id=sw_id)).scalars().all()
+    result.swimmers = len(swimmers)
+    if not swimmers:
+        return result
+
+    try:
+        pbs = await scraper.fetch_athlete_personal_bests(sw_id)
+    except (ScraperError, ValueError) as e:
+        print(e)
+        result.failed.extend(f"{s.first_name} {s.last_name}" for s in swimmers)
+        return result
+
+    write_pbs(db, [(swimmer, pbs) for swimmer in swimmers], result)
+    db.commit()
+    return result
+
+def active_targets(db: Session) -> list[SyncTarget]:
+    stmt = select(SyncTarget).filter_by(active=True).order_by(SyncTarget.sw_club_id, SyncTarget.id)
+    targets = db.execute(stmt).scalars().all()
+    db.expunge_all()
+    return list(targets)
+
+@tracer.traced("sync", root=True)
+async def sync_targets(
+    session_factory: sessionmaker,
+    scraper: SwimrankingsScraper,
+    targets: Optional[list[SyncTarget]] = None,
+    progress: Optional[Progress] = None,
+    options: Optional[SyncOptions] = None
+) -> SyncResult:
+    """
+    Syncs every club in `targets` (default: all active targets) concurrently.
+
+    Each club gets its own session. They share `scraper`, and the rate limit
+    on `BaseScraper._request` is global, so running clubs side by side never
+    raises the request rate to swimrankings.net; it only overlaps one club's
+    parsing and DB work with another club's waiting.
+
+    `progress` and `options` are passed on to every `sync_club`; at most
+    `options.max_clubs` clubs run at once.
+
+    With `options.trace_memory` the peak Python heap of the whole sync is
+    measured with `tracemalloc` (started for the sync unless something else
+    is already tracing, in which case the peak includes what ran before).
+
+    Side effects:
+    - Records the sync in the `sync_last_*` metrics.
+    """
+    start = time.perf_counter()
+    options = options or SyncOptions()
+    tracing = options.trace_memory and not tracemalloc.is_tracing()
+    if tracing:
+        tracemalloc.start()
+    try:
+        total = await _sync_targets(session_factory, scraper, targets, progress, options)
+        if options.trace_memory:
+            total.peak_memory = tracemalloc.get_traced_memory()[1]
+            SYNC_LAST_PEAK_MEMORY.set(total.peak_memory)
+    finally:
+        if tracing:
+            tracemalloc.stop()
+
+    for kind, count in total.rows().items():
+        SYNC_LAST_ROWS.set(count, kind=kind)
+    SYNC_LAST_DURATION.set(time.perf_counter() - start)
+    SYNC_LAST_TIMESTAMP.set(time.time())
+
+    return total
+
+async def _sync_targets(
+    session_factory: sessionmaker,
+    scraper: SwimrankingsScraper,
+    targets: Optional[list[SyncTarget]],
+    progress: Optional[Progress],
+    options: SyncOptions
+) -> SyncResult:
+    if targets is None:
+        with session_factory() as db:
+            targets = active_targets(db)
+
+    slots = asyncio.Semaphore(options.max_clubs or len(targets) or 1)
+
+    async def run(sw_club_id: int, club_targets: list[SyncTarget]) -> SyncResult:
+        async with slots:
+            with session_factory() as db:
+                try:
+                    return await sync_club(db, scraper, sw_club_id, club_targets, progress, options)
+                except ScraperError as e:
+                    print(e)
+                    return SyncResult(failed_clubs=[sw_club_id])
+
+    clubs = [(club, list(group)) for club, group in groupby(sorted(targets, key=lambda t: t.sw_club_id), key=lambda t: t.sw_club_id)]
+    results = await asyncio.gather(*(run(club, group) for club, group in clubs))
+
+    total = SyncResult()
+    for result in results:
+        total.merge(result)
+    return total
@@ -0,0 +1,146 @@
+from collections import Counter
+from typing import AsyncIterator, Callable, Optional
+from fastapi import FastAPI
+from jinja2 import Environment
+from sqlalchemy.orm import sessionmaker
+from scraper.swimrankings import SwimrankingsScraper
+from snapshots import SnapshotStore
+from sync import SyncEvent, SyncOptions, SyncResult, sync_targets
+from templating import make_templates
+import asyncio
+import itertools
+
+_job_numbers = itertools.count(1)
+
+def format_sse(event_id: str, event: str, data: str) -> str:
+    """
+    Formats one server-sent event. Every line of `data` gets its own `data:`
+    field, the browser joins them back together with newlines.
+    """
+    lines = [f"id: {event_id}", f"event: {event}"]
+    lines += [f"data: {line}" for line in data.splitlines() or [""]]
+    return "\n".join(lines) + "\n\n"
+
+class EventLog:
+    """
+    Server-sent events any number of clients can follow.
+
+    Every message is kept, so a client that connects late (or reconnects
+    with `Last-Event-ID`) replays what it missed. Messages are rendered once,
+    however many clients are listening.
+
+    Attributes:
+        number (int): Sequence number of the log within this process, part of every event id.
+        messages (list[str]): Formatted events, in order.
+        done (bool): Whether the log is closed, listeners stop after the last message.
+        env (Environment): Template environment the events are rendered with, the app's (`app.state.templates.env`).
+    """
+    def __init__(self, env: Optional[Environment] = None):
+        self.env = env if env is not None else make_templates().env
+        self.number = next(_job_numbers)
+        self.messages: list[str] = []
+        self.done = False
+        self._new = asyncio.Event()
+
+    def event_id(self, index: int) -> str:
+        return f"{self.number}-{index}"
+
+    def parse_event_id(self, event_id: str) -> Optional[int]:
+        """
+        Returns the index of the next message after `event_id`, or None if
+        the id belongs to another log.
+        """
+        number, _, index = event_id.partition("-")
+        if number != str(self.number) or not index.isdigit():
+            return None
+        return int(index) + 1
+
+    def publish(self, event: str, data: str) -> None:
+        self.messages.append(format_sse(self.event_id(len(self.messages)), event, data.strip()))
+        # Wake every listener, later ones wait on a fresh event
+        self._new.set()
+        self._new = asyncio.Event()
+
+    async def stream(self, start: int = 0) -> AsyncIterator[str]:
+        """
+        Yields formatted events from `start` on, waiting for new ones until
+        the log is done.
+        """
+        i = start
+        while True:
+            new = self._new
+            while i < len(self.messages):
+                yield self.messages[i]
+                i += 1
+            if self.done:
+                return
+            await new.wait()
+
+class SyncJob(EventLog):
+    """
+    A sync running in the background of the app whose progress any number
+    of admin dashboards can follow as server-sent events.
+
+    Attributes:
+        result (Optional[SyncResult]): Totals of the finished sync.
+        task (Optional[asyncio.Task]): The task running the sync.
+    """
+    def __init__(self, env: Optional[Environment] = None):
+        super().__init__(env)
+        self.result: Optional[SyncResult] = None
+        self.task: Optional[asyncio.Task] = None
+        self._clubs: dict[int, tuple[int, int]] = {}
+        self._statuses: Counter = Counter()
+
+    def on_event(self, event: SyncEvent) -> None:
+        self._statuses[event.status] += 1
+        if event.total:
+            self._clubs[event.sw_club_id] = (event.done, event.total)
+
+        done = sum(d for d, _ in self._clubs.values())
+        total = sum(t for _, t in self._clubs.values())
+        html = self.env.get_template("htmx/admin_sync_event.html").render(
+            event=event, done=done, total=total, statuses=self._statuses
+        )
+        self.publish("progress", html)
+
+    async def run(
+        self,
+        session_factory: sessionmaker,
+        scraper_factory: Callable[[], SwimrankingsScraper],
+        snapshots: Optional[SnapshotStore] = None,
+        options: Optional[SyncOptions] = None
+    ) -> None:
+        error = None
+        try:
+            async with scraper_factory() as scraper:
+                self.result = await sync_targets(session_factory, scraper, progress=self.on_event, options=options)
+            if snapshots is not None:
+                # Before `done`, so a finished sync is already on the public pages
+                await snapshots.publish_async()
+        except Exception as e:
+            print(e)
+            error = "Sync crashed, see the server log"
+        finally:
+            self.done = True
+            html = self.env.get_template("htmx/admin_sync_event.html").render(
+                result=self.result, error=error, statuses=self._statuses
+            )
+            self.publish("done", html)
+
+def start_sync_job(app: FastAPI, scraper_factory: Callable[[], SwimrankingsScraper]) -> SyncJob:
+    """
+    Returns the app's running sync job, starting a new one if none is running.
+
+    Side effects:
+    - Sets `app.state.sync_job`.
+    """
+    job = app.state.sync_job
+    if job is not None and not job.done:
+        return job
+
+    job = SyncJob(app.state.templates.env)
+    options = SyncOptions(trace_memory=app.state.settings.sync_trace_memory)
+    job.task = asyncio.create_task(job.run(app.state.session_factory, scraper_factory, app.state.snapshots, options))
+    app.state.sync_job = job
+    return job
@@ -0,0 +1,122 @@
+from fastapi import Request
+from fastapi.templating import Jinja2Templates
+from jinja2 import Environment, FileSystemBytecodeCache
+from jinja2.ext import Extension
+from datetime import time, date
+from typing import Optional
+from analytics import fmt_seconds
+from assets import static_url
+from settings import Settings
+import os
+import re
+
+def fmt_time(tim_e: time) -> str:
+    if tim_e.hour:
+        return tim_e.strftime("%H:%M:%S.%f")[:-3]
+    elif tim_e.minute:
+        return tim_e.strftime("%M:%S.%f")[:-3]
+    else:
+        return tim_e.strftime("%S.%f")[:-3]
+
+def fmt_date(dat_e: date) -> str:
+    return dat_e.strftime("%d-%m-%Y")
+
+# Whitespace sensitive elements, left alone when stripping
+_VERBATIM = re.compile(r"<(pre|textarea|script|style)\b.*?</\1\s*>", re.S | re.I)
+_LINE_BREAK = re.compile(r"[ \t\r\f\v]*\n\s*")
+
+def strip_whitespace(source: str) -> str:
+    """
+    Collapses every run of whitespace containing a line break into a single
+    newline, outside `<pre>`, `<textarea>`, `<script>` and `<style>`. That
+    drops the tab indentation and blank lines without changing how a page
+    renders, since HTML treats any whitespace run like one space.
+    """
+    parts, pos = [], 0
+    for match in _VERBATIM.finditer(source):
+        parts.append(_LINE_BREAK.sub("\n", source[pos:match.start()]))
+        parts.append(match.group(0))
+        pos = match.end()
+    parts.append(_LINE_BREAK.sub("\n", source[pos:]))
+    return "".join(parts)
+
+class StripWhitespace(Extension):
+    """
+    Runs `strip_whitespace` over `.html` template sources before they are
+    compiled when `env.strip_whitespace` is set, so it costs nothing per render.
+    """
+    def __init__(self, environment: Environment):
+        super().__init__(environment)
+        environment.extend(strip_whitespace=False)
+
+    def preprocess(self, source: str, name: str, filename: str = None) -> str:
+        if self.environment.strip_whitespace and name and name.endswith(".html"):
+            return strip_whitespace(source)
+        return source
+
+def make_templates(settings: Optional[Settings] = None) -> Jinja2Templates:
+    """
+    Builds the template environment of one app, with every filter and
+    global the templates use, configured by `settings`.
+
+    Outside debug mode templates are never re-checked on disk, and compiled
+    bytecode is persisted to `settings.template_cache_dir` so new workers skip
+    parsing entirely. Stripped and unstripped bytecode are cached under
+    different names, since the cache only checks the template source.
+
+    Args:
+        settings (Optional[Settings]): App configuration, defaults (debug off, no bytecode cache) when omitted.
+
+    Returns:
+        Jinja2Templates: The new environment
+    """
+    templates = Jinja2Templates(directory="templates")
+    env = templates.env
+    env.filters["fmt_time"] = fmt_time
+    env.filters["fmt_date"] = fmt_date
+    env.filters["fmt_seconds"] = fmt_seconds
+    env.globals["static_url"] = static_url
+    env.add_extension(StripWhitespace)
+    if settings is None:
+        env.auto_reload = False
+        return templates
+
+    env.auto_reload = settings.debug
+    env.strip_whitespace = settings.template_strip_whitespace
+    if settings.template_cache_dir:
+        os.makedirs(settings.template_cache_dir, exist_ok=True)
+        pattern = "__jinja2_stripped_%s.cache" if env.strip_whitespace else "__jinja2_%s.cache"
+        env.bytecode_cache = FileSystemBytecodeCache(settings.template_cache_dir, pattern)
+    return templates
+
+class AppTemplates:
+    """
+    What the routers render with: hands every response to the environment of
+    the app serving the request (`app.state.templates`, see `make_templates`),
+    so apps in one process never share template settings.
+    """
+    def TemplateResponse(self, request: Request, name: str, *args, **kwargs):
+        return request.app.state.templates.TemplateResponse(*args, request=request, name=name, **kwargs)
+
+templates = AppTemplates()
+
+def precompile_templates(env: Environment) -> int:
+    """
+    Loads every template under `templates/` into `env`.
+
+    This writes bytecode for each template to the cache (if configured) and
+    leaves the compiled templates in the in-memory cache.
+
+    Returns:
+        int: Number of templates compiled
+    """
+    names = env.list_templates(extensions=["html"])
+    for name in names:
+        env.get_template(name)
+    return len(names)
+
+if __name__ == "__main__":
+    # Build step: python -m templating
+    env = make_templates(Settings.from_env()).env
+    count = precompile_templates(env)
+    print(f"Precompiled {count} templates into {env.bytecode_cache.directory if env.bytecode_cache else 'memory only'}")
@@ -0,0 +1,37 @@
+"""
+Shared fixtures. Database tests run against in-memory SQLite and, when
+`TEST_POSTGRES_URL` points at a scratch PostgreSQL database (its tables are
+dropped), against PostgreSQL too.
+"""
+from sqlalchemy.orm import Session
+from db import Base, init_db, make_engine, make_session_factory
+import os
+import pytest
+
+POSTGRES_URL = os.getenv("TEST_POSTGRES_URL")
+
+requires_postgres = pytest.mark.skipif(not POSTGRES_URL, reason="TEST_POSTGRES_URL is not set")
+
+def pytest_report_header(config) -> str:
+    if POSTGRES_URL:
+        return "database backends: sqlite, postgres"
+    return "database backends: sqlite (set TEST_POSTGRES_URL to also test PostgreSQL and COPY)"
+
+@pytest.fixture(params=["sqlite", pytest.param("postgres", marks=requires_postgres)])
+def engine(request):
+    """
+    A freshly initialised database on every backend.
+    """
+    if request.param == "sqlite":
+        engine = make_engine("sqlite://")
+    else:
+        engine = make_engine(POSTGRES_URL)
+        Base.metadata.drop_all(engine)
+    init_db(engine)
+    yield engine
+    engine.dispose()
+
+@pytest.fixture
+def db(engine) -> Session:
+    with make_session_factory(engine)() as session:
+        yield session
@@ -0,0 +1,161 @@
+from datetime import datetime, timedelta, timezone
+from fastapi.testclient import TestClient
+from sqlalchemy import Column, Index, Integer, MetaData, String, Table, event, func, insert, select
+from app import create_app
+from db import ClubSwimmer, ClubSwimmerPb, DEFAULT_CLUB_ID, Token, init_db, make_engine, make_session_factory
+from name_index import remember_athletes
+from scraper import swimrankings
+from scraper.swimrankings import Gender, PbBatch, Swimmer, SwimrankingsScraper
+from settings import Settings
+from sync import add_club_swimmer
+import httpx
+import secrets
+
+ATHLETE = Swimmer(sw_id=5001, birth_year=2009, first_name="Lea", last_name="Beispiel", gender=Gender.FEMALE)
+
+def roster(db) -> list[int]:
+    return db.execute(select(ClubSwimmer.sw_id).order_by(ClubSwimmer.id)).scalars().all()
+
+def test_add_club_swimmer_returns_the_existing_row(db):
+    row, added = add_club_swimmer(db, ATHLETE, DEFAULT_CLUB_ID)
+    again, added_again = add_club_swimmer(db, ATHLETE, DEFAULT_CLUB_ID)
+
+    assert (added, added_again) == (True, False)
+    assert again.id == row.id
+    assert roster(db) == [ATHLETE.sw_id]
+
+def test_add_racing_another_request_returns_its_row(tmp_path):
+    engine = make_engine(f"sqlite:///{tmp_path / 'race.db'}")
+    init_db(engine)
+    with make_session_factory(engine)() as db:
+        @event.listens_for(db, "before_flush", once=True)
+        def other_request_commits_first(session, flush_context, instances):
+            # Passed the existence check too, and committed in between
+            with engine.begin() as conn:
+                conn.execute(insert(ClubSwimmer), {
+                    "sw_club_id": DEFAULT_CLUB_ID, "sw_id": ATHLETE.sw_id, "birth_year": 2009,
+                    "first_name": "Lea", "last_name": "Beispiel", "gender": 1
+                })
+
+        row, added = add_club_swimmer(db, ATHLETE, DEFAULT_CLUB_ID)
+
+        assert not added
+        assert row.sw_id == ATHLETE.sw_id
+        assert roster(db) == [ATHLETE.sw_id]
+    engine.dispose()
+
+def test_double_submitted_add_keeps_one_row():
+    class FakeScraper:
+        async def fetch_athlete_personal_bests(self, sw_id: int) -> PbBatch:
+            return PbBatch()
+
+    async def fake_scraper():
+        yield FakeScraper()
+
+    app = create_app(Settings(db_location="sqlite://", password_hash="unused", parse_workers=0, snapshot_dir=None))
+    app.dependency_overrides[swimrankings.get_scraper] = fake_scraper
+    with TestClient(app) as client:
+        token = secrets.token_urlsafe(16)
+        with app.state.session_factory() as db:
+            db.add(Token(token=token, expiry=datetime.now(timezone.utc) + timedelta(hours=1)))
+            remember_athletes(db, [ATHLETE])
+            db.commit()
+        client.cookies.set("access_token", token)
+
+        for _ in range(2):
+            response = client.post("/v1/add-swimmer", headers={"HX-Request": "true"}, data={"sw_id": ATHLETE.sw_id})
+            assert response.status_code == 200
+            assert "Beispiel" in response.text
+
+        with app.state.session_factory() as db:
+            assert roster(db) == [ATHLETE.sw_id]
+
+def test_add_by_name_without_a_comma_is_a_bad_request():
+    fetched = []
+
+    async def scraper():
+        async with SwimrankingsScraper() as scraper:
+            await scraper.client.aclose()
+            scraper.client = httpx.AsyncClient(transport=httpx.MockTransport(lambda request: fetched.append(request) or httpx.Response(500)))
+            yield scraper
+
+    app = create_app(Settings(db_location="sqlite://", password_hash="unused", parse_workers=0, snapshot_dir=None))
+    app.dependency_overrides[swimrankings.get_scraper] = scraper
+    with TestClient(app) as client:
+        token = secrets.token_urlsafe(16)
+        with app.state.session_factory() as db:
+            db.add(Token(token=token, expiry=datetime.now(timezone.utc) + timedelta(hours=1)))
+            db.commit()
+        client.cookies.set("access_token", token)
+        headers = {"HX-Request": "true", "HX-Prompt": "Lea Beispiel"}
+
+        response = client.post("/v1/add-swimmer", headers=headers)
+        assert response.status_code == 400
+
+        # With a similar athlete in the index the suggestions are shown instead
+        with app.state.session_factory() as db:
+            remember_athletes(db, [ATHLETE])
+            db.commit()
+        response = client.post("/v1/add-swimmer", headers={**headers, "HX-Prompt": "Lea Beispel"})
+        assert response.status_code == 200
+        assert "Beispiel" in response.text
+
+    assert fetched == []
+
+def test_init_db_removes_duplicates_of_older_databases(tmp_path):
+    engine = make_engine(f"sqlite:///{tmp_path / 'old.db'}")
+    # The swimmers table as it was before the index became unique
+    old = Table(
+        "scwr_swimmers", MetaData(),
+        Column("id", Integer, primary_key=True),
+        Column("sw_club_id", Integer, nullable=False),
+        Column("sw_id", Integer, nullable=False),
+        Column("birth_year", Integer, nullable=False),
+        Column("first_name", String, nullable=False),
+        Column("last_name", String, nullable=False),
+        Column("gender", Integer, nullable=False),
+        Index("ix_scwr_swimmers_club_sw_id", "sw_club_id", "sw_id"),
+    )
+    old.metadata.create_all(engine)
+    with engine.begin() as conn:
+        conn.execute(old.insert(), [
+            {"sw_club_id": DEFAULT_CLUB_ID, "sw_id": sw_id, "birth_year": 2009, "first_name": "A", "last_name": "B", "gender": 0}
+            for sw_id in (1, 2, 1, 1)
+        ])
+
+    init_db(engine)
+    init_db(engine)
+
+    with make_session_factory(engine)() as db:
+        assert db.execute(select(ClubSwimmer.id, ClubSwimmer.sw_id).order_by(ClubSwimmer.id)).all() == [(1, 1), (2, 2)]
+        assert db.execute(select(func.count(ClubSwimmerPb.id))).scalar() == 0
+    engine.dispose()
+
+def test_init_db_removes_duplicates_of_baseline_databases(tmp_path):
+    engine = make_engine(f"sqlite:///{tmp_path / 'baseline.db'}")
+    # The swimmers table before clubs: no sw_club_id and no index at all
+    baseline = Table(
+        "scwr_swimmers", MetaData(),
+        Column("id", Integer, primary_key=True),
+        Column("sw_id", Integer, nullable=False),
+        Column("birth_year", Integer, nullable=False),
+        Column("first_name", String, nullable=False),
+        Column("last_name", String, nullable=False),
+        Column("gender", Integer, nullable=False),
+    )
+    baseline.metadata.create_all(engine)
+    with engine.begin() as conn:
+        conn.execute(baseline.insert(), [
+            {"sw_id": sw_id, "birth_year": 2009, "first_name": "A", "last_name": "B", "gender": 0}
+            for sw_id in (1, 1, 2)
+        ])
+
+    init_db(engine)
+    init_db(engine)
+
+    with make_session_factory(engine)() as db:
+        rows = db.execute(select(ClubSwimmer.id, ClubSwimmer.sw_club_id, ClubSwimmer.sw_id).order_by(ClubSwimmer.id)).all()
+        assert rows == [(1, DEFAULT_CLUB_ID, 1), (3, DEFAULT_CLUB_ID, 2)]
+        row, added = add_club_swimmer(db, Swimmer(sw_id=1, birth_year=2009, first_name="A", last_name="B", gender=Gender.MALE), DEFAULT_CLUB_ID)
+        assert (row.id, added) == (1, False)
+    engine.dispose()
@@ -0,0 +1,31 @@
+from sqlalchemy import text
+from sqlalchemy.pool import QueuePool, StaticPool
+from db import make_engine
+from conftest import POSTGRES_URL, requires_postgres
+import pytest
+
+def test_memory_sqlite_shares_one_connection():
+    engine = make_engine("sqlite://")
+    assert isinstance(engine.pool, StaticPool)
+    with engine.connect() as conn:
+        assert conn.execute(text("PRAGMA foreign_keys")).scalar() == 1
+
+@requires_postgres
+def test_postgres_pool_settings():
+    engine = make_engine(POSTGRES_URL, pool_size=3, max_overflow=7)
+    try:
+        assert isinstance(engine.pool, QueuePool)
+        assert engine.pool.size() == 3
+        assert engine.pool._max_overflow == 7
+        assert engine.pool._pre_ping
+        assert engine.pool._recycle == 1800
+        with engine.connect() as conn:
+            assert conn.execute(text("SELECT 1")).scalar() == 1
+    finally:
+        engine.dispose()
+
+def test_postgres_scheme_uses_psycopg():
+    pytest.importorskip("psycopg")
+    engine = make_engine("postgres://user@localhost/scwr")
+    assert engine.dialect.name == "postgresql"
+    assert engine.dialect.driver == "psycopg"
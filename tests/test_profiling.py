@@ -0,0 +1,53 @@
+from fastapi.testclient import TestClient
+from sqlalchemy import text
+from app import create_app
+from profiling import QueryBudgetExceeded, QueryProfile
+from settings import Settings
+import logging
+import profiling
+import pytest
+
+def profiled_app(**settings):
+    return create_app(Settings(
+        db_location="sqlite://", password_hash="unused", parse_workers=0, snapshot_dir=None,
+        compress_min_size=None, sql_profiling=True, **settings
+    ))
+
+def test_strict_budget_fails_the_request():
+    app = profiled_app(query_budgets={"/athletes": 0}, query_budget_strict=True)
+    with TestClient(app) as client:
+        with pytest.raises(QueryBudgetExceeded, match="GET /athletes issued"):
+            client.get("/athletes")
+
+    with TestClient(app, raise_server_exceptions=False) as client:
+        assert client.get("/athletes").status_code == 500
+
+def test_route_budget_overrides_the_default():
+    app = profiled_app(query_budget=0, query_budgets={"/athletes": 50}, query_budget_strict=True)
+    with TestClient(app) as client:
+        response = client.get("/athletes")
+        assert response.status_code == 200
+        assert "queries" in response.headers["Server-Timing"]
+
+        with pytest.raises(QueryBudgetExceeded, match="budget 0"):
+            client.get("/rankings")
+
+def test_over_budget_only_warns_without_strict(caplog):
+    app = profiled_app(query_budgets={"/athletes": 0})
+    with TestClient(app) as client, caplog.at_level(logging.WARNING, logger="profiling"):
+        assert client.get("/athletes").status_code == 200
+    assert "GET /athletes issued" in caplog.text
+
+def test_failed_statements_are_profiled_and_leave_nothing_on_the_connection():
+    app = profiled_app()
+    profile = QueryProfile()
+    token = profiling._current.set(profile)
+    try:
+        with app.state.engine.connect() as conn:
+            with pytest.raises(Exception):
+                conn.execute(text("SELECT missing FROM nowhere"))
+            conn.execute(text("SELECT 1"))
+            assert "profile_start" not in conn.info
+    finally:
+        profiling._current.reset(token)
+    assert [statement for statement, _ in profile.statements] == ["SELECT missing FROM nowhere", "SELECT 1"]
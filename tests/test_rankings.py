@@ -0,0 +1,49 @@
+from datetime import time
+from analytics import get_rankings
+from db import ClubSwimmer
+from sync import SyncResult, write_pbs
+from test_sync_pbs import add_swimmer, make_batch
+
+def test_cached_rankings_survive_a_sync_without_changes(db):
+    swimmer = add_swimmer(db)
+    write_pbs(db, [(swimmer, make_batch((1, time(0, 1, 5))))], SyncResult())
+    db.commit()
+    rankings = get_rankings(db)
+
+    # Only pbs_checked_at is written
+    write_pbs(db, [(swimmer, make_batch((1, time(0, 1, 5))))], SyncResult())
+    db.commit()
+    assert get_rankings(db) is rankings
+
+    write_pbs(db, [(swimmer, make_batch((1, time(0, 1, 4))))], SyncResult())
+    db.commit()
+    rankings = get_rankings(db)
+    assert [r.seconds for r in rankings.for_athlete(swimmer.id)] == [64.0]
+
+    swimmer.last_name = "Neu"
+    db.commit()
+    assert get_rankings(db) is not rankings
+    assert get_rankings(db).groups()[0][1][0]["last_name"] == "Neu"
+
+def test_every_club_is_ranked_on_its_own(db):
+    # 1001 swims for both clubs, 1002 only for club 1, 1003 only for club 2
+    rows = {}
+    for sw_club_id, sw_id, seconds in ((1, 1001, 30), (2, 1001, 30), (1, 1002, 32), (2, 1003, 28)):
+        swimmer = ClubSwimmer(sw_club_id=sw_club_id, sw_id=sw_id, birth_year=2008, first_name="Anna", last_name="Muster", gender=1)
+        db.add(swimmer)
+        db.flush()
+        write_pbs(db, [(swimmer, make_batch((sw_id * 10 + sw_club_id, time(0, 0, seconds))))], SyncResult())
+        rows[sw_club_id, sw_id] = swimmer
+    db.commit()
+    rankings = get_rankings(db)
+
+    def standing(sw_club_id: int, sw_id: int) -> tuple:
+        [ranked] = rankings.for_athlete(rows[sw_club_id, sw_id].id)
+        return ranked.sw_club_id, ranked.rank, ranked.group_size, ranked.percentile, ranked.gap
+
+    assert standing(1, 1001) == (1, 1, 2, 100.0, 0.0)
+    assert standing(1, 1002) == (1, 2, 2, 50.0, 2.0)
+    assert standing(2, 1003) == (2, 1, 2, 100.0, 0.0)
+    assert standing(2, 1001) == (2, 2, 2, 50.0, 2.0)
+    assert rankings.clubs() == [1, 2]
+    assert [[row["sw_id"] for row in table] for _, table in rankings.groups(2)] == [[1003, 1001]]
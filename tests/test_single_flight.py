@@ -0,0 +1,69 @@
+from scraper.base_scraper import BaseScraper
+import asyncio
+import httpx
+import pytest
+
+URL = "https://www.swimrankings.net/index.php?page=athleteDetail&athleteId=1"
+
+def parse_page(html: str) -> str:
+    return html.upper()
+
+@pytest.fixture(autouse=True)
+def no_rate_limit():
+    interval = BaseScraper._request.min_interval
+    BaseScraper._request.min_interval = 0
+    yield
+    BaseScraper._request.min_interval = interval
+
+def test_cancelled_initiator_leaves_the_fetch_to_joined_callers():
+    async def main():
+        started, release = asyncio.Event(), asyncio.Event()
+        requests, open_on_response = [], []
+
+        async def upstream(request: httpx.Request) -> httpx.Response:
+            requests.append(request.url)
+            started.set()
+            await release.wait()
+            open_on_response.append(not initiator.client.is_closed)
+            return httpx.Response(200, text="<html>pb page</html>")
+
+        initiator, joiner = BaseScraper(url_book=None), BaseScraper(url_book=None)
+        for scraper in (initiator, joiner):
+            await scraper.client.aclose()
+            scraper.client = httpx.AsyncClient(transport=httpx.MockTransport(upstream))
+
+        async def request_scope():
+            # Like `get_scraper`: the scraper is closed when the request ends
+            async with initiator:
+                return await initiator._scrape(URL, parse_page)
+
+        first = asyncio.create_task(request_scope())
+        await started.wait()
+        second = asyncio.create_task(joiner._scrape(URL, parse_page))
+        await asyncio.sleep(0)
+
+        first.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await first
+        assert not initiator.client.is_closed
+
+        release.set()
+        assert await second == "<HTML>PB PAGE</HTML>"
+        assert len(requests) == 1
+        assert open_on_response == [True]
+
+        for _ in range(3):
+            await asyncio.sleep(0)
+        assert initiator.client.is_closed
+        await joiner.client.aclose()
+
+    asyncio.run(main())
+
+def test_scraper_without_shared_scrapes_closes_right_away():
+    async def main():
+        scraper = BaseScraper(url_book=None)
+        async with scraper:
+            pass
+        assert scraper.client.is_closed
+
+    asyncio.run(main())
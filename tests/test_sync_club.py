@@ -0,0 +1,41 @@
+from sqlalchemy import event, insert, select
+from sqlalchemy.sql import Insert
+from db import ClubSwimmer, DEFAULT_CLUB_ID
+from discovery import Discovery
+from scraper.swimrankings import Gender, PbBatch, Swimmer
+import asyncio
+import sync
+
+ROSTER = [Swimmer(sw_id=sw_id, birth_year=2010, first_name="Kim", last_name=f"Muster{sw_id}", gender=Gender.MALE)
+          for sw_id in (11, 12, 13)]
+
+class FakeScraper:
+    async def fetch_athlete_personal_bests(self, sw_id: int) -> PbBatch:
+        return PbBatch()
+
+def test_athlete_added_during_sync_is_skipped(db, monkeypatch):
+    async def discover_roster(db, scraper, sw_club_id, targets, full=False):
+        return Discovery(athletes={swimmer.sw_id: swimmer for swimmer in ROSTER}, pages=1)
+
+    monkeypatch.setattr(sync, "discover_roster", discover_roster)
+
+    raced = []
+
+    @event.listens_for(db, "do_orm_execute")
+    def admin_adds_one_first(state):
+        # An add-swimmer committing after sync read the roster
+        if not raced and isinstance(state.statement, Insert) and state.statement.table.name == "scwr_swimmers":
+            raced.append(True)
+            db.connection().execute(insert(ClubSwimmer), {
+                "sw_club_id": DEFAULT_CLUB_ID, "sw_id": 12, "birth_year": 2010,
+                "first_name": "Kim", "last_name": "Muster12", "gender": 0
+            })
+
+    events = []
+    result = asyncio.run(sync.sync_club(db, FakeScraper(), DEFAULT_CLUB_ID, [], progress=events.append))
+
+    assert result.swimmers_added == 2
+    assert result.swimmers == 3
+    assert sorted(e.sw_id for e in events if e.status == "added") == [11, 13]
+    stmt = select(ClubSwimmer.sw_id).filter_by(sw_club_id=DEFAULT_CLUB_ID).order_by(ClubSwimmer.sw_id)
+    assert db.execute(stmt).scalars().all() == [11, 12, 13]
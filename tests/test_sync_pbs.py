@@ -0,0 +1,106 @@
+from datetime import date, datetime, time, timezone
+from sqlalchemy import insert, select
+from db import ClubSwimmer, ClubSwimmerPb, supports_copy
+from scraper.swimrankings import PbBatch
+from sync import SyncResult, copy_pbs, upsert_pbs, write_pbs
+from conftest import requires_postgres
+import pytest
+
+NOW = datetime(2025, 6, 1, 12, tzinfo=timezone.utc)
+
+def make_batch(*pbs: tuple[int, time]) -> PbBatch:
+    """
+    A pb page with one 100m freestyle result per `(sw_result_id, time)`.
+    """
+    batch = PbBatch()
+    for sw_result_id, swim_time in pbs:
+        batch.append(1, sw_result_id, 600000 + sw_result_id, "FINA", "100m Freestyle",
+                     50, swim_time, 500, date(2025, 5, 1), "Zurich", "Swiss Nationals")
+    return batch
+
+def add_swimmer(db, sw_id: int = 1001) -> ClubSwimmer:
+    swimmer = ClubSwimmer(sw_id=sw_id, birth_year=2008, first_name="Anna", last_name="Muster", gender=1)
+    db.add(swimmer)
+    db.flush()
+    return swimmer
+
+def stored(db, swimmer: ClubSwimmer) -> dict[int, time]:
+    stmt = select(ClubSwimmerPb.sw_result_id, ClubSwimmerPb.time).filter_by(athlete_id=swimmer.id)
+    return dict(db.execute(stmt).all())
+
+def counts(result: SyncResult) -> tuple[int, int, int, int]:
+    return result.pbs_inserted, result.pbs_updated, result.pbs_unchanged, result.pbs_deleted
+
+@pytest.mark.parametrize("write", [upsert_pbs, write_pbs], ids=["upsert_pbs", "write_pbs"])
+def test_inserts_updates_and_deletes(db, write):
+    swimmer = add_swimmer(db)
+
+    def run(batch: PbBatch) -> SyncResult:
+        result = SyncResult()
+        if write is upsert_pbs:
+            upsert_pbs(db, swimmer, batch, result, NOW)
+        else:
+            write_pbs(db, [(swimmer, batch)], result, NOW)
+        db.commit()
+        return result
+
+    first = run(make_batch((1, time(0, 1, 5)), (2, time(0, 1, 6)), (3, time(0, 1, 7))))
+    assert counts(first) == (3, 0, 0, 0)
+
+    # 1 unchanged, 2 faster, 3 no longer listed, 4 new
+    second = run(make_batch((1, time(0, 1, 5)), (2, time(0, 1, 4)), (4, time(0, 1, 8))))
+    assert counts(second) == (1, 1, 1, 1)
+    assert stored(db, swimmer) == {1: time(0, 1, 5), 2: time(0, 1, 4), 4: time(0, 1, 8)}
+    assert swimmer.pbs_checked_at is not None
+
+    again = run(make_batch((1, time(0, 1, 5)), (2, time(0, 1, 4)), (4, time(0, 1, 8))))
+    assert counts(again) == (0, 0, 3, 0)
+
+@pytest.mark.parametrize("write", [upsert_pbs, write_pbs], ids=["upsert_pbs", "write_pbs"])
+def test_removes_duplicate_results(db, write):
+    swimmer = add_swimmer(db)
+    row = next(make_batch((1, time(0, 1, 5))).records())
+    db.execute(insert(ClubSwimmerPb), [{**row, "athlete_id": swimmer.id, "last_scraped": NOW}] * 2)
+
+    result = SyncResult()
+    if write is upsert_pbs:
+        upsert_pbs(db, swimmer, make_batch((1, time(0, 1, 5))), result, NOW)
+    else:
+        write_pbs(db, [(swimmer, make_batch((1, time(0, 1, 5))))], result, NOW)
+    db.commit()
+
+    assert counts(result) == (0, 0, 1, 1)
+    assert len(db.execute(select(ClubSwimmerPb.id).filter_by(athlete_id=swimmer.id)).all()) == 1
+
+def test_write_pbs_reports_changed_swimmers(db):
+    unchanged, changed = add_swimmer(db, 1001), add_swimmer(db, 1002)
+    write_pbs(db, [(unchanged, make_batch((1, time(0, 1)))), (changed, make_batch((2, time(0, 2))))], SyncResult(), NOW)
+    db.commit()
+
+    ids = write_pbs(db, [(unchanged, make_batch((1, time(0, 1)))), (changed, make_batch((2, time(0, 1, 59))))], SyncResult(), NOW)
+    assert ids == {changed.id}
+
+@requires_postgres
+@pytest.mark.parametrize("engine", ["postgres"], indirect=True)
+def test_copy_pbs_merges_many_athletes(db):
+    assert supports_copy(db)
+    swimmers = [add_swimmer(db, 1000 + i) for i in range(3)]
+    first = SyncResult()
+    copy_pbs(db, [(s, make_batch((s.sw_id * 10 + 1, time(0, 1)), (s.sw_id * 10 + 2, time(0, 2)))) for s in swimmers], first, NOW)
+    db.commit()
+    assert counts(first) == (6, 0, 0, 0)
+
+    # Same result listed twice on a page: staged once, stored once
+    a, b, c = swimmers
+    second = SyncResult()
+    changed = copy_pbs(db, [
+        (a, make_batch((a.sw_id * 10 + 1, time(0, 1)), (a.sw_id * 10 + 2, time(0, 2)))),
+        (b, make_batch((b.sw_id * 10 + 1, time(0, 0, 59)), (b.sw_id * 10 + 2, time(0, 2)))),
+        (c, make_batch((c.sw_id * 10 + 3, time(0, 3)), (c.sw_id * 10 + 3, time(0, 3)))),
+    ], second, NOW)
+    db.commit()
+
+    assert changed == {b.id, c.id}
+    assert counts(second) == (1, 1, 3, 2)
+    assert stored(db, c) == {c.sw_id * 10 + 3: time(0, 3)}
+    assert stored(db, b)[b.sw_id * 10 + 1] == time(0, 0, 59)
@@ -0,0 +1,516 @@
+from contextlib import contextmanager
+from contextvars import ContextVar, Token
+from dataclasses import dataclass, field
+from functools import wraps
+from typing import Iterable, Iterator, Optional
+from fastapi import Request
+from sqlalchemy import Engine, event
+from sqlalchemy.orm import Session
+from metrics import TRACE_SPANS, statement_kind
+import asyncio
+import httpx
+import ipaddress
+import json
+import os
+import queue
+import random
+import re
+import threading
+import time
+
+EXPORT_BATCH = 512 # spans per write / request to the collector
+EXPORT_INTERVAL = 5.0 # seconds a finished span waits at most before it is exported
+EXPORT_QUEUE = 10_000 # finished spans buffered before new ones are dropped
+STATEMENT_CHARS = 1000 # SQL kept per statement span
+
+TRACEPARENT = re.compile(r"^00-([0-9a-f]{32})-([0-9a-f]{16})-([0-9a-f]{2})$")
+
+@dataclass(slots=True)
+class Span:
+    """
+    One timed operation of a trace.
+
+    Attributes:
+        name (str): What was done, e.g. `GET /athlete` or `scraper.fetch`.
+        trace_id (str): 32 hex digits shared by every span of the trace.
+        span_id (str): 16 hex digits.
+        parent_id (Optional[str]): Span this one ran in, None for the root.
+        start_ns (int): Wall clock start, nanoseconds since the epoch.
+        end_ns (int): Wall clock end, 0 while running.
+        attributes (dict): Details, e.g. the URL fetched or the SQL run.
+        error (Optional[str]): Exception (or failure) the operation ended with.
+        tracer (Optional[Tracer]): Tracer exporting the span, every span of a trace uses its root's.
+    """
+    name: str
+    trace_id: str
+    span_id: str
+    parent_id: Optional[str]
+    start_ns: int
+    end_ns: int = 0
+    attributes: dict = field(default_factory=dict)
+    error: Optional[str] = None
+    token: Optional[Token] = field(default=None, repr=False, compare=False)
+    tracer: Optional["Tracer"] = field(default=None, repr=False, compare=False)
+
+    @property
+    def duration(self) -> float:
+        return (self.end_ns - self.start_ns) / 1e9
+
+    def record(self) -> dict:
+        return {
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "name": self.name,
+            "start_ns": self.start_ns,
+            "duration_ms": round((self.end_ns - self.start_ns) / 1e6, 3),
+            "attributes": self.attributes,
+            "error": self.error,
+        }
+
+def _new_id(digits: int) -> str:
+    return f"{random.getrandbits(digits * 4):0{digits}x}"
+
+class Exporter:
+    """
+    Base class of span exporters: spans are queued by `export` (never
+    blocking, dropped when the queue is full) and written by a daemon thread
+    in batches of up to `EXPORT_BATCH`, at least every `EXPORT_INTERVAL`
+    seconds. Subclasses implement `write`.
+    """
+    def __init__(self):
+        self._queue: queue.Queue[Optional[Span]] = queue.Queue(EXPORT_QUEUE)
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+
+    def export(self, span: Span) -> None:
+        if self._thread is None:
+            with self._lock:
+                if self._thread is None:
+                    self._thread = threading.Thread(target=self._run, name="trace-exporter", daemon=True)
+                    self._thread.start()
+        try:
+            self._queue.put_nowait(span)
+        except queue.Full:
+            TRACE_SPANS.inc(outcome="dropped")
+
+    def write(self, spans: list[Span]) -> None:
+        raise NotImplementedError
+
+    def shutdown(self) -> None:
+        """
+        Exports what is still queued and stops the thread.
+        """
+        if self._thread is not None:
+            self._queue.put(None)
+            self._thread.join(timeout=EXPORT_INTERVAL * 2)
+            self._thread = None
+
+    def _run(self) -> None:
+        stop = False
+        while not stop:
+            batch = []
+            deadline = time.monotonic() + EXPORT_INTERVAL
+            while len(batch) < EXPORT_BATCH:
+                try:
+                    span = self._queue.get(timeout=max(deadline - time.monotonic(), 0))
+                except queue.Empty:
+                    break
+                if span is None:
+                    stop = True
+                    break
+                batch.append(span)
+            if not batch:
+                continue
+            try:
+                self.write(batch)
+                TRACE_SPANS.inc(len(batch), outcome="exported")
+            except Exception as e:
+                print(e)
+                TRACE_SPANS.inc(len(batch), outcome="failed")
+
+class FileExporter(Exporter):
+    """
+    Appends every span as one JSON line to `path`.
+    """
+    def __init__(self, path: str):
+        super().__init__()
+        self.path = path
+
+    def write(self, spans: list[Span]) -> None:
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with open(self.path, "a", encoding="utf-8") as f:
+            f.write("".join(json.dumps(span.record(), default=str) + "\n" for span in spans))
+
+def _otlp_value(value) -> dict:
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": str(value)}
+
+class OtlpExporter(Exporter):
+    """
+    Posts spans to an OpenTelemetry collector (or anything speaking OTLP
+    over HTTP with JSON, e.g. Jaeger or Tempo) at `<endpoint>/v1/traces`.
+    """
+    def __init__(self, endpoint: str, service_name: str = "scwr-swimmers"):
+        super().__init__()
+        self.url = endpoint.rstrip("/") + "/v1/traces"
+        self.service_name = service_name
+
+    def payload(self, spans: list[Span]) -> dict:
+        return {"resourceSpans": [{
+            "resource": {"attributes": [{"key": "service.name", "value": {"stringValue": self.service_name}}]},
+            "scopeSpans": [{
+                "scope": {"name": "scwr.tracing"},
+                "spans": [
+                    {
+                        "traceId": span.trace_id,
+                        "spanId": span.span_id,
+                        **({"parentSpanId": span.parent_id} if span.parent_id else {}),
+                        "name": span.name,
+                        "kind": 2 if span.parent_id is None else 1, # server / internal
+                        "startTimeUnixNano": str(span.start_ns),
+                        "endTimeUnixNano": str(span.end_ns),
+                        "attributes": [{"key": k, "value": _otlp_value(v)} for k, v in span.attributes.items()],
+                        "status": {"code": 2, "message": span.error} if span.error else {"code": 1},
+                    }
+                    for span in spans
+                ],
+            }],
+        }]}
+
+    def write(self, spans: list[Span]) -> None:
+        response = httpx.post(self.url, json=self.payload(spans), timeout=10.0)
+        response.raise_for_status()
+
+_current: ContextVar[Optional[Span]] = ContextVar("trace_span", default=None)
+# Tracer of the app serving the current request, set by `tracing_middleware`
+_active: ContextVar[Optional["Tracer"]] = ContextVar("tracer", default=None)
+
+class Tracer:
+    """
+    Sampled request tracing with nested spans.
+
+    A trace starts at a root (`trace`: a request, a sync, a live meet poll)
+    and is kept with probability `sample_rate`; everything below it
+    (`span`, `traced`, `record`) only costs a context variable lookup when
+    the trace wasn't sampled or tracing is off. Finished spans go to
+    `exporter` in the background.
+
+    The current span lives in a context variable, so spans nest across
+    `await`s, tasks started inside a span and the threads FastAPI runs sync
+    code on. Parse workers in other processes aren't traced.
+
+    Every app has its own tracer (`app.state.tracer`, see `make_tracer`).
+    Code shared with the CLI traces through the module's `tracer`: a child
+    span goes to the tracer of its root, and a new trace to the tracer of
+    the app serving the current request (inherited by the tasks it starts),
+    or the module's own outside of one.
+
+    Attributes:
+        sample_rate (float): Share of traces kept, 0 to 1.
+        exporter (Optional[Exporter]): Where finished spans go, tracing is off when None.
+        trusted_clients (tuple): Networks whose `traceparent` header is honoured (see `tracing_middleware`).
+    """
+    def __init__(self, sample_rate: float = 0.0, exporter: Optional[Exporter] = None, trusted_clients: Iterable[str] = ()):
+        self.sample_rate = sample_rate
+        self.exporter = exporter
+        self.trusted_clients = parse_networks(trusted_clients)
+
+    def trusts(self, host: Optional[str]) -> bool:
+        """
+        Whether a request from `host` may decide its own sampling.
+        """
+        if not host or not self.trusted_clients:
+            return False
+        try:
+            address = ipaddress.ip_address(host)
+        except ValueError:
+            return False
+        return any(address in network for network in self.trusted_clients)
+
+    @property
+    def enabled(self) -> bool:
+        return self.exporter is not None and self.sample_rate > 0
+
+    def current(self) -> Optional[Span]:
+        return _current.get()
+
+    def start(self, name: str, root: bool = False, sampled: Optional[bool] = None,
+              trace_id: Optional[str] = None, parent_id: Optional[str] = None, **attributes) -> Optional[Span]:
+        """
+        Starts a span (and makes it current) under the current one or, with
+        `root`, a new trace that is sampled at `sample_rate` unless `sampled`
+        decides. Returns None, doing nothing, if the span isn't recorded.
+        End it with `end`.
+        """
+        parent = _current.get()
+        if root:
+            owner = _active.get() or self
+            if not owner.enabled or not (random.random() < owner.sample_rate if sampled is None else sampled):
+                return None
+            span = Span(name, trace_id or _new_id(32), _new_id(16), parent_id, time.time_ns(), attributes=attributes, tracer=owner)
+        elif parent is None:
+            return None
+        else:
+            span = Span(name, parent.trace_id, _new_id(16), parent.span_id, time.time_ns(), attributes=attributes, tracer=parent.tracer)
+        span.token = _current.set(span)
+        return span
+
+    def end(self, span: Optional[Span], error: Optional[BaseException] = None) -> None:
+        if span is None:
+            return
+        span.end_ns = time.time_ns()
+        try:
+            _current.reset(span.token)
+        except ValueError:
+            # Ended in another context than it started in (e.g. a commit
+            # hook), the span is still exported
+            pass
+        if error is not None and span.error is None:
+            span.error = f"{type(error).__name__}: {error}"
+        span.tracer.exporter.export(span)
+
+    @contextmanager
+    def span(self, name: str, **attributes) -> Iterator[Optional[Span]]:
+        """
+        Times the `with` block as a child of the current span. Yields the
+        span, or None when it isn't recorded.
+        """
+        span = self.start(name, **attributes)
+        try:
+            yield span
+        except BaseException as e:
+            self.end(span, e)
+            raise
+        self.end(span)
+
+    @contextmanager
+    def trace(self, name: str, **attributes) -> Iterator[Optional[Span]]:
+        """
+        Like `span`, but starts a new (sampled) trace even inside another one.
+        """
+        span = self.start(name, root=True, **attributes)
+        try:
+            yield span
+        except BaseException as e:
+            self.end(span, e)
+            raise
+        self.end(span)
+
+    def traced(self, name: str, root: bool = False):
+        """
+        Decorator running every call of a function or coroutine function in
+        a span (a new trace with `root`).
+        """
+        enter = self.trace if root else self.span
+
+        def decorator(func):
+            if asyncio.iscoroutinefunction(func):
+                @wraps(func)
+                async def async_wrapper(*args, **kwargs):
+                    with enter(name):
+                        return await func(*args, **kwargs)
+                return async_wrapper
+
+            @wraps(func)
+            def wrapper(*args, **kwargs):
+                with enter(name):
+                    return func(*args, **kwargs)
+            return wrapper
+
+        return decorator
+
+    def annotate(self, **attributes) -> None:
+        """
+        Adds attributes to the current span, if any.
+        """
+        span = _current.get()
+        if span is not None:
+            span.attributes.update(attributes)
+
+    def record(self, name: str, start_ns: int, end_ns: Optional[int] = None, error: Optional[str] = None, **attributes) -> None:
+        """
+        Exports an operation that already happened (e.g. time spent waiting)
+        as a child of the current span.
+        """
+        parent = _current.get()
+        if parent is None:
+            return
+        span = Span(
+            name, parent.trace_id, _new_id(16), parent.span_id, start_ns, end_ns or time.time_ns(),
+            attributes, error, tracer=parent.tracer
+        )
+        parent.tracer.exporter.export(span)
+
+    def shutdown(self) -> None:
+        if self.exporter is not None:
+            self.exporter.shutdown()
+
+def parse_networks(networks: Iterable[str]) -> tuple:
+    """
+    Parses addresses and CIDR networks, e.g. `("10.0.0.0/8", "127.0.0.1")`.
+
+    Raises:
+        ValueError: If one isn't an address or network
+    """
+    return tuple(ipaddress.ip_network(network.strip(), strict=False) for network in networks if network.strip())
+
+# The CLI's, configured by `configure_tracing`; off until then (and in parse workers)
+tracer = Tracer()
+
+def make_exporter(trace_file: Optional[str], otlp_endpoint: Optional[str]) -> Optional[Exporter]:
+    if otlp_endpoint:
+        return OtlpExporter(otlp_endpoint)
+    if trace_file:
+        return FileExporter(trace_file)
+    return None
+
+def make_tracer(settings) -> Tracer:
+    """
+    Builds a tracer exporting to the file or collector of `settings`.
+    """
+    new = Tracer(
+        settings.trace_sample_rate,
+        make_exporter(settings.trace_file, settings.trace_otlp_endpoint),
+        settings.trace_trusted_clients
+    )
+    if new.enabled:
+        instrument_sessions()
+    return new
+
+def configure_tracing(settings) -> Tracer:
+    """
+    Points the module's `tracer` (the one a CLI run traces with) at the
+    exporter and sample rate of `settings`, replacing (and flushing) a
+    previous exporter.
+    """
+    configured = make_tracer(settings)
+    tracer.shutdown()
+    tracer.exporter = configured.exporter
+    tracer.sample_rate = configured.sample_rate
+    tracer.trusted_clients = configured.trusted_clients
+    return tracer
+
+def instrument_engine(engine: Engine) -> None:
+    """
+    Records a span for every statement executed on `engine` inside a trace.
+    """
+    @event.listens_for(engine, "before_cursor_execute")
+    def _before(conn, cursor, statement, parameters, context, executemany):
+        if _current.get() is not None and context is not None:
+            # On the execution context, not the connection: a statement that
+            # raises mustn't leave a start time behind on a pooled connection
+            context._trace_start = time.time_ns()
+
+    def record(statement: str, context, error: Optional[BaseException] = None) -> None:
+        start = getattr(context, "_trace_start", None)
+        if start is None:
+            return
+        del context._trace_start
+        tracer.record(
+            f"db.{statement_kind(statement)}", start,
+            error=f"{type(error).__name__}: {error}" if error is not None else None,
+            **{"db.statement": statement[:STATEMENT_CHARS], "db.executemany": context.executemany}
+        )
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def _after(conn, cursor, statement, parameters, context, executemany):
+        record(statement, context)
+
+    @event.listens_for(engine, "handle_error")
+    def _error(exception_context):
+        if exception_context.statement is not None:
+            record(exception_context.statement, exception_context.execution_context, exception_context.original_exception)
+
+_sessions_instrumented = False
+
+def instrument_sessions() -> None:
+    """
+    Times every `Session.commit` (including its flush) inside a trace. The
+    statements it runs nest under the commit span.
+    """
+    global _sessions_instrumented
+    if _sessions_instrumented:
+        return
+    _sessions_instrumented = True
+
+    @event.listens_for(Session, "before_commit")
+    def _before_commit(session):
+        span = tracer.start("db.commit")
+        if span is not None:
+            session.info["trace_commit"] = span
+
+    @event.listens_for(Session, "after_commit")
+    def _after_commit(session):
+        tracer.end(session.info.pop("trace_commit", None))
+
+    @event.listens_for(Session, "after_rollback")
+    def _after_rollback(session):
+        span = session.info.pop("trace_commit", None)
+        if span is not None:
+            span.error = "rolled back"
+            tracer.end(span)
+
+def _parent(request: Request) -> tuple[Optional[str], Optional[str], Optional[bool]]:
+    match = TRACEPARENT.match(request.headers.get("traceparent", ""))
+    if match is None or not request.app.state.tracer.trusts(request.client.host if request.client else None):
+        return None, None, None
+    trace_id, parent_id, flags = match.groups()
+    return trace_id, parent_id, bool(int(flags, 16) & 1)
+
+async def tracing_middleware(request: Request, call_next):
+    """
+    Traces a sampled share of requests; a traced response carries its own
+    `traceparent` so the trace can be looked up.
+
+    An incoming W3C `traceparent` continues the caller's trace and its
+    sampling decision only from the app tracer's `trusted_clients` (e.g. a
+    gateway or another internal service). From anyone else it is ignored, so
+    a client can't make every request it sends write spans.
+
+    Makes the app's tracer (`app.state.tracer`) the one new traces started
+    while handling the request go to, including background syncs and live
+    meet polls it starts.
+    """
+    app_tracer = request.app.state.tracer
+    active = _active.set(app_tracer)
+    try:
+        if not app_tracer.enabled:
+            return await call_next(request)
+        return await _traced_request(app_tracer, request, call_next)
+    finally:
+        _active.reset(active)
+
+async def _traced_request(app_tracer: Tracer, request: Request, call_next):
+    trace_id, parent_id, sampled = _parent(request)
+    span = app_tracer.start(
+        f"{request.method} {request.url.path}", root=True, sampled=sampled, trace_id=trace_id, parent_id=parent_id,
+        **{"http.method": request.method, "http.target": request.url.path}
+    )
+    if span is None:
+        return await call_next(request)
+
+    try:
+        response = await call_next(request)
+    except BaseException as e:
+        app_tracer.end(span, e)
+        raise
+
+    route = getattr(request.scope.get("route"), "path", None)
+    if route:
+        span.name = f"{request.method} {route}"
+        span.attributes["http.route"] = route
+    span.attributes["http.status_code"] = response.status_code
+    if response.status_code >= 500:
+        span.error = f"status {response.status_code}"
+    response.headers["traceparent"] = f"00-{span.trace_id}-{span.span_id}-01"
+    # Streamed bodies (server-sent events) aren't included, only the handler
+    app_tracer.end(span)
+    return response